@@ -1,44 +1,426 @@
-def to_anki_cards(key_words: list[tuple], lemma_container):
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+from ComprehensibleLatvian.cloze import ClozeMatcher
+from ComprehensibleLatvian.instrumentation import stage
+
+logger = logging.getLogger("lvLogger")
+
+# the cloze note type of the decks, a fixed id so every deck shares one note type in Anki
+MODEL_ID = 1718093201234
+MODEL_FIELDS = ("Text", "Header", "Back Extra")
+
+# legacy (schema 11) Anki collection, what every Anki version can import
+_SCHEMA = """
+CREATE TABLE col (
+    id integer PRIMARY KEY, crt integer NOT NULL, mod integer NOT NULL, scm integer NOT NULL,
+    ver integer NOT NULL, dty integer NOT NULL, usn integer NOT NULL, ls integer NOT NULL,
+    conf text NOT NULL, models text NOT NULL, decks text NOT NULL, dconf text NOT NULL, tags text NOT NULL
+);
+CREATE TABLE notes (
+    id integer PRIMARY KEY, guid text NOT NULL, mid integer NOT NULL, mod integer NOT NULL,
+    usn integer NOT NULL, tags text NOT NULL, flds text NOT NULL, sfld integer NOT NULL,
+    csum integer NOT NULL, flags integer NOT NULL, data text NOT NULL
+);
+CREATE TABLE cards (
+    id integer PRIMARY KEY, nid integer NOT NULL, did integer NOT NULL, ord integer NOT NULL,
+    mod integer NOT NULL, usn integer NOT NULL, type integer NOT NULL, queue integer NOT NULL,
+    due integer NOT NULL, ivl integer NOT NULL, factor integer NOT NULL, reps integer NOT NULL,
+    lapses integer NOT NULL, left integer NOT NULL, odue integer NOT NULL, odid integer NOT NULL,
+    flags integer NOT NULL, data text NOT NULL
+);
+CREATE TABLE revlog (
+    id integer PRIMARY KEY, cid integer NOT NULL, usn integer NOT NULL, ease integer NOT NULL,
+    ivl integer NOT NULL, lastIvl integer NOT NULL, factor integer NOT NULL, time integer NOT NULL,
+    type integer NOT NULL
+);
+CREATE TABLE graves (usn integer NOT NULL, oid integer NOT NULL, type integer NOT NULL);
+"""
+# made after the cards are inserted, building an index once is faster than updating it on every insert
+_INDEXES = """
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+_HTML_TAG = re.compile(r"<[^>]*>")
+# the number of each cloze in a note's text, Anki makes a card of each
+_CLOZE_NUMBER = re.compile(r"\{\{c(\d+)::")
+
+
+def card_matcher(key_words, lemma_container) -> ClozeMatcher:
+    """
+    Compiles the card forms of many key words into one ClozeMatcher, e.g. every key word of a book.
+
+    Args:
+        key_words (Iterable[tuple]): Tuples of key word and translation.
+        lemma_container (LemmaContainer): LemmaContainer object containing lemma information.
+
+    Returns:
+        ClozeMatcher: Matcher of the form each key word's card clozes, pass it to to_anki_cards.
+    """
+    forms = set()
+    for kw, _ in key_words:
+        example = lemma_container.card_example(kw)
+        if example is not None:
+            forms.add(example[0])
+    return ClozeMatcher(forms)
+
+
+def to_anki_cards(
+    key_words: list[tuple], lemma_container, max_clozes: int = 1, matcher: ClozeMatcher = None
+):
     """
     Converts key words and their translations into a dict ready to be consumed to Anki Cloze card format.
 
     Args:
         key_words (list[tuple]): List of tuples containing key words and their translations.
         lemma_container (LemmaContainer): LemmaContainer object containing lemma information.
+        max_clozes (int, optional): Number of clozes per card. Over 1 the other key words in a card's example
+            sentence become clozes c2, c3... too, each one a card in Anki. Defaults to 1.
+        matcher (ClozeMatcher, optional): Matcher of at least the key words' card forms, see card_matcher.
+            Defaults to compiling one for key_words.
 
     Returns:
         list[dict]: List of dictionaries representing Anki cards.
 
     Note:
         To limit the number of cards that can be produced cards are only the most frequent word form is selected and the shortest example sentence for each key word.
-        Anki cards are represented as dictionaries with "header," "cloze_string," and "backside" (currently unused) keys.
+        Anki cards are represented as dictionaries with "header," "cloze_string," and "backside" keys, the
+        backside lists the other key words clozed in the sentence.
+        The forms of every key word are found in the example sentences in one pass each with a ClozeMatcher,
+        only whole words are clozed, a key word whose form is only part of a word in its example sentence gets
+        no card. Pass a matcher made with card_matcher to cloze the key words of many pages
+        in each sentence, e.g. with max_clozes, a matcher pays off as the number of forms grows.
     """
 
     # for every keyword we want
     # one form with one example sentence.
-    # to find the form, select the form that has the most example sentences
-    # select the sentence by shortest length
+    # the form is the one that has the most example sentences
+    # the sentence is the shortest one, both are kept up to date by the lemma container
 
     anki_cards = []
-    for kw, trans in key_words:
-        forms = lemma_container.get_lemma(kw).forms
-        if len(forms[kw]) == 0:
-            continue
-
-        # get the form that has the most example sentences
-        form_most_sentences = max(forms, key=lambda k: len(forms[k]))
-        shortest_example_sentence = min(forms[form_most_sentences], key=len)
-
-        anki_header = f"{'_' if kw == form_most_sentences else kw } ({trans})"
-        anki_string = shortest_example_sentence.text.replace(
-            form_most_sentences, f"{{{{c1::{form_most_sentences}}}}}"
-        )
-        anki_extra = ""
-
-        card = {
-            "header": anki_header,
-            "cloze_string": anki_string,
-            "backside": anki_extra,
-        }
-        anki_cards.append(card)
+    with stage("anki_cards") as timed:
+        examples = []
+        for kw, trans in key_words:
+            example = lemma_container.card_example(kw)
+            if example is not None:
+                examples.append((kw, trans, *example))
+        if matcher is None:
+            matcher = ClozeMatcher(form for _, _, form, _ in examples)
+        # the key word and translation of each form, the first key word wins if two share a form
+        form_key_words = {}
+        for kw, trans, form, _ in examples:
+            form_key_words.setdefault(form.lower(), (kw, trans))
+
+        for kw, trans, form_most_sentences, shortest_example_sentence in examples:
+            text = shortest_example_sentence.text
+            matches = matcher.find(text)
+            numbers = {form_most_sentences.lower(): 1}
+            for _, _, form in matches:
+                if len(numbers) == max_clozes:
+                    break
+                # a book wide matcher also finds the forms of other pages' key words
+                if form not in numbers and form in form_key_words:
+                    numbers[form] = len(numbers) + 1
+
+            if not any(form == form_most_sentences.lower() for _, _, form in matches):
+                # the form is only part of a word in the sentence, e.g. split by the tokenizer
+                logger.debug(f"no card for {kw}, {form_most_sentences} isn't a whole word in {text!r}")
+                continue
+
+            anki_header = f"{'_' if kw == form_most_sentences else kw } ({trans})"
+            anki_string = matcher.cloze(text, numbers, matches)
+            anki_extra = ", ".join(
+                f"{form_key_words[form][0]} ({form_key_words[form][1]})"
+                for form in list(numbers)[1:]
+            )
+
+            card = {
+                "header": anki_header,
+                "cloze_string": anki_string,
+                "backside": anki_extra,
+            }
+            anki_cards.append(card)
+        timed.add(items=len(anki_cards))
     return anki_cards
+
+
+def make_deck_id(book_id: str) -> int:
+    """
+    Creates the Anki deck id of a book.
+
+    Args:
+        book_id (str): Something unique to the book, e.g. its path in the library.
+
+    Returns:
+        int: The deck id, the same for the same book_id so importing a book's deck again updates it.
+    """
+    return int(hashlib.sha256(book_id.encode("utf-8")).hexdigest()[:13], 16)
+
+
+def _note_guid(deck_id: int, card: dict) -> str:
+    # stable so a regenerated deck updates the notes already in Anki instead of duplicating them
+    key = f"{deck_id}\x1f{card['header']}\x1f{card['cloze_string']}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:20]
+
+
+def _field_checksum(field: str) -> int:
+    # Anki's duplicate check, the first 8 hex digits of the sha1 of the field without html
+    return int(hashlib.sha1(_HTML_TAG.sub("", field).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _model(now: int) -> dict:
+    template = "{{Header}}<br><br>{{cloze:Text}}"
+    return {
+        "id": MODEL_ID,
+        "name": "ComprehensibleLatvian Cloze",
+        "type": 1,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": 1,
+        "tmpls": [
+            {
+                "name": "Cloze",
+                "ord": 0,
+                "qfmt": template,
+                "afmt": template + "<br>{{Back Extra}}",
+                "bqfmt": "",
+                "bafmt": "",
+                "did": None,
+            }
+        ],
+        "flds": [
+            {"name": name, "ord": i, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+            for i, name in enumerate(MODEL_FIELDS)
+        ],
+        "css": ".card { font-family: arial; font-size: 20px; text-align: center; }\n"
+        ".cloze { font-weight: bold; color: blue; }",
+        "latexPre": "\\documentclass[12pt]{article}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "latexsvg": False,
+        "req": [[0, "any", [0]]],
+        "tags": [],
+        "vers": [],
+    }
+
+
+def _deck(deck_id: int, name: str, now: int) -> dict:
+    return {
+        "id": deck_id,
+        "name": name,
+        "mod": now,
+        "usn": -1,
+        "desc": "",
+        "dyn": 0,
+        "conf": 1,
+        "collapsed": False,
+        "browserCollapsed": False,
+        "extendNew": 0,
+        "extendRev": 0,
+        "newToday": [0, 0],
+        "revToday": [0, 0],
+        "lrnToday": [0, 0],
+        "timeToday": [0, 0],
+    }
+
+
+_DECK_CONFIG = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "dyn": False,
+    "maxTaken": 60,
+    "timer": 0,
+    "autoplay": True,
+    "replayq": True,
+    "new": {"bury": False, "delays": [1, 10], "initialFactor": 2500, "ints": [1, 4, 0], "order": 1, "perDay": 20},
+    "lapse": {"delays": [10], "leechAction": 1, "leechFails": 8, "minInt": 1, "mult": 0},
+    "rev": {"bury": False, "ease4": 1.3, "ivlFct": 1, "maxIvl": 36500, "perDay": 200, "hardFactor": 1.2},
+}
+
+
+def _write_collection(connection: sqlite3.Connection, decks, batch_size: int) -> int:
+    now = int(time.time())
+    # note and card ids are millisecond timestamps in Anki, counted up from now so they are unique
+    next_id = itertools.count(int(time.time() * 1000))
+    deck_names = {1: _deck(1, "Default", now)}
+    seen_guids = set()
+    position = 0
+
+    connection.executescript(_SCHEMA)
+    # every insert in one transaction
+    connection.execute("BEGIN")
+    for deck in decks:
+        deck_id = deck["deck_id"]
+        deck_names[deck_id] = _deck(deck_id, deck["name"], now)
+        cards = iter(deck["anki_cards"])
+        while batch := list(itertools.islice(cards, batch_size)):
+            notes, note_cards = [], []
+            for card in batch:
+                guid = _note_guid(deck_id, card)
+                if guid in seen_guids:
+                    continue
+                seen_guids.add(guid)
+                fields = (card["cloze_string"], card["header"], card["backside"])
+                note_id = next(next_id)
+                notes.append(
+                    (note_id, guid, MODEL_ID, now, -1, "", "\x1f".join(fields), fields[0], _field_checksum(fields[0]), 0, "")
+                )
+                # a card per cloze number, card ord is the number - 1, new cards are shown in book order
+                for number in sorted({int(n) for n in _CLOZE_NUMBER.findall(fields[0])}):
+                    note_cards.append(
+                        (next(next_id), note_id, deck_id, number - 1, now, -1, 0, 0, position, 0, 0, 0, 0, 0, 0, 0, 0, "")
+                    )
+                position += 1
+            connection.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", notes)
+            connection.executemany(
+                "INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", note_cards
+            )
+
+    conf = {
+        "activeDecks": [1],
+        "curDeck": 1,
+        "newSpread": 0,
+        "collapseTime": 1200,
+        "timeLim": 0,
+        "estTimes": True,
+        "dueCounts": True,
+        "curModel": MODEL_ID,
+        "nextPos": position,
+        "sortType": "noteFld",
+        "sortBackwards": False,
+        "addToCur": True,
+    }
+    connection.execute(
+        "INSERT INTO col VALUES (1,?,?,?,11,0,0,0,?,?,?,?,?)",
+        (
+            now,
+            now * 1000,
+            now * 1000,
+            json.dumps(conf),
+            json.dumps({str(MODEL_ID): _model(now)}),
+            json.dumps({str(deck_id): deck for deck_id, deck in deck_names.items()}, ensure_ascii=False),
+            json.dumps({"1": _DECK_CONFIG}),
+            "{}",
+        ),
+    )
+    connection.execute("COMMIT")
+    connection.executescript(_INDEXES)
+    return position
+
+
+def write_apkg(path: str, decks, batch_size: int = 1000) -> int:
+    """
+    Writes Anki cards straight into an Anki package (.apkg) that can be imported into Anki.
+
+    Args:
+        path (str): Path of the package.
+        decks (Iterable[dict]): The decks, dictionaries of deck_id (see make_deck_id), name and anki_cards, the
+            cards of to_anki_cards. anki_cards can be any iterable, e.g. a generator over the pages of a book.
+        batch_size (int, optional): Number of cards inserted at once. Defaults to 1000.
+
+    Returns:
+        int: Number of notes written, each of the cards of to_anki_cards is a note with an Anki card per cloze.
+
+    Note:
+        The cards are streamed into the collection database in batches inside one transaction, only a batch
+        and the note guids are kept in memory. A card that is already in its deck is left out.
+        Notes get stable guids, importing a regenerated deck updates the cards already in Anki.
+        The package is written to a temp file and renamed so a failed run never leaves a partial package.
+
+    Example:
+        ```python
+        cards = (
+            card
+            for page in pages
+            for card in to_anki_cards(key_words=page.key_words, lemma_container=lemma_container)
+        )
+        write_apkg("book.apkg", [{"deck_id": make_deck_id(epub_file_path), "name": "Book", "anki_cards": cards}])
+        ```
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with stage("anki_package") as timed, tempfile.TemporaryDirectory(dir=directory) as work_dir:
+        collection_path = os.path.join(work_dir, "collection.anki2")
+        connection = sqlite3.connect(collection_path, isolation_level=None)
+        try:
+            # a scratch database, a crash just means writing it again
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            written = _write_collection(connection, decks, batch_size)
+        finally:
+            connection.close()
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            # the fastest level, the collection is hardly any bigger than at the default level
+            with os.fdopen(fd, "wb") as f, zipfile.ZipFile(
+                f, "w", zipfile.ZIP_DEFLATED, compresslevel=1
+            ) as package:
+                package.write(collection_path, "collection.anki2")
+                # no media files
+                package.writestr("media", "{}")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        timed.add(items=written)
+    return written
+
+
+def book_anki_cards(book):
+    """
+    Makes the Anki cards of a saved book page by page, without reading the whole book.
+
+    Args:
+        book (BookFile): A book opened with load_book.
+
+    Yields:
+        dict: The Anki cards of to_anki_cards.
+    """
+    for i in range(book.page_count):
+        yield from to_anki_cards(key_words=book.key_words(i), lemma_container=book)
+
+
+if __name__ == "__main__":
+    from ComprehensibleLatvian.book_file import load_book
+
+    parser = argparse.ArgumentParser(
+        description="Make one Anki package with a deck for each saved book."
+    )
+    parser.add_argument("apkg_path")
+    parser.add_argument("book_paths", nargs="+", help="books saved with save_book (.clvb)")
+    args = parser.parse_args()
+
+    books = [load_book(path) for path in args.book_paths]
+    try:
+        written = write_apkg(
+            args.apkg_path,
+            (
+                {
+                    "deck_id": book.meta.get("deck_id", make_deck_id(book.path)),
+                    "name": os.path.splitext(os.path.basename(book.path))[0],
+                    "anki_cards": book_anki_cards(book),
+                }
+                for book in books
+            ),
+        )
+    finally:
+        for book in books:
+            book.close()
+    print(f"{written} cards from {len(books)} books written to {args.apkg_path}")
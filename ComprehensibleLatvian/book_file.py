@@ -0,0 +1,488 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from ComprehensibleLatvian.page_objects import (
+    Lemma,
+    LemmaContainer,
+    Page,
+    Sentence,
+    WordForm,
+)
+from ComprehensibleLatvian.token_store import TokenStore
+
+# bump when the layout or contents of the sections change, older files are then refused
+# 2: sentences no longer include the page delimiter tokens
+# 3: the book's text is saved and sentences are spans of it
+FORMAT_VERSION = 3
+MAGIC = b"CLVBOOK\n"
+
+# magic, version, section count
+_HEADER = struct.Struct("<8sII")
+# section name, offset, length in bytes
+_SECTION = struct.Struct("<16sQQ")
+# marks a key word saved without a translation
+_NO_TRANSLATION = 0xFFFFFFFF
+
+_ID_SECTIONS = (
+    "form_ids",
+    "lemma_ids",
+    "token_starts",
+    "stop_word_ids",
+    "stop_word_starts",
+    "text_ids",
+    "text_spans",
+    "text_starts",
+    "string_starts",
+    "lemma_names",
+    "lemma_forms",
+    "lemma_best",
+    "form_names",
+    "form_shortest",
+    "form_sents",
+    "form_sent_ids",
+    "lemma_rows",
+    "page_numbers",
+    "page_slices",
+    "page_sents",
+    "page_rows",
+    "page_kws",
+    "page_kw_ids",
+    "page_trans_ids",
+)
+
+
+class _StringTable:
+    def __init__(self, data, starts):
+        # strings are decoded from the utf-8 data the first time they are used
+        self._data = data
+        self._starts = starts
+        self._decoded: list[str] = [None] * (len(starts) - 1)
+
+    def __len__(self):
+        return len(self._decoded)
+
+    def __getitem__(self, i: int) -> str:
+        string = self._decoded[i]
+        if string is None:
+            string = str(self._data[self._starts[i] : self._starts[i + 1]], "utf-8")
+            self._decoded[i] = string
+        return string
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _book_store(sentences) -> tuple[TokenStore, dict]:
+    # the store holding every sentence, a new merged store if they come from several
+    stores = {id(sentence.store): sentence.store for sentence in sentences}
+    if len(stores) == 1:
+        return next(iter(stores.values())), None
+    if not stores:
+        return TokenStore(), None
+
+    merged = TokenStore()
+    rows = {}
+    text_ids = {}
+    for sentence in sentences:
+        key = (id(sentence.store), sentence.index)
+        if key not in rows:
+            span = sentence.store.span(sentence.index)
+            if span is not None:
+                text_key = (id(sentence.store), span[0])
+                if text_key not in text_ids:
+                    text_ids[text_key] = merged.add_text(sentence.store.texts[span[0]])
+                span = (text_ids[text_key], span[1], span[2])
+            rows[key] = merged.add_tokens(
+                sentence.forms, sentence.lemmas, sentence.stop_words, span
+            )
+    return merged, rows
+
+
+def save_book(
+    path: str, pages: list[Page], lemma_container: LemmaContainer, meta: dict = None
+):
+    """
+    Saves a processed book, its sentences, lemma index and page key words, in a versioned binary file.
+
+    Args:
+        path (str): Path of the file to write.
+        pages (list[Page]): Pages of the book.
+        lemma_container (LemmaContainer): Lemma index of the book's sentences.
+        meta (dict, optional): JSON serialisable information saved with the book, e.g the EPUB path. Defaults to None.
+
+    Note:
+        Every string is saved once in a UTF-8 string table and everything else as little-endian uint32 columns
+        so load_book can memory map the file without parsing it. The texts the sentences are spans of are saved
+        whole in a second table.
+
+    Example:
+        ```python
+        save_book("book.clvb", pages, lemma_container, meta={"epub": epub_file_path})
+        ```
+    """
+    sentences = lemma_container.sentences + [
+        sentence for page in pages for sentence in page.sentences
+    ]
+    store, rows = _book_store(sentences)
+
+    def row(sentence: Sentence) -> int:
+        if rows is None:
+            return sentence.index
+        return rows[(id(sentence.store), sentence.index)]
+
+    # strings that aren't tokens are added after the store's strings so token ids stay valid
+    strings = list(store.strings)
+    string_ids = {string: i for i, string in enumerate(strings)}
+
+    def intern(string: str) -> int:
+        string_id = string_ids.get(string)
+        if string_id is None:
+            string_id = len(strings)
+            string_ids[string] = string_id
+            strings.append(string)
+        return string_id
+
+    sections = {
+        "form_ids": store.form_ids,
+        "lemma_ids": store.lemma_ids,
+        "token_starts": store.token_starts,
+        "stop_word_ids": store.stop_word_ids,
+        "stop_word_starts": store.stop_word_starts,
+        "text_ids": store.text_ids,
+        "text_spans": store.text_spans,
+    }
+    sections.update({name: array("I") for name in _ID_SECTIONS if name not in sections})
+
+    sections["lemma_rows"].extend(row(s) for s in lemma_container.sentences)
+    sections["lemma_forms"].append(0)
+    sections["form_sents"].append(0)
+    for lemma in lemma_container.lemmas.values():
+        sections["lemma_names"].append(intern(lemma.lemma))
+        for word_form in lemma.word_forms.values():
+            if word_form is lemma.best_form:
+                sections["lemma_best"].append(len(sections["form_names"]))
+            sections["form_names"].append(intern(word_form.form))
+            sections["form_shortest"].append(word_form.shortest_sentence_id)
+            sections["form_sent_ids"].extend(word_form.sentence_ids)
+            sections["form_sents"].append(len(sections["form_sent_ids"]))
+        sections["lemma_forms"].append(len(sections["form_names"]))
+
+    sections["page_sents"].append(0)
+    sections["page_kws"].append(0)
+    for page in pages:
+        sections["page_numbers"].append(intern(str(page.page_number)))
+        sections["page_slices"].extend(
+            [page.start_end_slice.start, page.start_end_slice.stop]
+        )
+        sections["page_rows"].extend(row(s) for s in page.sentences)
+        sections["page_sents"].append(len(sections["page_rows"]))
+
+        translated = len(page.translated_kws) == len(page._key_words)
+        for i, key_word in enumerate(page._key_words):
+            sections["page_kw_ids"].append(intern(key_word))
+            sections["page_trans_ids"].append(
+                intern(page.translated_kws[i]) if translated else _NO_TRANSLATION
+            )
+        sections["page_kws"].append(len(sections["page_kw_ids"]))
+
+    encoded = [string.encode("utf-8") for string in strings]
+    string_starts = sections["string_starts"]
+    string_starts.append(0)
+    for string in encoded:
+        string_starts.append(string_starts[-1] + len(string))
+
+    encoded_texts = [text.encode("utf-8") for text in store.texts]
+    text_starts = sections["text_starts"]
+    text_starts.append(0)
+    for text in encoded_texts:
+        text_starts.append(text_starts[-1] + len(text))
+
+    if sys.byteorder != "little":
+        for name, column in sections.items():
+            column = array("I", column)
+            column.byteswap()
+            sections[name] = column
+
+    sections["strings"] = b"".join(encoded)
+    sections["texts"] = b"".join(encoded_texts)
+    sections["meta"] = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+
+    # header and section table, then each section 8 byte aligned
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, data in sections.items():
+        offset += -offset % 8
+        size = memoryview(data).nbytes
+        table.append((name, offset, size))
+        offset += size
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+            for name, offset, size in table:
+                f.write(_SECTION.pack(name.encode("ascii"), offset, size))
+            for (name, offset, size), data in zip(table, sections.values()):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class BookFile:
+    def __init__(self, path: str, use_mmap: bool = True):
+        """
+        Opens a book saved with save_book.
+
+        Args:
+            path (str): Path of the saved book.
+            use_mmap (bool, optional): Memory map the file instead of reading it into memory. Defaults to True.
+
+        Attributes:
+            path (str): Path of the saved book.
+            meta (dict): Information saved with the book.
+            token_store (TokenStore): Store of the book's sentences, reading from the file.
+            page_count (int): Number of pages in the book.
+
+        Note:
+            Nothing is parsed when the book is opened, sentences, pages and strings are read from the file when used.
+            Use BookFile as a context manager or call close, objects read from it can't be used once it's closed.
+
+        Example:
+            ```python
+            with BookFile("book.clvb") as book:
+                cards = [
+                    card
+                    for i in range(book.page_count)
+                    for card in to_anki_cards(key_words=book.key_words(i), lemma_container=book)
+                ]
+            ```
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            if use_mmap:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = f.read()
+        self._view = memoryview(self._buffer)
+        self._views = [self._view]
+
+        if len(self._view) < _HEADER.size:
+            raise ValueError(f"{path} is not a saved book")
+        magic, version, section_count = _HEADER.unpack_from(self._view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a saved book")
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has book format version {version}, expected {FORMAT_VERSION}"
+            )
+
+        self._sections = {}
+        for i in range(section_count):
+            name, offset, size = _SECTION.unpack_from(
+                self._view, _HEADER.size + i * _SECTION.size
+            )
+            self._sections[name.rstrip(b"\0").decode("ascii")] = (offset, size)
+
+        self._columns = {name: self._column(name) for name in _ID_SECTIONS}
+        self.meta = json.loads(str(self._bytes("meta"), "utf-8"))
+        self._strings = _StringTable(self._bytes("strings"), self._columns["string_starts"])
+        # a text is decoded when a sentence in it is first used
+        texts = _StringTable(self._bytes("texts"), self._columns["text_starts"])
+
+        self.token_store = TokenStore.from_columns(
+            self._strings,
+            *(
+                self._columns[name]
+                for name in (
+                    "form_ids",
+                    "lemma_ids",
+                    "token_starts",
+                    "stop_word_ids",
+                    "stop_word_starts",
+                )
+            ),
+            texts=texts,
+            text_ids=self._columns["text_ids"],
+            text_spans=self._columns["text_spans"],
+        )
+        self.page_count = len(self._columns["page_numbers"])
+        self._lemma_index: dict[str, int] = None
+
+    def _bytes(self, name: str) -> memoryview:
+        offset, size = self._sections[name]
+        view = self._view[offset : offset + size]
+        self._views.append(view)
+        return view
+
+    def _column(self, name: str):
+        view = self._bytes(name)
+        if sys.byteorder != "little":
+            column = array("I")
+            column.frombytes(view)
+            column.byteswap()
+            return column
+        column = view.cast("I")
+        self._views.append(column)
+        return column
+
+    def sentence(self, row: int) -> Sentence:
+        """
+        Returns:
+            Sentence: The sentence at row of the token store.
+        """
+        return Sentence.from_store(self.token_store, row)
+
+    def page_number(self, i: int) -> str:
+        """
+        Returns:
+            str: The page number of the i-th page.
+        """
+        return self._strings[self._columns["page_numbers"][i]]
+
+    def key_words(self, i: int) -> list[tuple[str, str]]:
+        """
+        Returns the key words of a page, without reading its sentences.
+
+        Args:
+            i (int): Index of the page.
+
+        Returns:
+            list[tuple[str, str]]: List of tuples of key word and translation, empty if the page was saved untranslated.
+        """
+        strings = self._strings
+        start, end = self._columns["page_kws"][i], self._columns["page_kws"][i + 1]
+        translations = self._columns["page_trans_ids"][start:end]
+        if _NO_TRANSLATION in translations:
+            return []
+        return [
+            (strings[kw], strings[trans])
+            for kw, trans in zip(self._columns["page_kw_ids"][start:end], translations)
+        ]
+
+    def page(self, i: int) -> Page:
+        """
+        Rebuilds a Page object, key words are not extracted or translated again.
+
+        Args:
+            i (int): Index of the page.
+
+        Returns:
+            Page: The page.
+        """
+        columns = self._columns
+        rows = columns["page_rows"][columns["page_sents"][i] : columns["page_sents"][i + 1]]
+        start, end = columns["page_kws"][i], columns["page_kws"][i + 1]
+        page = Page(
+            page_number=self.page_number(i),
+            start_end_slice=slice(
+                columns["page_slices"][2 * i], columns["page_slices"][2 * i + 1]
+            ),
+            sentences=[self.sentence(row) for row in rows],
+            extracted_key_words=[self._strings[kw] for kw in columns["page_kw_ids"][start:end]],
+            translate=False,
+        )
+        key_words = self.key_words(i)
+        if key_words:
+            page.set_translations(dict(key_words))
+        return page
+
+    @property
+    def pages(self) -> list[Page]:
+        return [self.page(i) for i in range(self.page_count)]
+
+    def _lemma(self, lemma: str) -> int:
+        if self._lemma_index is None:
+            strings = self._strings
+            self._lemma_index = {
+                strings[name]: i for i, name in enumerate(self._columns["lemma_names"])
+            }
+        return self._lemma_index.get(lemma)
+
+    def card_example(self, key_word: str):
+        """
+        Retrieves the form and example sentence for the card of a key word, see LemmaContainer.card_example.
+
+        Args:
+            key_word (str): The key word, a lemma.
+
+        Returns:
+            tuple[str, Sentence]: The most frequent form of the lemma and the shortest sentence it occurs in,
+                None if the key word itself never occurs as a form of the lemma.
+        """
+        i = self._lemma(key_word)
+        if i is None:
+            return None
+        columns, strings = self._columns, self._strings
+        form_names = columns["form_names"][columns["lemma_forms"][i] : columns["lemma_forms"][i + 1]]
+        if not any(strings[form] == key_word for form in form_names):
+            return None
+        best = columns["lemma_best"][i]
+        row = columns["lemma_rows"][columns["form_shortest"][best]]
+        return strings[columns["form_names"][best]], self.sentence(row)
+
+    def to_lemma_container(self) -> LemmaContainer:
+        """
+        Reads the whole lemma index into a LemmaContainer, e.g to add the sentences of another book.
+
+        Returns:
+            LemmaContainer: The book's lemma index.
+        """
+        columns, strings = self._columns, self._strings
+        lemma_container = LemmaContainer()
+        lemma_container.sentences.extend(self.sentence(row) for row in columns["lemma_rows"])
+
+        form_sents, form_sent_ids = columns["form_sents"], columns["form_sent_ids"]
+        lemma_forms = columns["lemma_forms"]
+        for i, name in enumerate(columns["lemma_names"]):
+            lemma = Lemma(strings[name], lemma_container.sentences)
+            for rank, f in enumerate(range(lemma_forms[i], lemma_forms[i + 1])):
+                word_form = WordForm(strings[columns["form_names"][f]], rank)
+                word_form.sentence_ids = list(form_sent_ids[form_sents[f] : form_sents[f + 1]])
+                word_form.shortest_sentence_id = columns["form_shortest"][f]
+                word_form._shortest_len = len(
+                    lemma_container.sentences[word_form.shortest_sentence_id]
+                )
+                lemma.word_forms[word_form.form] = word_form
+                if f == columns["lemma_best"][i]:
+                    lemma.best_form = word_form
+            lemma_container.lemmas[lemma.lemma] = lemma
+        return lemma_container
+
+    def close(self):
+        """
+        Closes the file, sentences and pages read from the book can't be used afterwards.
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_book(path: str, use_mmap: bool = True) -> BookFile:
+    """
+    Opens a book saved with save_book, see BookFile.
+
+    Args:
+        path (str): Path of the saved book.
+        use_mmap (bool, optional): Memory map the file instead of reading it into memory. Defaults to True.
+
+    Returns:
+        BookFile: The opened book.
+    """
+    return BookFile(path, use_mmap=use_mmap)
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+
+def make_cache_key(text: str, steps: list[str]) -> str:
+    """
+    Creates a content addressed cache key for an NLP API request.
+
+    Args:
+        text (str): Input text sent to the NLP API.
+        steps (List[str]): NLP processing steps requested for the text.
+
+    Returns:
+        str: Hex sha256 digest of the text and steps.
+
+    Example:
+        ```python
+        key = make_cache_key("Sample text", ["tokenizer", "morpho", "ner"])
+        ```
+    """
+    payload = json.dumps({"steps": list(steps), "data": text}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024, max_entries=None):
+        """
+        Initializes an on disk cache of NLP API responses.
+
+        Args:
+            cache_dir (str, optional): Directory the responses are saved in. Defaults to ./nlp_cache in the working directory.
+            max_bytes (int, optional): Maximum total size of cached responses. Defaults to 512MB.
+            max_entries (int, optional): Maximum number of cached responses. Defaults to no limit.
+
+        Attributes:
+            cache_dir (str): Directory the responses are saved in.
+            max_bytes (int): Maximum total size of cached responses.
+            max_entries (int): Maximum number of cached responses.
+            hits (int): Number of lookups that found a cached response.
+            misses (int): Number of lookups that did not find a cached response.
+            evictions (int): Number of responses removed to stay within the limits.
+
+        Note:
+            Entries are evicted least recently used first. The access time of an entry is kept in the
+            file's mtime so the eviction order survives between runs.
+            Processes can share a cache_dir, responses saved by another process are found on a lookup.
+
+        Example:
+            ```python
+            cache = ResponseCache(max_bytes=100 * 1024 * 1024)
+            results = asyncio.run(request_nlp_api(extracted_text, cache=cache))
+            print(cache.stats())
+            ```
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.getcwd(), "nlp_cache")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> size in bytes, ordered from least to most recently used
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name[: -len(".json")], stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _found_on_disk(self, key: str) -> bool:
+        # picks up responses saved by other processes sharing the cache directory
+        try:
+            size = os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            return False
+        self._entries[key] = size
+        self._total_bytes += size
+        return True
+
+    def _path(self, key: str) -> str:
+        # shard on the first two characters so no single directory gets too large
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    @staticmethod
+    def key_for_post_body(post_body: dict) -> str:
+        """
+        Creates the cache key for a POST body made by make_nlp_post_body.
+
+        Args:
+            post_body (dict): Dictionary of url, headers and data.
+
+        Returns:
+            str: The cache key for the request.
+        """
+        data = json.loads(post_body["data"])
+        return make_cache_key(data["data"], data["steps"])
+
+    def get(self, key: str):
+        """
+        Retrieves a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict: The cached response, or None if the key is not cached.
+        """
+        if key not in self._entries and not self._found_on_disk(key):
+            self.misses += 1
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # removed by someone else or a partial file, treat as a miss
+            self._forget(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        os.utime(path)
+        return data
+
+    def set(self, key: str, data: dict) -> None:
+        """
+        Saves a response to the cache, evicting old entries if the cache is over its limits.
+
+        Args:
+            key (str): The cache key.
+            data (dict): The response to cache.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temp file and rename so readers never see a partial response
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self._forget(key)
+        size = os.path.getsize(path)
+        self._entries[key] = size
+        self._total_bytes += size
+
+        self._evict()
+
+    def invalidate(self, key: str) -> bool:
+        """
+        Removes a response from the cache.
+
+        Args:
+            key (str): The cache key, see make_cache_key.
+
+        Returns:
+            bool: True if the key was cached.
+        """
+        if key not in self._entries:
+            return False
+
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def clear(self) -> None:
+        """
+        Removes every response from the cache.
+        """
+        for key in list(self._entries):
+            self.invalidate(key)
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self) -> None:
+        while self._entries and (
+            self._total_bytes > self.max_bytes
+            or (self.max_entries is not None and len(self._entries) > self.max_entries)
+        ):
+            oldest_key = next(iter(self._entries))
+            self.invalidate(oldest_key)
+            self.evictions += 1
+
+    def responses(self):
+        """
+        Reads every cached response, e.g. to build a Lexicon.
+
+        Yields:
+            dict: Each cached response, in least to most recently used order.
+
+        Note:
+            Unlike get this doesn't count as a use, the eviction order and the hit counters are unchanged.
+        """
+        for key in list(self._entries):
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    yield json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+
+    def stats(self) -> dict:
+        """
+        Returns the hit, miss and size counters of the cache.
+
+        Returns:
+            dict: Dictionary of hits, misses, evictions, entries and bytes.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+        }
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
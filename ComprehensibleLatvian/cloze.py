@@ -0,0 +1,105 @@
+import re
+
+
+def _trie_pattern(words) -> str:
+    # a regular expression shaped like a trie of the words, so matching at a position walks one branch per
+    # character however many words there are, optional endings are greedy so the longest word is tried first
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def pattern(node: dict) -> str:
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        alternation = "(?:" + "|".join(branches) + ")"
+        return alternation + "?" if "" in node else alternation
+
+    return pattern(trie)
+
+
+class ClozeMatcher:
+    def __init__(self, forms):
+        """
+        Compiles word forms into one pattern that finds every one of them in a single pass over a text.
+
+        Args:
+            forms (Iterable[str]): The word forms, e.g. the card forms of a page's key words.
+
+        Attributes:
+            forms (frozenset[str]): The lowercase forms.
+
+        Note:
+            Only whole words match, a form inside a longer word doesn't, and case is ignored so a form at the start
+            of a sentence is found too. Where forms overlap the longest match wins.
+            The forms are compiled into a trie shaped regular expression, like an Aho-Corasick automaton the work
+            per character doesn't grow with the number of forms, and the matching runs in the re module.
+            Compiling takes far longer than a match, make one matcher for many texts.
+
+        Example:
+            ```python
+            matcher = ClozeMatcher(["suns", "kaķis"])
+            matcher.cloze("Suns dzenā kaķi.", {"suns": 1})  # "{{c1::Suns}} dzenā kaķi."
+            ```
+        """
+        self.forms = frozenset(form.lower() for form in forms if form)
+        self._pattern = None
+        self._ignore_case_pattern = None
+        if self.forms:
+            self._pattern = re.compile(r"\b" + _trie_pattern(self.forms) + r"\b")
+
+    def find(self, text: str) -> list[tuple[int, int, str]]:
+        """
+        Finds every form in a text.
+
+        Args:
+            text (str): The text, e.g. an example sentence.
+
+        Returns:
+            list[tuple[int, int, str]]: Start and end offset and the lowercase form of each match, in order.
+        """
+        if self._pattern is None:
+            return []
+        lower = text.lower()
+        if len(lower) == len(text):
+            # matching the lowercase text is much faster than ignoring case
+            return [(match.start(), match.end(), match.group()) for match in self._pattern.finditer(lower)]
+
+        # a character whose lowercase is longer, offsets into lower would be off
+        if self._ignore_case_pattern is None:
+            self._ignore_case_pattern = re.compile(self._pattern.pattern, re.IGNORECASE)
+        return [
+            (match.start(), match.end(), match.group().lower())
+            for match in self._ignore_case_pattern.finditer(text)
+        ]
+
+    def cloze(self, text: str, numbers: dict[str, int], matches=None) -> str:
+        """
+        Turns forms in a text into Anki clozes.
+
+        Args:
+            text (str): The text.
+            numbers (dict[str, int]): The cloze number of each lowercase form to hide, other forms are left as they are.
+            matches (list[tuple[int, int, str]], optional): The matches of find, if already made. Defaults to finding them.
+
+        Returns:
+            str: The text with every match of a form in numbers as {{cN::match}}, in the case it has in the text.
+        """
+        if matches is None:
+            matches = self.find(text)
+        parts = []
+        position = 0
+        for start, end, form in matches:
+            number = numbers.get(form)
+            if number is None:
+                continue
+            parts.append(text[position:start])
+            parts.append(f"{{{{c{number}::{text[start:end]}}}}}")
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
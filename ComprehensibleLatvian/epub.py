@@ -1,10 +1,29 @@
-import asyncio
-import json
-from itertools import islice
-
-import aiohttp
-from bs4 import BeautifulSoup
-from ebooklib import epub
+from __future__ import annotations
+
+import os
+import re
+import statistics
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import Executor
+from html import escape
+from html.entities import html5
+from html.parser import HTMLParser
+from itertools import islice, repeat
+from string import Template
+from typing import TYPE_CHECKING
+from urllib.parse import quote
+
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.instrumentation import stage, timed_iter
+from ComprehensibleLatvian.nlp_client import NLPBackend, NLPClient
+# make_nlp_post_body moved to nlp_client, still importable from here
+from ComprehensibleLatvian.nlp_client import make_nlp_post_body  # noqa: F401
+
+if TYPE_CHECKING:
+    # ebooklib and the lxml it imports are slow to load, imported where an EPUB is read or written
+    from ebooklib import epub
 
 
 def batched(iterable, n):
@@ -28,215 +47,840 @@ def batched(iterable, n):
         yield batch
 
 
-def extract_text_from_epub(epub_file_path, page_chunk_size=10) -> list[str]:
+# put between the pages of a chunk so the NLP API ends a sentence there, it isn't part of any page
+PAGE_SEPARATOR = "\n\n"
+
+
+class PageChunk(str):
+    def __new__(cls, text="", pages=()):
+        """
+        Creates the text of an NLP request along with where each page is in it.
+
+        Args:
+            text (str): The text sent to the NLP API.
+            pages (Iterable[tuple[str, int, int, bool]]): Page id, start and end character offset of each page in text,
+                and whether the page ends in this chunk, a page too large for one request is split over several.
+
+        Attributes:
+            pages (tuple[tuple[str, int, int, bool]]): The pages in text, in order.
+
+        Note:
+            A PageChunk is a str, so it can be sent and cached like any text. The page boundaries stay on the client
+            and are mapped onto the returned sentences by align_chunk_sentences, nothing is added to the text.
+        """
+        chunk = super().__new__(cls, text)
+        chunk.pages = tuple(pages)
+        return chunk
+
+
+def join_pages(pages) -> PageChunk:
     """
-    Extracts text from an EPUB file into chunks.
+    Joins pages into the text of one NLP request.
 
     Args:
-        epub_file_path (str): Path to the EPUB file.
-        page_chunk_size (int, optional): Number of pages in each chunk. Defaults to 10.
+        pages (Iterable[tuple[str, str, bool]]): Page id, text and whether the page ends in this chunk, in book order.
 
     Returns:
-        List[str]: List of text chunks.
+        PageChunk: The page texts joined by PAGE_SEPARATOR with the offsets of each page.
+    """
+    parts = []
+    spans = []
+    offset = 0
+    for page_id, page_text, ends_page in pages:
+        if parts:
+            parts.append(PAGE_SEPARATOR)
+            offset += len(PAGE_SEPARATOR)
+        parts.append(page_text)
+        spans.append((page_id, offset, offset + len(page_text), ends_page))
+        offset += len(page_text)
+    return PageChunk("".join(parts), spans)
+
+
+def chapter_page_id(item: epub.EpubHtml) -> str:
+    """
+    Creates the page id of a chapter.
 
-    Note:
-        This function extracts text content from EPUB pages, groups it into chunks, and adds page identifiers for context.
+    Args:
+        item (epub.EpubHtml): The chapter.
 
-    Example:
-        ```python
-        text_chunks = extract_text_from_epub("sample.epub", page_chunk_size=5)
-        print(text_chunks)
-        ```
+    Returns:
+        str: The item id without "_", page ids have always been made this way so saved pages keep their ids.
     """
-    book = epub.read_epub(epub_file_path)
-    page_chunks = []
-    ids = []
+    return item.get_id().replace("_", "")
 
-    for batch in batched(book.items, page_chunk_size):
-        chunk_text = ""
-        for item in batch:
-            if isinstance(item, epub.EpubHtml) and item.is_chapter():
-                content = item.get_content()
-                page_id: str = item.get_id().replace(
-                    "_", ""
-                )  # we split on _ later so dont want this in the id
-                ids.append(page_id)
-                soup = BeautifulSoup(content, "html.parser")
-                page_text = soup.get_text()
-                chunk_text += (
-                    "page_start_"
-                    + page_id
-                    + " "
-                    + page_text
-                    + "\n. "
-                    + "page_end_"
-                    + page_id
-                    + ". \n "
-                )
 
-        page_chunks.append(chunk_text)
-    return page_chunks
+def open_epub(epub_file) -> epub.EpubBook:
+    """
+    Reads an EPUB unless it has already been read.
 
+    Args:
+        epub_file (str | epub.EpubBook): Path to the EPUB file or the parsed EPUB.
 
-def make_nlp_post_body(text: str, steps: list[str] = ["tokenizer", "morpho", "ner"]):
+    Returns:
+        epub.EpubBook: The parsed EPUB.
+    """
+    from ebooklib import epub
+
+    if isinstance(epub_file, epub.EpubBook):
+        return epub_file
+    with stage("epub_read") as timed:
+        book = epub.read_epub(epub_file)
+        timed.add(items=len(book.items))
+    return book
+
+
+# tags whose strings BeautifulSoup's get_text leaves out, since beautifulsoup4 4.10
+_HIDDEN_STRING_TAGS = frozenset(["script", "style", "template", "rt", "rp"])
+# tags where BeautifulSoup keeps whitespace only strings as they are
+_PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+_ASCII_SPACES = frozenset("\x20\x0a\x09\x0c\x0d")
+# tags BeautifulSoup closes as soon as they open
+_VOID_TAGS = frozenset(
+    "area base br col embed hr img input keygen link menuitem meta param source track wbr "
+    "basefont bgsound command frame image isindex nextid spacer".split()
+)
+
+
+def _numeric_reference(number: int) -> str:
+    # html5 numeric character reference rules, as used by BeautifulSoup
+    if number == 0 or number > 0x10FFFF or 0xD800 <= number <= 0xDFFF:
+        return "\ufffd"
+    if 0x80 <= number <= 0x9F:
+        # references written with their windows-1252 byte
+        try:
+            return bytes([number]).decode("cp1252")
+        except UnicodeDecodeError:
+            pass
+    return chr(number)
+
+
+class _TextStripper(HTMLParser):
+    def __init__(self):
+        """
+        Initializes a _TextStripper object.
+
+        Note:
+            Streams html into the text BeautifulSoup(html, "html.parser").get_text() returns, without building a tree.
+            It uses the same tokenizer as BeautifulSoup and only keeps the stack of open tag names
+            to know which strings get_text leaves out and which whitespace it keeps.
+        """
+        super().__init__(convert_charrefs=False)
+        self.parts: list[str] = []
+        self._data: list[str] = []
+        self._open_tags: list[str] = []
+        # stack positions of the open hidden and whitespace preserving tags
+        self._hidden: list[int] = []
+        self._preserve: list[int] = []
+        # void tags closed at their start tag, a later end tag for them is ignored
+        self._already_closed: list[str] = []
+
+    def _end_data(self, keep=None):
+        # a string ends at every tag, comment or declaration
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        if not self._preserve and all(c in _ASCII_SPACES for c in data):
+            data = "\n" if "\n" in data else " "
+        if keep is None:
+            keep = not self._hidden
+        if keep:
+            self.parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        if tag in _VOID_TAGS:
+            self._already_closed.append(tag)
+            return
+        if tag in _HIDDEN_STRING_TAGS:
+            self._hidden.append(len(self._open_tags))
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self._preserve.append(len(self._open_tags))
+        self._open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._already_closed:
+            # doesn't end the current string either
+            self._already_closed.remove(tag)
+            return
+        self._end_data()
+        # close the most recent open tag of this name and everything opened after it, if there is one
+        for i in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[i] == tag:
+                del self._open_tags[i:]
+                while self._hidden and self._hidden[-1] >= i:
+                    self._hidden.pop()
+                while self._preserve and self._preserve[-1] >= i:
+                    self._preserve.pop()
+                break
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        base, digits = (16, name[1:]) if name[:1] in ("x", "X") else (10, name)
+        try:
+            self._data.append(_numeric_reference(int(digits, base)))
+            return
+        except ValueError:
+            pass
+        # a reference without its semicolon, the rest is text
+        match = (_HEX_DIGITS if base == 16 else _DIGITS).match(digits)
+        if match is None:
+            self._data.append(digits)
+            return
+        self._data.append(_numeric_reference(int(match.group(), base)))
+        self._data.append(digits[match.end() :])
+
+    def handle_entityref(self, name):
+        character = html5.get(name + ";")
+        self._data.append(character if character is not None else "&" + name)
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+        if data.upper().startswith("CDATA["):
+            # CDATA is kept even in hidden tags
+            self._data.append(data[len("CDATA[") :])
+            self._end_data(keep=True)
+
+    def close(self):
+        super().close()
+        self._end_data()
+
+
+_DIGITS = re.compile("[0-9]+")
+_HEX_DIGITS = re.compile("[0-9a-f]+")
+
+
+def _bs4_text(content) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    return soup.get_text()
+
+
+def _stream_text(content) -> str:
+    if isinstance(content, bytes):
+        from bs4 import UnicodeDammit
+
+        # decode the way BeautifulSoup does, from the xml declaration or meta charset
+        content = UnicodeDammit(content, is_html=True).unicode_markup
+    stripper = _TextStripper()
+    stripper.feed(content)
+    stripper.close()
+    return "".join(stripper.parts)
+
+
+# html to text engines, "stream" gives the same text as "bs4" without building a tree
+TEXT_ENGINES = {"bs4": _bs4_text, "stream": _stream_text}
+
+
+def html_to_text(content, engine="bs4") -> str:
     """
-    Creates a POST request body for the ailab NLP API.
+    Extracts the plain text of an html document.
 
     Args:
-        text (str): Input text to be processed.
-        steps (List[str], optional): NLP processing steps (tokenizer, morpho, parser, ner). Default is ["tokenizer", "morpho", "ner"].
+        content (bytes | str): The html.
+        engine (str, optional): "bs4" for BeautifulSoup or "stream" for a streaming tag stripper giving the same text. Defaults to "bs4".
 
     Returns:
-        dict: A dictionary of url, headers and data
+        str: The text with the html removed.
+    """
+    try:
+        text_engine = TEXT_ENGINES[engine]
+    except KeyError:
+        raise ValueError(
+            f"engine must be one of {', '.join(TEXT_ENGINES)}, not {engine!r}"
+        ) from None
+    return text_engine(content)
 
-    Example:
-        ```python
-        post_body = make_nlp_post_body("Sample text for NLP processing")
-        print(post_body)
-        ```
+
+def chapter_text(item: epub.EpubHtml, engine="bs4") -> str:
     """
+    Extracts the plain text of a chapter.
 
-    end_point = "https://nlp.ailab.lv/api/nlp"
-    headers = {"Content-Type": "application/json"}
+    Args:
+        item (epub.EpubHtml): The chapter.
+        engine (str, optional): Html to text engine, see html_to_text. Defaults to "bs4".
+
+    Returns:
+        str: The text of the chapter with the html removed.
+    """
+    return html_to_text(item.get_content(), engine)
+
+
+def _is_chapter(item) -> bool:
+    from ebooklib import epub
+
+    return isinstance(item, epub.EpubHtml) and item.is_chapter()
 
-    data = {
-        "steps": steps,
-        "data": text,
-    }
 
-    return {"url": end_point, "headers": headers, "data": json.dumps(data)}
+def _windowed_texts(contents, engine: str, executor: Executor, window: int):
+    # like executor.map but only window chapters are submitted ahead of the one being consumed, Executor.map
+    # would read and submit every chapter at once and hold every text until it is consumed
+    pending = deque()
+    try:
+        for content in contents:
+            if len(pending) == window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(html_to_text, content, engine))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
 
 
-async def fetch_data(post_body):
+def _chapter_texts(chapters: list, engine="bs4", executor: Executor = None):
+    # texts of the chapters in order, lazily, with an executor a few chapters ahead are extracted in parallel
+    contents = (item.get_content() for item in chapters)
+    if executor is None:
+        texts = map(html_to_text, contents, repeat(engine))
+    else:
+        texts = _windowed_texts(contents, engine, executor, 2 * (os.cpu_count() or 1))
+    return timed_iter("epub_extraction", texts)
+
+
+def iter_chapters(book: epub.EpubBook, engine="bs4", executor: Executor = None):
     """
-    Asynchronously fetches data from a specified endpoint using a POST request.
+    Extracts the text of every chapter in an EPUB.
 
     Args:
-        post_body (dict): Dictionary containing information for the POST request, including URL, headers, and data.
+        book (epub.EpubBook): The parsed EPUB.
+        engine (str, optional): Html to text engine, see html_to_text. Defaults to "bs4".
+        executor (Executor, optional): Process pool to extract the chapters in parallel. Defaults to None.
 
-    Returns:
-        dict: Data received from the API response.
+    Yields:
+        tuple[str, str]: The page id and text of each chapter in book order.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.post(**post_body) as response:
-            data = await response.json()
-            return data["data"]
+    chapters = [item for item in book.items if _is_chapter(item)]
+    texts = _chapter_texts(chapters, engine, executor)
+    for item, text in zip(chapters, texts):
+        yield chapter_page_id(item), text
 
 
-async def request_nlp_api(text_list: list[str]):
+def text_size(text: str, size_unit="chars") -> int:
     """
-    Asynchronously makes NLP API requests for a list of texts.
+    Measures text in characters or UTF-8 bytes.
 
     Args:
-        text_list (List[str]): List of texts to be processed by the NLP API.
+        text (str): The text to measure.
+        size_unit (str, optional): "chars" or "bytes". Defaults to "chars".
 
     Returns:
-        List[dict]: List of results received from the NLP API responses.
+        int: The size of the text.
     """
-    request_bodies = [make_nlp_post_body(text) for text in text_list]
-
-    tasks = [fetch_data(body) for body in request_bodies]
-    results = await asyncio.gather(*tasks)
-    return results
+    if size_unit == "chars":
+        return len(text)
+    if size_unit == "bytes":
+        return len(text.encode("utf-8"))
+    raise ValueError(f"size_unit must be 'chars' or 'bytes', not {size_unit!r}")
 
 
-def make_key_word_soup_tag(key_word: str, translation: str):
+def split_text(text: str, max_size: int, size_unit="chars") -> list[str]:
     """
-    Creates a BeautifulSoup tag for a key word and its translation.
+    Splits text into pieces no larger than max_size, preferring paragraph then sentence then word breaks.
 
     Args:
-        key_word (str): The key word.
-        translation (str): The translation of the key word.
+        text (str): The text to split.
+        max_size (int): Maximum size of each piece.
+        size_unit (str, optional): "chars" or "bytes". Defaults to "chars".
 
     Returns:
-        Tag: A BeautifulSoup tag representing the key word and its translation.
+        list[str]: Pieces that join back into text.
+    """
+    if max_size < 1:
+        raise ValueError("max_size must be at least one")
+
+    pieces = []
+    while text_size(text, size_unit) > max_size:
+        # binary search the largest prefix that fits, a character is at least one byte
+        low, high = 1, max_size
+        while low < high:
+            mid = (low + high + 1) // 2
+            if text_size(text[:mid], size_unit) <= max_size:
+                low = mid
+            else:
+                high = mid - 1
+        limit = low
+
+        cut = -1
+        for separator in ("\n", ". ", " "):
+            cut = text.rfind(separator, 0, limit)
+            if cut > 0:
+                cut += len(separator)
+                break
+        if cut <= 0:
+            cut = limit
+
+        pieces.append(text[:cut])
+        text = text[cut:]
+
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def pack_chunks(pages, max_chunk_size: int, size_unit="chars"):
+    """
+    Packs pages into chunks that fill up to a size budget.
+
+    Args:
+        pages (Iterable[tuple[str, str]]): The page id and text of each page in book order.
+        max_chunk_size (int): Maximum size of each chunk, including the separators between pages.
+        size_unit (str, optional): Whether max_chunk_size counts "chars" or UTF-8 "bytes". Defaults to "chars".
+
+    Yields:
+        PageChunk: Chunks of page text with the offsets of their pages.
+
+    Note:
+        Pages are never split unless a page is over the budget on its own, then it is split over several chunks
+        and only the chunk with its last piece ends the page.
 
     Example:
         ```python
-        key_word_tag = make_key_word_soup_tag("apple", "ābols")
-        print(key_word_tag)
+        book = epub.read_epub("sample.epub")
+        chunks = list(pack_chunks(iter_chapters(book), max_chunk_size=20000))
         ```
     """
+    separator_size = text_size(PAGE_SEPARATOR, size_unit)
+    chunk_pages = []
+    chunk_size = 0
+
+    for page_id, page_text in pages:
+        if text_size(page_text, size_unit) <= max_chunk_size:
+            pieces = [page_text]
+        else:
+            pieces = split_text(page_text, max_chunk_size, size_unit)
+
+        last = len(pieces) - 1
+        for i, piece in enumerate(pieces):
+            piece_size = text_size(piece, size_unit)
+            if chunk_pages and chunk_size + separator_size + piece_size > max_chunk_size:
+                yield join_pages(chunk_pages)
+                chunk_pages = []
+                chunk_size = 0
+            if chunk_pages:
+                chunk_size += separator_size
+            chunk_pages.append((page_id, piece, i == last))
+            chunk_size += piece_size
+
+    if chunk_pages:
+        yield join_pages(chunk_pages)
+
+
+def chunk_size_stats(chunks: list[str], size_unit="chars") -> dict:
+    """
+    Summarises how chunk sizes are distributed.
+
+    Args:
+        chunks (list[str]): Text chunks.
+        size_unit (str, optional): "chars" or "bytes". Defaults to "chars".
+
+    Returns:
+        dict: Dictionary of count, total, min, max, mean, median, stdev, p10 and p90 of the chunk sizes.
+    """
+    sizes = sorted(text_size(chunk, size_unit) for chunk in chunks)
+    if not sizes:
+        return {"count": 0, "total": 0}
+
+    def percentile(p):
+        return sizes[min(len(sizes) - 1, int(p * len(sizes)))]
+
+    return {
+        "count": len(sizes),
+        "total": sum(sizes),
+        "min": sizes[0],
+        "max": sizes[-1],
+        "mean": statistics.fmean(sizes),
+        "median": statistics.median(sizes),
+        "stdev": statistics.pstdev(sizes),
+        "p10": percentile(0.1),
+        "p90": percentile(0.9),
+    }
 
-    soup = BeautifulSoup("", "html.parser")
-    key_word_tag = soup.new_tag("div", attrs={"class": "paragraph"})
-    key_word_tag.string = "\n".join([key_word, translation])
 
-    return key_word_tag
+def iter_text_from_epub(
+    epub_file_path,
+    page_chunk_size=10,
+    max_chunk_size=None,
+    size_unit="chars",
+    engine="bs4",
+    executor: Executor = None,
+):
+    """
+    Lazily extracts text from an EPUB file into chunks.
 
+    Args:
+        epub_file_path (str | epub.EpubBook): Path to the EPUB file or the parsed EPUB.
+        page_chunk_size (int, optional): Number of pages in each chunk. Defaults to 10.
+        max_chunk_size (int, optional): If set chapters are packed into chunks of up to this size instead of by page_chunk_size. Defaults to None.
+        size_unit (str, optional): Whether max_chunk_size counts "chars" or UTF-8 "bytes". Defaults to "chars".
+        engine (str, optional): Html to text engine, see html_to_text. Defaults to "bs4".
+        executor (Executor, optional): Process pool to extract the chapters in parallel. Defaults to None.
 
-def init_new_epub(original_epub: epub.EpubBook) -> epub.EpubBook:
-    """Initalise new epub object by copying over contents from old book.
+    Yields:
+        PageChunk: Text chunks with the offsets of their pages, each chunk is only extracted once the previous one has been consumed, with an executor a few chapters ahead of it too.
+    """
+    book = open_epub(epub_file_path)
+
+    if max_chunk_size is not None:
+        yield from pack_chunks(
+            iter_chapters(book, engine=engine, executor=executor),
+            max_chunk_size,
+            size_unit,
+        )
+        return
+
+    texts = _chapter_texts(
+        [item for item in book.items if _is_chapter(item)], engine, executor
+    )
+    for batch in batched(book.items, page_chunk_size):
+        yield join_pages(
+            (chapter_page_id(item), next(texts), True)
+            for item in batch
+            if _is_chapter(item)
+        )
+
+
+def extract_text_from_epub(
+    epub_file_path,
+    page_chunk_size=10,
+    max_chunk_size=None,
+    size_unit="chars",
+    engine="bs4",
+    executor: Executor = None,
+) -> list[str]:
+    """
+    Extracts text from an EPUB file into chunks.
 
     Args:
-        original_epub:(epub.EpubBook): Original epub
+        epub_file_path (str | epub.EpubBook): Path to the EPUB file or the parsed EPUB.
+        page_chunk_size (int, optional): Number of pages in each chunk. Defaults to 10.
+        max_chunk_size (int, optional): If set chapters are packed into chunks of up to this size instead of by page_chunk_size. Defaults to None.
+        size_unit (str, optional): Whether max_chunk_size counts "chars" or UTF-8 "bytes". Defaults to "chars".
+        engine (str, optional): Html to text engine, "stream" gives the same text as "bs4" faster. Defaults to "bs4".
+        executor (Executor, optional): Process pool to extract the chapters in parallel. Defaults to None.
 
     Returns:
-        epub.EpubBook: EpubBook object with meta data copied over
+        List[PageChunk]: List of text chunks.
+
+    Note:
+        This function extracts text content from EPUB pages and groups it into chunks, each chunk knows where its pages are.
+        page_chunk_size counts every item in the EPUB (images, css...), max_chunk_size gives more evenly sized requests.
+        Use iter_text_from_epub to extract the chunks one at a time.
+
+    Example:
+        ```python
+        with ProcessPoolExecutor() as executor:
+            text_chunks = extract_text_from_epub("sample.epub", max_chunk_size=20000, engine="stream", executor=executor)
+        print(chunk_size_stats(text_chunks))
+        ```
+    """
+    return list(
+        iter_text_from_epub(
+            epub_file_path,
+            page_chunk_size=page_chunk_size,
+            max_chunk_size=max_chunk_size,
+            size_unit=size_unit,
+            engine=engine,
+            executor=executor,
+        )
+    )
+
+
+async def fetch_data(post_body, cache: ResponseCache = None):
     """
-    new_book = epub.EpubBook()
-    new_book.metadata = original_epub.metadata
-    new_book.toc = original_epub.toc
+    Asynchronously fetches data from a specified endpoint using a POST request.
+
+    Args:
+        post_body (dict): Dictionary containing information for the POST request, including URL, headers, and data.
+        cache (ResponseCache, optional): Cache checked before making the request. Defaults to None (no caching).
+
+    Returns:
+        dict: Data received from the API response.
 
-    cover_content = original_epub.items[0].get_content()
-    new_book.set_cover("cover.jpeg", content=cover_content)
-    return new_book
+    Note:
+        Opens a client for a single request, use NLPClient directly when making many requests.
+    """
+    async with NLPClient(max_concurrency=1, cache=cache) as client:
+        return await client.fetch(post_body)
 
 
-def construct_epub(epub_file_path: str, pages: list, save_path: str):
+async def request_nlp_api(
+    text_list: list[str], cache: ResponseCache = None, client: NLPBackend = None
+):
     """
-    Constructs a new EPUB file with additional pages containing key word tags.
+    Asynchronously makes NLP API requests for a list of texts.
 
     Args:
-        epub_file_path (str): Path to the original EPUB file.
-        pages (List[Page]): List of Page objects containing key words.
-        save_path (str): Path to save the new EPUB file.
+        text_list (List[str]): List of texts to be processed by the NLP API.
+        cache (ResponseCache, optional): Cache of previous responses, texts already in the cache are not sent. Defaults to None.
+        client (NLPBackend, optional): Backend to analyse the texts with, e.g. an NLPClient or a LocalNLPBackend. Defaults to a new NLPClient using cache.
 
     Returns:
-        None. Writes an epub to save_path
+        List[dict]: List of results received from the NLP API responses, in the same order as text_list.
+    """
+    if client is not None:
+        return await client.analyse_all(text_list)
+
+    async with NLPClient(cache=cache) as client:
+        return await client.analyse_all(text_list)
+
+
+# keyword pages are rendered straight to xhtml, the key words are the only part that changes
+_KEY_WORD_PAGE = Template(
+    """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" lang="lv" xml:lang="lv">
+  <head>
+    <title>$title</title>
+  </head>
+  <body>
+$key_words  </body>
+</html>
+"""
+)
+_KEY_WORD_DIV = '<div class="paragraph">{}\n{}</div>\n'
+
+_CONTAINER_XML = """<?xml version='1.0' encoding='utf-8'?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+"""
+_DC_NAMESPACE = "http://purl.org/dc/elements/1.1/"
+_OPF_NAMESPACE = "http://www.idpf.org/2007/opf"
+
+
+def render_key_word_page(title: str, key_words: list[tuple]) -> bytes:
     """
-    original_epub = epub.read_epub(epub_file_path)
-    new_book = init_new_epub(original_epub=original_epub)
+    Renders the xhtml of a keyword page.
 
-    new_spine = []
-    page_map = {page.page_number: page for page in pages}
+    Args:
+        title (str): Title of the page.
+        key_words (list[tuple]): Key words and their translations, most important first.
 
-    for item in original_epub.items[
-        1:
-    ]:  # assuming the first item is the cover - will see if this is valid
-        page_id = item.get_id()
+    Returns:
+        bytes: UTF-8 xhtml with a div of each key word and its translation.
+    """
+    divs = "".join(
+        _KEY_WORD_DIV.format(escape(key_word, quote=False), escape(trans, quote=False))
+        for key_word, trans in key_words
+    )
+    return _KEY_WORD_PAGE.substitute(title=escape(title), key_words=divs).encode(
+        "utf-8"
+    )
+
+
+def _quote_attribute(value: str) -> str:
+    # xml.sax.saxutils.quoteattr without importing it, it imports urllib.request
+    value = escape(value, quote=True)
+    return '"' + value.replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;") + '"'
+
+
+def _xml_attributes(attributes: dict) -> str:
+    parts = []
+    for name, value in attributes.items():
+        if name.startswith("{" + _OPF_NAMESPACE + "}"):
+            name = "opf:" + name[len(_OPF_NAMESPACE) + 2 :]
+        elif name.startswith("{"):
+            # attributes of other namespaces have no prefix declared
+            continue
+        parts.append(f" {name}={_quote_attribute(str(value))}")
+    return "".join(parts)
+
+
+def _opf_metadata(metadata: dict) -> str:
+    lines = []
+    for namespace, elements in metadata.items():
+        if namespace == _DC_NAMESPACE:
+            prefix = "dc:"
+        elif namespace == _OPF_NAMESPACE:
+            prefix = ""
+        else:
+            continue
+        for name, values in elements.items():
+            for value, attributes in values:
+                tag = prefix + name
+                attrs = _xml_attributes(attributes)
+                if value is None:
+                    lines.append(f"    <{tag}{attrs}/>")
+                else:
+                    lines.append(f"    <{tag}{attrs}>{escape(value, quote=False)}</{tag}>")
+    return "\n".join(lines)
+
+
+def _item_properties(item) -> list[str]:
+    from ebooklib import epub
+
+    properties = list(getattr(item, "properties", None) or [])
+    if isinstance(item, epub.EpubNav) and "nav" not in properties:
+        properties.append("nav")
+    if isinstance(item, epub.EpubCover) and "cover-image" not in properties:
+        properties.append("cover-image")
+    return properties
+
+
+def _package_document(book: epub.EpubBook, items: list, spine: list) -> bytes:
+    # items are (id, file name, media type, properties), spine is (id, linear)
+    version = book.version or "3.0"
+    manifest = []
+    for item_id, file_name, media_type, properties in items:
+        attrs = _xml_attributes(
+            {"href": quote(file_name, safe="/"), "id": item_id, "media-type": media_type}
+        )
+        if properties and version.startswith("3"):
+            attrs += _xml_attributes({"properties": " ".join(properties)})
+        manifest.append(f"    <item{attrs}/>")
+
+    itemrefs = []
+    for item_id, linear in spine:
+        linear = "" if linear in (None, True, "yes") else ' linear="no"'
+        itemrefs.append(f"    <itemref idref={_quote_attribute(item_id)}{linear}/>")
+
+    ncx = next(
+        (item_id for item_id, _, media_type, _ in items if media_type == "application/x-dtbncx+xml"),
+        None,
+    )
+    spine_attrs = _xml_attributes({"toc": ncx}) if ncx else ""
+
+    guide = [
+        f"    <reference{_xml_attributes({k: reference[k] for k in ('type', 'title', 'href') if reference.get(k)})}/>"
+        for reference in book.guide
+    ]
+
+    parts = [
+        "<?xml version='1.0' encoding='utf-8'?>",
+        f'<package xmlns="{_OPF_NAMESPACE}" unique-identifier={_quote_attribute(book.IDENTIFIER_ID)} version={_quote_attribute(version)}>',
+        f'  <metadata xmlns:dc="{_DC_NAMESPACE}" xmlns:opf="{_OPF_NAMESPACE}">',
+        _opf_metadata(book.metadata),
+        "  </metadata>",
+        "  <manifest>",
+        *manifest,
+        "  </manifest>",
+        f"  <spine{spine_attrs}>",
+        *itemrefs,
+        "  </spine>",
+    ]
+    if guide:
+        parts += ["  <guide>", *guide, "  </guide>"]
+    parts.append("</package>\n")
+    return "\n".join(parts).encode("utf-8")
+
+
+def _raw_content(item) -> bytes:
+    # the bytes read from the original EPUB, EpubHtml.get_content would parse and rebuild the chapter
+    content = item.content
+    if content is None:
+        return item.get_content()
+    if isinstance(content, str):
+        return content.encode("utf-8")
+    return content
+
+
+def write_key_word_epub(book: epub.EpubBook, pages: list, save_path: str):
+    """
+    Writes a copy of a parsed EPUB with a keyword page before every chapter that has key words.
 
-        if page_id in page_map:
-            soup = BeautifulSoup("<div></div>", "html.parser")
+    Args:
+        book (epub.EpubBook): The parsed original EPUB, e.g. the book the text was extracted from.
+        pages (List[Page]): List of Page objects containing key words.
+        save_path (str): Path to save the new EPUB file.
 
-            page = page_map[page_id]
+    Returns:
+        None. Writes an epub to save_path
+
+    Note:
+        The original items are copied byte for byte, only the package document and the keyword pages are made,
+        so writing is close to the cost of copying the file. Each item is compressed and written to the zip
+        as it is reached, the file is written to a temporary file and moved to save_path when complete.
+        Keyword pages aren't added to the table of contents.
+    """
+    with stage("construct_epub") as timed:
+        _write_key_word_epub(book, pages, save_path)
+        timed.add(items=len(pages))
 
-            key_word_tags = [make_key_word_soup_tag(*kw) for kw in page.key_words]
-            # reverse so we add the most important words at the top
-            for tag in reversed(key_word_tags):
-                soup.div.insert_before(tag)
 
-            key_word_page = epub.EpubHtml(
-                title=f"{page_id}_keywords",
-                file_name=f"{page_id}_keywords.xhtml",
-                lang="lv",
+def _write_key_word_epub(book: epub.EpubBook, pages: list, save_path: str):
+    page_map = {page.page_number: page for page in pages}
+    items = [item for item in book.items if item.file_name]
+    file_names = {item.file_name for item in items}
+    item_ids = {item.get_id(): item for item in items}
+
+    manifest = []
+    spine = []
+    key_word_pages = {}
+    for item in items:
+        manifest.append(
+            (item.get_id(), item.file_name, item.media_type, _item_properties(item))
+        )
+    for entry in book.spine:
+        item_id, linear = entry if isinstance(entry, tuple) else (entry.get_id(), "yes")
+        item = item_ids.get(item_id)
+        if item is not None and _is_chapter(item):
+            page = page_map.get(chapter_page_id(item))
+            if page is not None and page.key_words:
+                key_word_id = f"{chapter_page_id(item)}_keywords"
+                file_name = f"{key_word_id}.xhtml"
+                if key_word_id in item_ids or file_name in file_names:
+                    raise ValueError(f"{file_name} is already an item of the EPUB")
+                key_word_pages[file_name] = (key_word_id, page)
+                manifest.append((key_word_id, file_name, "application/xhtml+xml", []))
+                spine.append((key_word_id, linear))
+        spine.append((item_id, linear))
+
+    directory = os.path.dirname(os.path.abspath(save_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(
+            f, "w", zipfile.ZIP_DEFLATED
+        ) as out:
+            # the mimetype has to be the first entry and uncompressed
+            out.writestr(
+                "mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED
             )
-            key_word_page.content = soup.encode("utf-8")
-            new_book.add_item(key_word_page)
-            new_spine.append(key_word_page)
+            out.writestr("META-INF/container.xml", _CONTAINER_XML)
+            out.writestr("EPUB/content.opf", _package_document(book, manifest, spine))
+            for item in items:
+                out.writestr("EPUB/" + item.file_name, _raw_content(item))
+            for file_name, (key_word_id, page) in key_word_pages.items():
+                out.writestr(
+                    "EPUB/" + file_name, render_key_word_page(key_word_id, page.key_words)
+                )
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
 
-        # if isinstance(item, epub.EpubImage):
-        #     # might have to revisit this
-        #     # check if you need to add html <img src="path/img_file.jepg"/> somewhere
-        #     content = item.get_content()
-        #     id = item.get_id()
-        #     media_type = item.media_type
-        #     item = epub.EpubImage(uid=id, media_type=media_type, content=content)
 
-        new_book.add_item(item)
-        new_spine.append(item)
+def construct_epub(epub_file_path, pages: list, save_path: str):
+    """
+    Constructs a new EPUB file with additional pages containing key word tags.
+
+    Args:
+        epub_file_path (str | epub.EpubBook): Path to the original EPUB file, or the EPUB already parsed for extraction.
+        pages (List[Page]): List of Page objects containing key words.
+        save_path (str): Path to save the new EPUB file.
 
-    new_book.spine = new_spine
-    epub.write_epub(save_path, new_book)
+    Returns:
+        None. Writes an epub to save_path
 
+    Note:
+        Pass the EpubBook the text was extracted from to not read and parse the EPUB again, see write_key_word_epub.
+    """
+    write_key_word_epub(open_epub(epub_file_path), pages, save_path)
     return None
@@ -0,0 +1,412 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import Executor
+
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.epub import (
+    batched,
+    iter_chapters,
+    join_pages,
+    open_epub,
+    pack_chunks,
+    request_nlp_api,
+)
+from ComprehensibleLatvian.instrumentation import stage
+from ComprehensibleLatvian.nlp_client import NLPClient
+from ComprehensibleLatvian.page_objects import (
+    LemmaContainer,
+    Page,
+    PageAssembler,
+    Sentence,
+    StopwordStore,
+    _extract_key_words_recording,
+    join_lemma_text,
+    join_stop_words,
+    page_sentences_from_results,
+)
+from ComprehensibleLatvian.token_store import TokenStore
+
+logger = logging.getLogger("lvLogger")
+
+# version of the stored chapters, stores of an older version are emptied when opened
+CHAPTER_STORE_VERSION = 1
+
+
+def chapter_hash(text: str) -> str:
+    """
+    Creates the content hash of a chapter.
+
+    Args:
+        text (str): The text of the chapter.
+
+    Returns:
+        str: Hex sha256 digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChapterStore:
+    def __init__(self, path=None, timeout=5.0):
+        """
+        Initializes a persistent SQLite store of processed chapters.
+
+        Args:
+            path (str, optional): Path to the SQLite database. Defaults to ./chapters.sqlite3 in the working directory.
+            timeout (float, optional): Seconds to wait for another process's write to finish before raising. Defaults to 5.
+
+        Attributes:
+            path (str): Path to the SQLite database.
+
+        Note:
+            Each chapter is keyed by book and page id and saved with the hash of its text, its sentences
+            and its key words, along with the words YAKE looked up in the stop words to find them.
+
+        Example:
+            ```python
+            with ChapterStore() as chapter_store:
+                pages = asyncio.run(process_epub_incrementally("sample.epub", chapter_store))
+            ```
+        """
+        if path is None:
+            path = os.path.join(os.getcwd(), "chapters.sqlite3")
+        self.path = path
+
+        self._connection = sqlite3.connect(path, timeout=timeout)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chapters (
+                book TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                sentences TEXT NOT NULL,
+                key_words TEXT,
+                queries TEXT,
+                used TEXT,
+                no_key_words INTEGER,
+                PRIMARY KEY (book, page_id)
+            ) WITHOUT ROWID
+            """
+        )
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version < CHAPTER_STORE_VERSION:
+            # older sentences include the page delimiter tokens, the chapters are processed again
+            self._connection.execute("DELETE FROM chapters")
+            self._connection.execute(f"PRAGMA user_version = {CHAPTER_STORE_VERSION}")
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        self._connection.close()
+
+    def get_book(self, book: str) -> dict[str, dict]:
+        """
+        Looks up every stored chapter of a book.
+
+        Args:
+            book (str): The book id.
+
+        Returns:
+            dict[str, dict]: Dictionary of hash, sentences, key_words, queries, used and no_key_words for each page id.
+                Each sentence is a list of its forms, lemmas and stop words, followed by its start and end offset
+                in the chapter's text when it has one.
+        """
+        rows = self._connection.execute(
+            "SELECT page_id, hash, sentences, key_words, queries, used, no_key_words "
+            "FROM chapters WHERE book = ?",
+            (book,),
+        )
+        chapters = {}
+        for page_id, hash_, sentences, key_words, queries, used, no_key_words in rows:
+            chapters[page_id] = {
+                "hash": hash_,
+                "sentences": json.loads(sentences),
+                "key_words": json.loads(key_words) if key_words else None,
+                "queries": json.loads(queries) if queries else None,
+                "used": frozenset(json.loads(used)) if used else None,
+                "no_key_words": no_key_words,
+            }
+        return chapters
+
+    def set_chapters(self, book: str, chapters: dict[str, dict]) -> None:
+        """
+        Saves many chapters of a book in one transaction.
+
+        Args:
+            book (str): The book id.
+            chapters (dict[str, dict]): Dictionary in the format returned by get_book for each page id.
+        """
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        book,
+                        page_id,
+                        chapter["hash"],
+                        json.dumps(chapter["sentences"], ensure_ascii=False),
+                        json.dumps(chapter["key_words"], ensure_ascii=False),
+                        json.dumps(sorted(chapter["queries"]), ensure_ascii=False),
+                        json.dumps(sorted(chapter["used"]), ensure_ascii=False),
+                        chapter["no_key_words"],
+                    )
+                    for page_id, chapter in chapters.items()
+                ],
+            )
+
+    def remove_other_chapters(self, book: str, page_ids) -> None:
+        """
+        Removes the chapters of a book that are no longer in it.
+
+        Args:
+            book (str): The book id.
+            page_ids (Iterable[str]): Page ids of the chapters to keep.
+        """
+        keep = set(page_ids)
+        stored = [
+            page_id
+            for (page_id,) in self._connection.execute(
+                "SELECT page_id FROM chapters WHERE book = ?", (book,)
+            )
+            if page_id not in keep
+        ]
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM chapters WHERE book = ? AND page_id = ?",
+                [(book, page_id) for page_id in stored],
+            )
+
+
+def _chapter_chunks(chapters, page_chunk_size=10, max_chunk_size=None, size_unit="chars"):
+    # the same chunks iter_text_from_epub makes, for only some of the chapters
+    if max_chunk_size is not None:
+        return list(pack_chunks(chapters, max_chunk_size, size_unit))
+    return [
+        join_pages((page_id, text, True) for page_id, text in batch)
+        for batch in batched(chapters, page_chunk_size)
+    ]
+
+
+def split_chapter_sentences(chunks: list, results: list[dict]) -> dict[str, list]:
+    """
+    Splits the sentences returned by the NLP API into the chapters they belong to.
+
+    Args:
+        chunks (list[PageChunk]): The chunks sent to the NLP API.
+        results (list[dict]): The result of each chunk.
+
+    Returns:
+        dict[str, list]: The sentences of each page id that ended in the chunks, each as a list of its forms,
+            lemmas and stop words, and its start and end offset in the chapter's text unless the chapter was
+            split over several chunks.
+    """
+    # where each page starts in its chunk, the store's text ids are the chunk indices
+    page_starts = {}
+    for chunk in chunks:
+        for chunk_page_id, start, _, _ in chunk.pages:
+            page_starts.setdefault(chunk_page_id, []).append(start)
+
+    chapters = {}
+    page_id, page_sentences = None, None
+    # parse into a throwaway store, the book's store gets the sentences in book order later
+    for chunk_page_id, sentences, ends_page in page_sentences_from_results(chunks, results):
+        if chunk_page_id != page_id:
+            page_id, page_sentences = chunk_page_id, []
+        starts = page_starts[page_id]
+        for s in sentences:
+            sentence = [s.forms, s.lemmas, sorted(s.stop_words)]
+            span = s.store.span(s.index)
+            if span is not None and len(starts) == 1:
+                sentence += [span[1] - starts[0], span[2] - starts[0]]
+            page_sentences.append(sentence)
+        if ends_page:
+            chapters[page_id] = page_sentences
+            page_id, page_sentences = None, None
+    return chapters
+
+
+async def process_epub_incrementally(
+    epub_file_path: str,
+    chapter_store: ChapterStore,
+    book_id: str = None,
+    page_chunk_size: int = 10,
+    max_chunk_size: int = None,
+    size_unit: str = "chars",
+    engine: str = "bs4",
+    executor: Executor = None,
+    client: NLPClient = None,
+    cache: ResponseCache = None,
+    lemma_container: LemmaContainer = None,
+    token_store: TokenStore = None,
+    stopword_store: StopwordStore = None,
+    no_key_words: int = 20,
+) -> list[Page]:
+    """
+    Makes the pages of an EPUB, only processing the chapters that changed since the last run.
+
+    Args:
+        epub_file_path (str | epub.EpubBook): Path to the EPUB file or the parsed EPUB.
+        chapter_store (ChapterStore): Store of the chapters processed in previous runs, updated with this run.
+        book_id (str, optional): Id the book's chapters are stored under. Defaults to the EPUB file name, needed when passing a parsed EPUB.
+        page_chunk_size (int, optional): Number of changed chapters in each NLP request. Defaults to 10.
+        max_chunk_size (int, optional): If set changed chapters are packed into requests of up to this size instead. Defaults to None.
+        size_unit (str, optional): Whether max_chunk_size counts "chars" or UTF-8 "bytes". Defaults to "chars".
+        engine (str, optional): Html to text engine, see html_to_text. Defaults to "bs4".
+        executor (Executor, optional): Process pool to extract the chapters' text in parallel. Defaults to None.
+        client (NLPClient, optional): Client to send the NLP requests with. Defaults to a new NLPClient using cache.
+        cache (ResponseCache, optional): Cache of previous NLP responses. Defaults to None.
+        lemma_container (LemmaContainer, optional): Container the sentences of every chapter are added to. Defaults to None.
+        token_store (TokenStore, optional): Store the tokens of the book's sentences are kept in. Defaults to a new TokenStore.
+        stopword_store (StopwordStore, optional): Book stopwords, updated page by page. Defaults to a new StopwordStore that doesn't load other books' stop words.
+        no_key_words (int, optional): Number of key words per page. Defaults to 20.
+
+    Returns:
+        list[Page]: List of untranslated Page objects, translate them with translate_pages and a TranslationCache
+            so only key words that weren't translated before are sent to the translator.
+
+    Note:
+        A chapter is only sent to the NLP API again if the hash of its text changed. Every page's key words depend
+        on the key words of the pages before it, so a stored page's key words are only reused if every word YAKE
+        looked up in the stop words is still in, or still not in, the stop words. The key words are the same as
+        a full run with the same stop words, a changed chapter only re-extracts the later pages it affects.
+        Stop words loaded from other files change every page's stop words, so to reuse the most pages keep
+        the stopword_store the same between runs.
+
+    Example:
+        ```python
+        with ChapterStore() as chapter_store, TranslationCache() as translation_cache:
+            pages = asyncio.run(process_epub_incrementally("sample.epub", chapter_store))
+            translate_pages(pages, cache=translation_cache)
+        ```
+    """
+    if book_id is None:
+        from ebooklib import epub
+
+        if isinstance(epub_file_path, epub.EpubBook):
+            raise ValueError("book_id is needed when passing a parsed EpubBook")
+        book_id = os.path.basename(epub_file_path)
+    if token_store is None:
+        token_store = TokenStore()
+    if stopword_store is None:
+        stopword_store = StopwordStore(load_all_in_dir=False)
+
+    book = await asyncio.to_thread(open_epub, epub_file_path)
+    chapters = await asyncio.to_thread(
+        lambda: list(iter_chapters(book, engine=engine, executor=executor))
+    )
+    stored = chapter_store.get_book(book_id)
+
+    hashes = {page_id: chapter_hash(text) for page_id, text in chapters}
+    changed = [
+        (page_id, text)
+        for page_id, text in chapters
+        if page_id not in stored or stored[page_id]["hash"] != hashes[page_id]
+    ]
+
+    new_sentences = {}
+    if changed:
+        chunks = _chapter_chunks(changed, page_chunk_size, max_chunk_size, size_unit)
+        results = await request_nlp_api(chunks, cache=cache, client=client)
+        new_sentences = split_chapter_sentences(chunks, results)
+
+    updated = {}
+    sentences = []
+    chapter_pages = []
+    with stage("sentence_construction") as timed:
+        for page_id, text in chapters:
+            if page_id in new_sentences:
+                chapter = {"hash": hashes[page_id], "sentences": new_sentences[page_id]}
+                chapter.update(key_words=None, queries=None, used=None, no_key_words=None)
+                updated[page_id] = chapter
+            elif page_id in stored and stored[page_id]["hash"] == hashes[page_id]:
+                chapter = stored[page_id]
+            else:
+                # the NLP API didn't return the chapter
+                continue
+            stored[page_id] = chapter
+            # the sentences' texts are slices of the chapter's text
+            text_id = token_store.add_text(text)
+            chapter_sentences = [
+                Sentence.from_store(
+                    token_store,
+                    token_store.add_tokens(
+                        forms, lemmas, stop_words, (text_id, *span) if span else None
+                    ),
+                )
+                for forms, lemmas, stop_words, *span in chapter["sentences"]
+            ]
+            sentences.extend(chapter_sentences)
+            chapter_pages.append((page_id, chapter_sentences, True))
+        timed.add(items=len(sentences))
+
+    if lemma_container is not None:
+        lemma_container.sentences_to_lemmas(sentences)
+
+    page_spans = PageAssembler(stopword_store=stopword_store).collect_page_spans(
+        chapter_pages
+    )
+
+    pages = []
+    extracted = 0
+    stopwords = set(stopword_store.all_stopwords())
+    for page_number, sentence_slice, page_sentences in page_spans:
+        lemma_text = join_lemma_text(page_sentences)
+        page_stop_words = join_stop_words(page_sentences)
+        stopwords |= page_stop_words
+
+        chapter = stored[page_number]
+        key_words = None
+        if chapter["key_words"] is not None and chapter["no_key_words"] == no_key_words:
+            needed = frozenset(q for q in chapter["queries"] if q in stopwords)
+            if needed == chapter["used"]:
+                key_words = chapter["key_words"]
+
+        if key_words is None:
+            key_words, queries = _extract_key_words_recording(
+                lemma_text, frozenset(stopwords), no_key_words
+            )
+            chapter.update(
+                key_words=key_words,
+                queries=queries,
+                used=frozenset(q for q in queries if q in stopwords),
+                no_key_words=no_key_words,
+            )
+            updated[page_number] = chapter
+            extracted += 1
+
+        # same updates to the book stop words as extract_key_words
+        stopwords.update(key_words)
+        stopword_store.update(page_stop_words)
+        stopword_store.update(key_words)
+        stopword_store.checkpoint()
+
+        pages.append(
+            Page(
+                page_number=page_number,
+                start_end_slice=sentence_slice,
+                sentences=page_sentences,
+                extracted_key_words=key_words,
+                translate=False,
+            )
+        )
+
+    chapter_store.set_chapters(book_id, updated)
+    chapter_store.remove_other_chapters(book_id, hashes)
+    stopword_store.flush()
+
+    logger.info(
+        f"{len(changed)} of {len(chapters)} chapters sent to the NLP API, "
+        f"key words of {extracted} of {len(pages)} pages extracted again"
+    )
+    return pages
@@ -0,0 +1,293 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is then only reported with trace_memory
+    resource = None
+
+# the instrumentation recording the current run, None when disabled
+_active = None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _StageStats:
+    __slots__ = (
+        "calls",
+        "wall_seconds",
+        "cpu_seconds",
+        "items",
+        "bytes_sent",
+        "bytes_received",
+        "peak_rss_bytes",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.items = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.peak_rss_bytes = None
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Stage:
+    __slots__ = ("_instrumentation", "_name", "_wall", "_cpu", "_items", "_sent", "_received")
+
+    def __init__(self, instrumentation, name: str):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._items = 0
+        self._sent = 0
+        self._received = 0
+
+    def add(self, items=0, bytes_sent=0, bytes_received=0) -> None:
+        """
+        Adds to the counts of the stage.
+
+        Args:
+            items (int, optional): Number of items processed. Defaults to 0.
+            bytes_sent (int, optional): Number of bytes sent. Defaults to 0.
+            bytes_received (int, optional): Number of bytes received. Defaults to 0.
+        """
+        self._items += items
+        self._sent += bytes_sent
+        self._received += bytes_received
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        self._instrumentation._record(
+            self._name, wall, cpu, self._items, self._sent, self._received
+        )
+
+
+class _NullStage:
+    # stands in for a stage when instrumentation is disabled
+    __slots__ = ()
+
+    def add(self, items=0, bytes_sent=0, bytes_received=0) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Instrumentation:
+    def __init__(self, trace_memory=False):
+        """
+        Initializes a recorder of the time, counts and memory of each stage of a run.
+
+        Args:
+            trace_memory (bool, optional): Whether to trace python allocations with tracemalloc for the peak traced memory, this slows the run down. Defaults to False.
+
+        Attributes:
+            stages (dict[str, _StageStats]): Totals of each stage by name.
+            counters (dict[str, int]): Named counters, e.g. cache hits.
+            trace_memory (bool): Whether python allocations are traced.
+
+        Note:
+            Stages are recorded while the instrumentation is used as a context manager. Outside of it stage() and
+            count() do nothing, so the instrumented code costs one global lookup per call.
+            Stages can nest and run concurrently, e.g. NLP requests, so their times can add up to more than the run.
+            CPU time is the process's, stages running in other processes (executors) are only timed where they are waited on.
+
+        Example:
+            ```python
+            with Instrumentation() as run:
+                pages = asyncio.run(process_epub_incrementally("sample.epub", chapter_store))
+            run.write_report("run_report.json")
+            ```
+        """
+        self.trace_memory = trace_memory
+        self.stages: dict[str, _StageStats] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._started = None
+        self._wall = None
+        self._cpu = None
+        self._wall_seconds = None
+        self._cpu_seconds = None
+        self._peak_traced_bytes = None
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        if self.trace_memory:
+            tracemalloc.start()
+        self._started = datetime.now().isoformat(timespec="seconds")
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _active
+        self._wall_seconds = time.perf_counter() - self._wall
+        self._cpu_seconds = time.process_time() - self._cpu
+        if self.trace_memory:
+            self._peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        _active = self._previous
+        self._previous = None
+
+    def stage(self, name: str) -> _Stage:
+        """
+        Times a stage, use as a context manager.
+
+        Args:
+            name (str): Name of the stage, calls with the same name are added up.
+
+        Returns:
+            _Stage: Context manager, call its add method to count items and bytes.
+        """
+        return _Stage(self, name)
+
+    def count(self, name: str, n=1) -> None:
+        """
+        Adds to a named counter.
+
+        Args:
+            name (str): Name of the counter.
+            n (int, optional): Amount to add. Defaults to 1.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _record(self, name, wall, cpu, items, sent, received):
+        peak = _peak_rss_bytes()
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = _StageStats()
+            stats.calls += 1
+            stats.wall_seconds += wall
+            stats.cpu_seconds += cpu
+            stats.items += items
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+            # the peak of the process when the stage last finished
+            stats.peak_rss_bytes = peak
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: Dictionary of started, wall_seconds, cpu_seconds, peak_rss_bytes, peak_traced_bytes,
+                stages (calls, wall_seconds, cpu_seconds, items, bytes_sent, bytes_received, peak_rss_bytes of each) and counters.
+        """
+        with self._lock:
+            return {
+                "started": self._started,
+                "wall_seconds": self._wall_seconds,
+                "cpu_seconds": self._cpu_seconds,
+                "peak_rss_bytes": _peak_rss_bytes(),
+                "peak_traced_bytes": self._peak_traced_bytes,
+                "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def write_report(self, path: str) -> None:
+        """
+        Writes the report as JSON.
+
+        Args:
+            path (str): Path of the JSON file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def stage(name: str):
+    """
+    Times a stage of the active instrumentation, use as a context manager.
+
+    Args:
+        name (str): Name of the stage.
+
+    Returns:
+        _Stage | _NullStage: The stage, or a stage that records nothing when instrumentation is disabled.
+
+    Example:
+        ```python
+        with stage("translation") as timed:
+            translations = translate_words(words)
+            timed.add(items=len(words))
+        ```
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
+
+
+def count(name: str, n=1) -> None:
+    """
+    Adds to a counter of the active instrumentation, does nothing when instrumentation is disabled.
+
+    Args:
+        name (str): Name of the counter.
+        n (int, optional): Amount to add. Defaults to 1.
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+
+def timed_iter(name: str, iterable):
+    """
+    Times a stage that produces its items lazily, each item counts towards the stage.
+
+    Args:
+        name (str): Name of the stage.
+        iterable (Iterable): The items, only the time spent getting each one is counted.
+
+    Returns:
+        Iterable: The items, the iterable itself when instrumentation is disabled.
+    """
+    if _active is None:
+        return iterable
+    return _timed_items(_active, name, iterable)
+
+
+def _timed_items(instrumentation, name, iterable):
+    iterator = iter(iterable)
+    while True:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        instrumentation._record(
+            name, time.perf_counter() - wall, time.process_time() - cpu, 1, 0, 0
+        )
+        yield item
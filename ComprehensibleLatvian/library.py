@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ComprehensibleLatvian.anki import make_deck_id, to_anki_cards, write_apkg
+from ComprehensibleLatvian.book_file import save_book
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.epub import construct_epub, open_epub
+from ComprehensibleLatvian.incremental import ChapterStore, process_epub_incrementally
+from ComprehensibleLatvian.instrumentation import Instrumentation
+from ComprehensibleLatvian.local_nlp import Lexicon, LocalNLPBackend
+from ComprehensibleLatvian.nlp_client import NLPClient
+from ComprehensibleLatvian.page_objects import (
+    LemmaContainer,
+    StopwordStore,
+    generate_stopwords_filename,
+)
+from ComprehensibleLatvian.translation import (
+    DictionaryBackend,
+    TranslationCache,
+    translate_pages,
+    translator_fn,
+)
+
+logger = logging.getLogger("lvLogger")
+
+# seconds a worker waits for another worker's write to a shared sqlite database
+_SHARED_DB_TIMEOUT = 120.0
+
+# slots of the NLP concurrency cap shared by every worker, set by _init_worker
+_request_slots = None
+# the lexicon of the worker's LocalNLPBackend, loaded by its first book
+_lexicon = None
+# the worker's DictionaryBackend, loaded by its first book
+_dictionary = None
+
+
+def find_epubs(library_dir: str, exclude_dir: str = None) -> list[str]:
+    """
+    Finds every EPUB under a directory, e.g. a Calibre library.
+
+    Args:
+        library_dir (str): Directory to search.
+        exclude_dir (str, optional): Directory to leave out, e.g. where the output EPUBs are written. Defaults to None.
+
+    Returns:
+        list[str]: Sorted paths of the EPUBs.
+    """
+    if exclude_dir is not None:
+        exclude_dir = os.path.abspath(exclude_dir)
+
+    found = []
+    for directory, sub_directories, files in os.walk(library_dir):
+        if exclude_dir is not None:
+            sub_directories[:] = [
+                d
+                for d in sub_directories
+                if os.path.abspath(os.path.join(directory, d)) != exclude_dir
+            ]
+        found.extend(
+            os.path.join(directory, file_name)
+            for file_name in files
+            if file_name.lower().endswith(".epub")
+        )
+    return sorted(found)
+
+
+def _output_names(epub_paths: list[str]) -> list[str]:
+    # the file name without extension, numbered when two books share one
+    names = []
+    seen = {}
+    for path in epub_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name} ({seen[name]})")
+    return names
+
+
+def _init_worker(request_slots):
+    global _request_slots
+    _request_slots = request_slots
+
+
+def _nlp_backend(options):
+    global _lexicon
+    if options["lexicon_path"] is None:
+        return NLPClient(
+            max_concurrency=options["nlp_concurrency"],
+            cache=ResponseCache(options["cache_dir"]),
+            request_slots=_request_slots,
+        )
+    if _lexicon is None:
+        _lexicon = Lexicon.load(options["lexicon_path"])
+    # the books are already spread over the processes, analyse in the worker
+    return LocalNLPBackend(_lexicon, max_workers=0)
+
+
+def _translator(options):
+    global _dictionary
+    if not options["translate"]:
+        # every key word gets an empty translation, so the cards are still made
+        return DictionaryBackend()
+    if options["dictionary_path"] is None:
+        return translator_fn
+    if _dictionary is None:
+        _dictionary = DictionaryBackend(options["dictionary_path"])
+    return _dictionary
+
+
+async def _book_pages(book, book_id, name, chapter_store, lemma_container, options):
+    async with _nlp_backend(options) as client:
+        pages = await process_epub_incrementally(
+            book,
+            chapter_store,
+            book_id=book_id,
+            page_chunk_size=options["page_chunk_size"],
+            engine="stream",
+            client=client,
+            lemma_container=lemma_container,
+            # a new stop words file each run like main.py, so reruns start from the same stop words
+            stopword_store=StopwordStore(
+                save_path=f"{name}_{generate_stopwords_filename()}",
+                load_all_in_dir=False,
+            ),
+        )
+        return pages, client.stats()
+
+
+def process_book(epub_file_path: str, book_id: str, name: str, options: dict) -> dict:
+    """
+    Processes one book of a library, saving its book file, Anki deck (.apkg) and optionally its keyword EPUB.
+
+    Args:
+        epub_file_path (str): Path to the EPUB file.
+        book_id (str): Id the book's chapters are stored under, its path in the library.
+        name (str): Name of the output files.
+        options (dict): Settings of the batch, see process_library.
+
+    Returns:
+        dict: Dictionary of path, name, pages, anki_cards, nlp_requests, nlp_coverage (None unless using a lexicon), seconds and the stages of the book's Instrumentation report.
+    """
+    start = time.perf_counter()
+    output_dir = options["output_dir"]
+    # stable per book so importing a book again updates its deck, and unique within a library
+    deck_id = make_deck_id(book_id)
+
+    with Instrumentation() as run:
+        book = open_epub(epub_file_path)
+        lemma_container = LemmaContainer()
+        with ChapterStore(
+            options["chapter_store_path"], timeout=_SHARED_DB_TIMEOUT
+        ) as chapter_store:
+            pages, nlp_stats = asyncio.run(
+                _book_pages(book, book_id, name, chapter_store, lemma_container, options)
+            )
+
+        translator = _translator(options)
+        if options["translate"]:
+            with TranslationCache(
+                options["translation_cache_path"], timeout=_SHARED_DB_TIMEOUT
+            ) as translation_cache:
+                translate_pages(pages, translator=translator, cache=translation_cache)
+        else:
+            translate_pages(pages, translator=translator)
+
+        save_book(
+            os.path.join(output_dir, name + ".clvb"),
+            pages,
+            lemma_container,
+            meta={"epub_file_path": epub_file_path, "deck_id": deck_id},
+        )
+
+        anki_cards = write_apkg(
+            os.path.join(output_dir, name + ".apkg"),
+            [
+                {
+                    "deck_id": deck_id,
+                    "name": name,
+                    "anki_cards": (
+                        card
+                        for page in pages
+                        for card in to_anki_cards(key_words=page.key_words, lemma_container=lemma_container)
+                    ),
+                }
+            ],
+        )
+
+        if options["write_epub"]:
+            construct_epub(book, pages, os.path.join(output_dir, name + ".epub"))
+
+    return {
+        "path": epub_file_path,
+        "name": name,
+        "pages": len(pages),
+        "anki_cards": anki_cards,
+        "nlp_requests": nlp_stats["requests"],
+        "nlp_coverage": nlp_stats.get("coverage"),
+        "seconds": time.perf_counter() - start,
+        "stages": run.report()["stages"],
+    }
+
+
+def process_library(
+    library_dir: str,
+    output_dir: str,
+    max_workers: int = None,
+    nlp_concurrency: int = 4,
+    page_chunk_size: int = 8,
+    cache_dir: str = None,
+    translation_cache_path: str = None,
+    chapter_store_path: str = None,
+    write_epub: bool = False,
+    lexicon_path: str = None,
+    dictionary_path: str = None,
+    translate: bool = True,
+) -> dict:
+    """
+    Processes every EPUB in a library, several books at once in a process pool.
+
+    Args:
+        library_dir (str): Directory searched for EPUBs, e.g. a Calibre library.
+        output_dir (str): Directory the book files, Anki decks, EPUBs and report are written to.
+        max_workers (int, optional): Number of books processed at once. Defaults to the number of CPUs.
+        nlp_concurrency (int, optional): Maximum number of NLP requests in flight across all the workers. Defaults to 4.
+        page_chunk_size (int, optional): Number of chapters in each NLP request. Defaults to 8.
+        cache_dir (str, optional): Directory of the NLP response cache shared by the workers. Defaults to ./nlp_cache.
+        translation_cache_path (str, optional): Path of the translation cache shared by the workers. Defaults to ./translations.sqlite3.
+        chapter_store_path (str, optional): Path of the chapter store shared by the workers. Defaults to ./chapters.sqlite3.
+        write_epub (bool, optional): Whether to also write each book as an EPUB with keyword pages. Defaults to False.
+        lexicon_path (str, optional): Path of a Lexicon to analyse the books offline with a LocalNLPBackend instead
+            of the NLP API, see local_nlp. Defaults to None.
+        dictionary_path (str, optional): Path of a dictionary file to translate the key words offline with a
+            DictionaryBackend instead of googletrans. Defaults to None.
+        translate (bool, optional): Whether to translate the key words, if False the cards are made with empty
+            translations and nothing is sent to a translator. Defaults to True.
+
+    Returns:
+        dict: The run report, also written to output_dir/library_report.json. Dictionary of books, succeeded,
+            failed, pages, anki_cards, nlp_requests, seconds, books_per_hour, failures and results.
+
+    Note:
+        A book that fails is logged and listed in the report's failures, the other books carry on.
+        Each book's chapters are stored under its path in the library so reruns only process what changed.
+
+    Example:
+        ```python
+        report = process_library(r"C:\\Users\\small\\Calibre Library", "decks", max_workers=4)
+        print(report["books_per_hour"], report["failures"])
+        ```
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    epub_paths = find_epubs(library_dir, exclude_dir=output_dir)
+    names = _output_names(epub_paths)
+    options = {
+        "output_dir": output_dir,
+        # each worker's client can use every slot, the shared semaphore keeps the total under the cap
+        "nlp_concurrency": nlp_concurrency,
+        "page_chunk_size": page_chunk_size,
+        "cache_dir": cache_dir,
+        "translation_cache_path": translation_cache_path,
+        "chapter_store_path": chapter_store_path,
+        "write_epub": write_epub,
+        "lexicon_path": lexicon_path,
+        "dictionary_path": dictionary_path,
+        "translate": translate,
+    }
+
+    start = time.perf_counter()
+    results = []
+    failures = []
+    context = multiprocessing.get_context()
+    request_slots = context.BoundedSemaphore(nlp_concurrency)
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(request_slots,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                process_book, path, os.path.relpath(path, library_dir), name, options
+            ): path
+            for path, name in zip(epub_paths, names)
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"failed to process {path}: {e!r}")
+                failures.append({"path": path, "error": repr(e)})
+                continue
+            logger.info(f"processed {path} in {result['seconds']:.1f}s")
+            results.append(result)
+
+    seconds = time.perf_counter() - start
+    report = {
+        "library_dir": library_dir,
+        "books": len(epub_paths),
+        "succeeded": len(results),
+        "failed": len(failures),
+        "pages": sum(result["pages"] for result in results),
+        "anki_cards": sum(result["anki_cards"] for result in results),
+        "nlp_requests": sum(result["nlp_requests"] for result in results),
+        "seconds": seconds,
+        "books_per_hour": len(results) / seconds * 3600 if seconds else 0.0,
+        "failures": failures,
+        "results": sorted(results, key=lambda result: result["path"]),
+    }
+    with open(
+        os.path.join(output_dir, "library_report.json"), "w", encoding="utf8"
+    ) as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+
+    parser = argparse.ArgumentParser(
+        description="Make Anki cards for every EPUB in a Calibre library."
+    )
+    parser.add_argument("library_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--nlp-concurrency", type=int, default=4)
+    parser.add_argument("--epub", action="store_true", help="also write keyword EPUBs")
+    parser.add_argument("--lexicon", default=None, help="analyse offline with this lexicon, see local_nlp")
+    parser.add_argument(
+        "--dictionary", default=None, help="translate offline with this dictionary file, see DictionaryBackend"
+    )
+    parser.add_argument("--no-translate", action="store_true", help="leave the key words untranslated")
+    args = parser.parse_args()
+
+    report = process_library(
+        args.library_dir,
+        args.output_dir,
+        max_workers=args.workers,
+        nlp_concurrency=args.nlp_concurrency,
+        write_epub=args.epub,
+        lexicon_path=args.lexicon,
+        dictionary_path=args.dictionary,
+        translate=not args.no_translate,
+    )
+    print(
+        f"{report['succeeded']} of {report['books']} books in {report['seconds']:.0f}s, "
+        f"{report['books_per_hour']:.1f} books/hour"
+    )
+    for failure in report["failures"]:
+        print(f"failed: {failure['path']} {failure['error']}")
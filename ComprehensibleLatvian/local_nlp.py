@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.instrumentation import count, stage
+from ComprehensibleLatvian.nlp_client import DEFAULT_STEPS, NLPBackend
+
+logger = logging.getLogger("lvLogger")
+
+LEXICON_VERSION = 1
+
+# a sentence ends after . ! ? or … unless the next word starts lowercase (an abbreviation), and at every line break
+_SENTENCE_END = re.compile(
+    r"(?<=[.!?…])[ \t]+(?=[^a-zāčēģīķļņšūž\s])|\s*\n\s*"
+)
+# a word, or a single punctuation character, like the NLP API's tokenizer
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# lexicon table of the process, set by _init_worker
+_worker_table = None
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Splits a text into sentences with regular expressions.
+
+    Args:
+        text (str): The text, e.g. a chunk of pages.
+
+    Returns:
+        list[str]: The non empty sentences in order.
+    """
+    return [sentence for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Args:
+        text (str): A sentence.
+
+    Returns:
+        list[str]: The forms of its words and punctuation.
+    """
+    return _TOKEN.findall(text)
+
+
+class Lexicon:
+    def __init__(self):
+        """
+        Initializes an empty form to lemma lexicon, built from the results of the NLP API.
+
+        Attributes:
+            forms (dict[str, dict[str, list]]): Lemma analyses of each form, lemma -> [count, other token fields].
+            entities (dict[str, dict[str, int]]): Label counts of each named entity text.
+
+        Note:
+            A form can have several lemmas, the most common one is used. The other fields of a token (pos, tag,
+            ufeats...) are the first seen with that lemma.
+
+        Example:
+            ```python
+            lexicon = Lexicon.from_cache(ResponseCache("nlp_cache"))
+            lexicon.save("lexicon.json")
+            ```
+        """
+        self.forms: dict[str, dict[str, list]] = {}
+        self.entities: dict[str, dict[str, int]] = {}
+
+    def add_result(self, result: dict) -> None:
+        """
+        Adds the tokens and named entities of an NLP API result.
+
+        Args:
+            result (dict): A result of request_nlp_api.
+        """
+        for sentence in result["sentences"]:
+            for token in sentence["tokens"]:
+                analyses = self.forms.setdefault(token["form"], {})
+                analysis = analyses.get(token["lemma"])
+                if analysis is None:
+                    fields = {
+                        key: value
+                        for key, value in token.items()
+                        if key not in ("index", "form")
+                    }
+                    analyses[token["lemma"]] = [1, fields]
+                else:
+                    analysis[0] += 1
+            for entity in sentence.get("ner", []):
+                labels = self.entities.setdefault(entity["text"], {})
+                label = entity.get("label")
+                labels[label] = labels.get(label, 0) + 1
+
+    @classmethod
+    def from_cache(cls, cache: ResponseCache) -> "Lexicon":
+        """
+        Builds a lexicon from every response in a cache.
+
+        Args:
+            cache (ResponseCache): Cache of NLP API responses.
+
+        Returns:
+            Lexicon: The lexicon.
+        """
+        lexicon = cls()
+        for result in cache.responses():
+            if isinstance(result, dict) and "sentences" in result:
+                lexicon.add_result(result)
+        return lexicon
+
+    def table(self) -> tuple[dict, dict]:
+        """
+        Returns:
+            tuple[dict, dict]: What analyse_text needs, the best analysis of each form and the named entities
+                indexed by their first token, longest first.
+        """
+        forms = {form: _best_analysis(analyses) for form, analyses in self.forms.items()}
+        entity_index = {}
+        for text, labels in self.entities.items():
+            words = tuple(tokenize(text))
+            if words:
+                label = max(labels, key=labels.get)
+                entity_index.setdefault(words[0], []).append((words, text, label))
+        for candidates in entity_index.values():
+            candidates.sort(key=lambda candidate: -len(candidate[0]))
+        return forms, entity_index
+
+    def save(self, path: str) -> None:
+        """
+        Saves the lexicon as JSON.
+
+        Args:
+            path (str): Path of the file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": LEXICON_VERSION, "forms": self.forms, "entities": self.entities},
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "Lexicon":
+        """
+        Loads a lexicon saved with save.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            Lexicon: The lexicon.
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != LEXICON_VERSION:
+            raise ValueError(f"{path} is not a version {LEXICON_VERSION} lexicon")
+        lexicon = cls()
+        lexicon.forms = data["forms"]
+        lexicon.entities = data["entities"]
+        return lexicon
+
+    def __len__(self):
+        return len(self.forms)
+
+
+def _best_analysis(analyses: dict) -> dict:
+    lemma, (_, fields) = max(analyses.items(), key=lambda item: item[1][0])
+    return {"lemma": lemma, **fields}
+
+
+def _unknown_lemma(form: str, first: bool) -> str:
+    # punctuation and, away from the start of a sentence, capitalised words (names) are their own lemma
+    if not form[0].isalnum() or (not first and form[0].isupper()):
+        return form
+    return form.lower()
+
+
+def _find_entities(forms: list[str], entity_index: dict) -> list[dict]:
+    ner = []
+    i = 0
+    while i < len(forms):
+        for words, text, label in entity_index.get(forms[i], ()):
+            if tuple(forms[i : i + len(words)]) == words:
+                ner.append({"text": text, "label": label, "start": i, "end": i + len(words)})
+                i += len(words)
+                break
+        else:
+            i += 1
+    return ner
+
+
+def analyse_text(text: str, table: tuple[dict, dict]) -> tuple[dict, int, int]:
+    """
+    Tokenizes, lemmatizes and tags the named entities of a text from a lexicon.
+
+    Args:
+        text (str): The text.
+        table (tuple[dict, dict]): Lexicon.table() of the lexicon.
+
+    Returns:
+        tuple[dict, int, int]: The result in the NLP API's format, the number of tokens found in the lexicon and
+            the number of tokens.
+
+    Note:
+        A form not in the lexicon is tried lowercased, and failing that is its own lemma, lowercased unless it
+        is capitalised in the middle of a sentence.
+    """
+    forms_table, entity_index = table
+    sentences = []
+    known = 0
+    tokens_seen = 0
+    for sentence_text in split_sentences(text):
+        forms = tokenize(sentence_text)
+        if not forms:
+            continue
+        tokens = []
+        for i, form in enumerate(forms):
+            analysis = forms_table.get(form)
+            if analysis is None:
+                analysis = forms_table.get(form.lower())
+            if analysis is None:
+                analysis = {"lemma": _unknown_lemma(form, i == 0)}
+            else:
+                known += 1
+            tokens.append({"index": i + 1, "form": form, **analysis})
+        tokens_seen += len(tokens)
+        sentences.append({"tokens": tokens, "ner": _find_entities(forms, entity_index)})
+    return {"sentences": sentences}, known, tokens_seen
+
+
+def _init_worker(table):
+    global _worker_table
+    _worker_table = table
+
+
+def _analyse_in_worker(text: str):
+    return analyse_text(text, _worker_table)
+
+
+class LocalNLPBackend(NLPBackend):
+    name = "local"
+
+    def __init__(self, lexicon: Lexicon, max_workers: int = None):
+        """
+        Initializes an offline NLP backend that tokenizes with regular expressions and lemmatizes from a lexicon.
+
+        Args:
+            lexicon (Lexicon): Lexicon built from earlier NLP API responses, see Lexicon.from_cache.
+            max_workers (int, optional): Number of processes analysing texts. 0 analyses in a thread of this
+                process, e.g. when already running in a worker process. Defaults to the number of CPUs.
+
+        Attributes:
+            texts (int): Number of texts analysed.
+            tokens (int): Number of tokens in them.
+            known_tokens (int): Number of those found in the lexicon.
+
+        Note:
+            Gives results in the same format as the NLP API so Sentence and the rest of the pipeline don't change,
+            but only as good as the lexicon: forms never seen by the API get a guessed lemma and no other fields,
+            see coverage. Results aren't cached, they are cheaper to make again than to read.
+
+        Example:
+            ```python
+            async with LocalNLPBackend(Lexicon.load("lexicon.json")) as backend:
+                results = await request_nlp_api(extracted_text, client=backend)
+                print(backend.coverage())
+            ```
+        """
+        super().__init__()
+        self.lexicon = lexicon
+        self.max_workers = max_workers
+        self._table = lexicon.table()
+        self._executor = None
+
+        self.texts = 0
+        self.tokens = 0
+        self.known_tokens = 0
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # started on first use, the lexicon table is sent to each worker once
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(self._table,),
+            )
+        return self._executor
+
+    async def analyse(self, text: str, steps=DEFAULT_STEPS) -> dict:
+        """
+        Analyses one text from the lexicon.
+
+        Args:
+            text (str): The text.
+            steps (List[str], optional): Ignored, tokens, lemmas and named entities are always given. Defaults to DEFAULT_STEPS.
+
+        Returns:
+            dict: The result in the NLP API's format.
+        """
+        with stage("local_nlp") as timed:
+            if self.max_workers == 0:
+                result, known, tokens = await asyncio.to_thread(
+                    analyse_text, text, self._table
+                )
+            else:
+                loop = asyncio.get_running_loop()
+                result, known, tokens = await loop.run_in_executor(
+                    self._get_executor(), _analyse_in_worker, text
+                )
+            timed.add(items=1)
+
+        self.texts += 1
+        self.tokens += tokens
+        self.known_tokens += known
+        count("local_nlp_tokens", tokens)
+        count("local_nlp_known_tokens", known)
+        return result
+
+    def coverage(self) -> float:
+        """
+        Returns:
+            float: Share of the tokens analysed so far that were found in the lexicon, 1.0 before any.
+        """
+        return self.known_tokens / self.tokens if self.tokens else 1.0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Dictionary of requests, texts, tokens, known_tokens and coverage.
+        """
+        return super().stats() | {
+            "texts": self.texts,
+            "tokens": self.tokens,
+            "known_tokens": self.known_tokens,
+            "coverage": self.coverage(),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a lexicon for LocalNLPBackend from cached NLP API responses."
+    )
+    parser.add_argument("cache_dir", help="ResponseCache directory, e.g. nlp_cache")
+    parser.add_argument("lexicon_path")
+    args = parser.parse_args()
+
+    lexicon = Lexicon.from_cache(ResponseCache(args.cache_dir))
+    lexicon.save(args.lexicon_path)
+    print(f"{len(lexicon)} forms and {len(lexicon.entities)} named entities saved to {args.lexicon_path}")
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import random
+from abc import ABC, abstractmethod
+
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.instrumentation import count, stage
+
+logger = logging.getLogger("lvLogger")
+
+# response statuses worth trying again, anything else is treated as a permanent failure
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+NLP_API_URL = "https://nlp.ailab.lv/api/nlp"
+# the analysis every backend gives, Sentence uses the tokens' forms and lemmas and the named entities
+DEFAULT_STEPS = ("tokenizer", "morpho", "ner")
+
+
+def make_nlp_post_body(text: str, steps: list[str] = DEFAULT_STEPS, url: str = NLP_API_URL):
+    """
+    Creates a POST request body for the ailab NLP API.
+
+    Args:
+        text (str): Input text to be processed.
+        steps (List[str], optional): NLP processing steps (tokenizer, morpho, parser, ner). Default is ["tokenizer", "morpho", "ner"].
+        url (str, optional): The NLP API endpoint. Defaults to NLP_API_URL.
+
+    Returns:
+        dict: A dictionary of url, headers and data
+
+    Example:
+        ```python
+        post_body = make_nlp_post_body("Sample text for NLP processing")
+        print(post_body)
+        ```
+    """
+    headers = {"Content-Type": "application/json"}
+
+    data = {
+        "steps": list(steps),
+        "data": text,
+    }
+
+    return {"url": url, "headers": headers, "data": json.dumps(data)}
+
+
+class NLPBackend(ABC):
+    # name of the backend, override in subclasses
+    name = "base"
+
+    def __init__(self):
+        """
+        Initializes an NLP backend, something that tokenizes, lemmatizes and finds the named entities of texts.
+
+        Attributes:
+            requests (int): Number of requests sent to a remote API, including retries.
+
+        Note:
+            Subclasses implement analyse, returning a dict with the "sentences" of the text in the NLP API's format:
+            each sentence a dict of "tokens", each with at least a "form" and "lemma", and "ner", each with a "text".
+            Use a backend as an async context manager so it is closed when finished.
+
+        Example:
+            ```python
+            async with LocalNLPBackend(Lexicon.load("lexicon.json")) as backend:
+                results = await request_nlp_api(extracted_text, client=backend)
+            ```
+        """
+        self.requests = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Releases the backend's resources.
+        """
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Dictionary of the backend's counters, requests for every backend.
+        """
+        return {"requests": self.requests}
+
+    @abstractmethod
+    async def analyse(self, text: str, steps=DEFAULT_STEPS) -> dict:
+        """
+        Analyses one text.
+
+        Args:
+            text (str): The text.
+            steps (List[str], optional): NLP processing steps. Defaults to DEFAULT_STEPS.
+
+        Returns:
+            dict: The result, a dict of sentences.
+        """
+
+    async def analyse_all(self, texts: list[str], steps=DEFAULT_STEPS) -> list[dict]:
+        """
+        Analyses many texts concurrently.
+
+        Args:
+            texts (List[str]): The texts.
+            steps (List[str], optional): NLP processing steps. Defaults to DEFAULT_STEPS.
+
+        Returns:
+            List[dict]: The result of each text, in the same order as texts.
+        """
+        return await asyncio.gather(*[self.analyse(text, steps) for text in texts])
+
+
+class NLPClient(NLPBackend):
+    name = "ailab"
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 300.0,
+        cache: ResponseCache = None,
+        request_slots=None,
+        url: str = NLP_API_URL,
+    ):
+        """
+        Initializes a client for the ailab NLP API that shares one connection pool between requests.
+
+        Args:
+            max_concurrency (int, optional): Maximum number of requests in flight at once. Defaults to 4.
+            max_retries (int, optional): Number of times a request is retried after a transient error. Defaults to 3.
+            backoff_base (float, optional): Base delay in seconds of the exponential backoff. Defaults to 0.5.
+            backoff_max (float, optional): Maximum delay in seconds between retries. Defaults to 30.
+            timeout (float, optional): Total timeout in seconds of a single request. Defaults to 300.
+            cache (ResponseCache, optional): Cache checked before making a request. Defaults to None.
+            request_slots (multiprocessing.Semaphore, optional): Semaphore shared with other processes, a slot is held
+                for every request in flight so the processes together stay under one limit. Defaults to None.
+            url (str, optional): The NLP API endpoint. Defaults to NLP_API_URL.
+
+        Attributes:
+            requests (int): Number of requests sent, including retries.
+            retries (int): Number of retries made after transient errors.
+
+        Note:
+            Use the client as an async context manager so the session is closed when finished.
+
+        Example:
+            ```python
+            async with NLPClient(max_concurrency=2) as client:
+                results = await request_nlp_api(extracted_text, client=client)
+            ```
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least one")
+
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.cache = cache
+        self.request_slots = request_slots
+        self.url = url
+
+        self.retries = 0
+
+        self._session = None
+        self._semaphore: asyncio.Semaphore = None
+
+    async def __aenter__(self):
+        self._ensure_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ensure_session(self):
+        if self._session is None or self._session.closed:
+            # aiohttp is slow to import, only load it once a client is used
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        """
+        Closes the shared session and its connection pool.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # full jitter, spreads retries out so they don't all hit the api at the same time
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    async def _acquire_slot(self):
+        # poll instead of blocking a thread, a cancelled request then never takes a slot it can't give back
+        while not self.request_slots.acquire(block=False):
+            await asyncio.sleep(0.05)
+
+    async def _post_once(self, post_body: dict) -> dict:
+        if self.request_slots is not None:
+            await self._acquire_slot()
+        try:
+            with stage("nlp_requests") as timed:
+                async with self._session.post(**post_body) as response:
+                    response.raise_for_status()
+                    body = await response.read()
+                timed.add(
+                    items=1,
+                    bytes_sent=len(post_body["data"].encode("utf-8")),
+                    bytes_received=len(body),
+                )
+            return json.loads(body)["data"]
+        finally:
+            if self.request_slots is not None:
+                self.request_slots.release()
+
+    async def _post(self, post_body: dict) -> dict:
+        import aiohttp
+
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                return await self._post_once(post_body)
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+
+            delay = self._backoff_delay(attempt)
+            logger.warning(
+                f"NLP request failed ({error}), retry {attempt + 1} in {delay:.1f}s"
+            )
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def fetch(self, post_body: dict) -> dict:
+        """
+        Fetches the NLP result for a single POST body, retrying transient errors.
+
+        Args:
+            post_body (dict): Dictionary containing information for the POST request, including URL, headers, and data.
+
+        Returns:
+            dict: Data received from the API response.
+        """
+        if self.cache is not None:
+            key = self.cache.key_for_post_body(post_body)
+            cached = self.cache.get(key)
+            if cached is not None:
+                count("nlp_cache_hits")
+                return cached
+
+        self._ensure_session()
+        async with self._semaphore:
+            data = await self._post(post_body)
+
+        if self.cache is not None:
+            self.cache.set(key, data)
+        return data
+
+    async def fetch_all(self, post_bodies: list[dict]) -> list[dict]:
+        """
+        Fetches the NLP results for many POST bodies with at most max_concurrency requests in flight.
+
+        Args:
+            post_bodies (List[dict]): List of POST bodies made by make_nlp_post_body.
+
+        Returns:
+            List[dict]: List of results in the same order as post_bodies.
+        """
+        return await asyncio.gather(*[self.fetch(body) for body in post_bodies])
+
+    async def analyse(self, text: str, steps=DEFAULT_STEPS) -> dict:
+        """
+        Analyses one text with the NLP API, using the cache.
+
+        Args:
+            text (str): The text.
+            steps (List[str], optional): NLP processing steps. Defaults to DEFAULT_STEPS.
+
+        Returns:
+            dict: Data received from the API response.
+        """
+        return await self.fetch(make_nlp_post_body(text, steps, self.url))
@@ -1,22 +1,22 @@
-import itertools
 import logging
 import os
-from collections import defaultdict
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import datetime
-from functools import partial
+from functools import cached_property
+from itertools import repeat
 
-# import deepl
-import yake
-from googletrans import Translator
+from ComprehensibleLatvian.instrumentation import count, stage
+from ComprehensibleLatvian.token_store import TokenStore
+from ComprehensibleLatvian.translation import (
+    translate_pages,
+    translate_words,
+    translator_fn,
+)
 
-logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger("lvLogger")
 
-# this is the string that is used when processing the input text to delimt start and end of a page
-PAGE_DELIMITER = "page_"
-PAGE_START_DELIMITER = PAGE_DELIMITER + "start_"
-PAGE_END_DELIMITER = PAGE_DELIMITER + "end_"
-
 
 def generate_stopwords_filename():
     # Get the current local time
@@ -28,52 +28,42 @@ def generate_stopwords_filename():
     return filename
 
 
-# path to where the books stop words will be saved
-# will probs be set in the script later
-stopword_save_path = generate_stopwords_filename()
-STOPWORD_SAVE_PATH = stopword_save_path
+# name of the file the books stop words will be saved to, made on first use by default_stopword_save_path
+_stopword_save_path = None
 
 
-def make_page_sentence_map(all_sentence_dict: dict[str, list]):
+def default_stopword_save_path() -> str:
     """
-    Creates a mapping of sentences to their respective pages based on delimiters.
-
-    Args:
-        all_sentence_dict (dict[str, list]): Dictionary containing information about sentences.
-
     Returns:
-        dict: A mapping of sentences to their respective pages. e.g {pages: [{page: 1, start_idx:0, end_idx:19}, {...}] }
-    """
-    # returns dict of form{pages: [{page: 1, start_idx:0, end_idx:19}, {...}] }
-    page_sentence_mapping = {"pages": []}
-    for index, sentence_dict in enumerate(all_sentence_dict["sentences"]):
-        delimiter = sentence_dict["tokens"][0]["form"]
-        if delimiter.startswith(PAGE_START_DELIMITER):
-            page_number = delimiter.split("_")[-1]
-            start_idx = index
-        if delimiter.startswith(PAGE_END_DELIMITER):
-            end_idx = index
-            page_sentence_mapping["pages"].append(
-                {"page": page_number, "start_idx": start_idx, "end_idx": end_idx}
-            )
+        str: The stopwords file name of this run, generated from the time it is first asked for.
+    """
+    global _stopword_save_path
+    if _stopword_save_path is None:
+        _stopword_save_path = generate_stopwords_filename()
+    return _stopword_save_path
 
-    return page_sentence_mapping
 
+def __getattr__(name):
+    # these used to be set when the module was imported
+    if name in ("STOPWORD_SAVE_PATH", "stopword_save_path"):
+        return default_stopword_save_path()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def load_local_stopwords(
-    file_name=generate_stopwords_filename(), load_all_in_dir=False
-):
+
+def load_local_stopwords(file_name=None, load_all_in_dir=False):
     """
     Loads stop words saved in the local working directory.
 
     Args:
-        file_name (str, optional): Name of the stopwords file. Defaults to generated filename.
+        file_name (str, optional): Name of the stopwords file. Defaults to default_stopword_save_path().
         load_all_in_dir (bool, optional): Whether to load stopwords from all files in the directory. Defaults to False.
 
     Returns:
         set: Set of stop words.
     """
     # load stop words saved in local working directory
+    if file_name is None:
+        file_name = default_stopword_save_path()
 
     # Create a directory for stopwords in the local working directory
     specific_stopwords_dir = os.path.join(os.getcwd(), "stopwords")
@@ -146,31 +136,97 @@ def write_stopwords(file_name="stopwords.txt", stop_words=set()):
     # Define the path for the specific stopwords file based on the working directory
     specific_stopwords_path = os.path.join(local_stopwords_dir, file_name)
 
-    with open(specific_stopwords_path, "w+", encoding="utf-8") as file:
-        for item in stop_words:
-            file.write(str(item) + "\n")
+    # write to a temp file and rename so a crash never leaves a half written stopword file
+    fd, tmp_path = tempfile.mkstemp(dir=local_stopwords_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            for item in stop_words:
+                file.write(str(item) + "\n")
+        os.replace(tmp_path, specific_stopwords_path)
+    except BaseException:
+        # a leftover temp file would be read as stop words by load_all_in_dir
+        os.remove(tmp_path)
+        raise
+
+
+class StopwordStore:
+    def __init__(self, save_path=None, load_all_in_dir=True, checkpoint_every=None):
+        """
+        Initializes a StopwordStore object.
+
+        Args:
+            save_path (str, optional): Name of the book stopwords file. Defaults to default_stopword_save_path().
+            load_all_in_dir (bool, optional): Whether to load stopwords from all files in the directory. Defaults to True.
+            checkpoint_every (int, optional): Write the book stopwords every n pages, None only writes on flush. Defaults to None.
 
+        Attributes:
+            save_path (str): Name of the book stopwords file.
+            common_stopwords (set): Common stop words from the package resources.
+            book_stopwords (set): Stop words of the book, the named entities and key words of every page so far.
 
-def extract_key_words(
-    text: str, stop_words: set, save_path: str, no_key_words=20, load_all_in_dir=True
-):
+        Note:
+            Stopwords are loaded from disk once and kept in memory, call flush at the end of the book to save them.
+
+        Example:
+            ```python
+            stopword_store = StopwordStore()
+            pages = sentences_to_pages(page_sentences, stopword_store=stopword_store)
+            ```
+        """
+        self.save_path = save_path if save_path is not None else default_stopword_save_path()
+        self.checkpoint_every = checkpoint_every
+
+        self.common_stopwords: set = load_common_stopwords()
+        self.book_stopwords: set = load_local_stopwords(
+            self.save_path, load_all_in_dir=load_all_in_dir
+        )
+        self._pages_since_flush = 0
+
+    def all_stopwords(self) -> set:
+        """
+        Returns:
+            set: The common and book stop words.
+        """
+        return self.common_stopwords | self.book_stopwords
+
+    def update(self, stop_words) -> None:
+        """
+        Adds stop words to the book stop words.
+
+        Args:
+            stop_words (Iterable[str]): Stop words to add.
+        """
+        self.book_stopwords.update(stop_words)
+
+    def checkpoint(self) -> None:
+        """
+        Marks a page as finished, writing the book stop words every checkpoint_every pages.
+        """
+        self._pages_since_flush += 1
+        if self.checkpoint_every and self._pages_since_flush >= self.checkpoint_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the book stop words to save_path.
+        """
+        write_stopwords(file_name=self.save_path, stop_words=self.book_stopwords)
+        self._pages_since_flush = 0
+
+
+def make_key_word_extractor(stopwords: set, no_key_words=20) -> "yake.KeywordExtractor":
     """
-    Extracts key words from the given text and updates the stop words.
+    Creates the YAKE keyword extractor used for every page.
 
     Args:
-        text (str): The input text from which key words are to be extracted.
-        stop_words (set): Set of stop words.
-        save_path (str): Path to the stop words file to be updated.
+        stopwords (set): Set of stop words, these are never returned as key words.
         no_key_words (int, optional): Number of key words to extract. Defaults to 20.
-        load_all_in_dir (bool, optional): Whether to load stopwords from all files in the directory. Defaults to False.
 
     Returns:
-        List[str]: List of extracted key words.
-
-    Note:
-        This function uses the YAKE keyword extraction algorithm to extract key words from the input text.
-        Writes new keywords to stop_words file so that the same key word is not returned more than once
+        yake.KeywordExtractor: The keyword extractor.
     """
+    # yake is slow to import, only load it once key words are extracted
+    import yake
 
     language = "lv"
     max_ngram_size = 1
@@ -179,14 +235,7 @@ def extract_key_words(
     windowSize = 1
     numOfKeywords = no_key_words
 
-    default_stopwords = load_common_stopwords()
-    # global stop words - load all previous stop words, add new ones in and save again
-    book_stopwords = load_local_stopwords(save_path, load_all_in_dir=load_all_in_dir)
-    book_stopwords.update(stop_words)
-
-    all_stopwords = default_stopwords | book_stopwords
-
-    custom_kw_extractor = yake.KeywordExtractor(
+    return yake.KeywordExtractor(
         lan=language,
         n=max_ngram_size,
         dedupLim=deduplication_threshold,
@@ -194,138 +243,589 @@ def extract_key_words(
         windowsSize=windowSize,
         top=numOfKeywords,
         features=None,
-        stopwords=all_stopwords,
+        stopwords=stopwords,
     )
-    keyword_importance = custom_kw_extractor.extract_keywords(text)
-    keywords = [word for word, _ in keyword_importance]
+
+
+def extract_key_words(
+    text: str,
+    stop_words: set,
+    save_path: str,
+    no_key_words=20,
+    load_all_in_dir=True,
+    stopword_store: StopwordStore = None,
+):
+    """
+    Extracts key words from the given text and updates the stop words.
+
+    Args:
+        text (str): The input text from which key words are to be extracted.
+        stop_words (set): Set of stop words.
+        save_path (str): Path to the stop words file to be updated.
+        no_key_words (int, optional): Number of key words to extract. Defaults to 20.
+        load_all_in_dir (bool, optional): Whether to load stopwords from all files in the directory. Defaults to False.
+        stopword_store (StopwordStore, optional): In memory book stopwords, if None they are loaded from and written to save_path. Defaults to None.
+
+    Returns:
+        List[str]: List of extracted key words.
+
+    Note:
+        This function uses the YAKE keyword extraction algorithm to extract key words from the input text.
+        Adds new keywords to the book stop words so that the same key word is not returned more than once
+    """
+    # global stop words - load all previous stop words, add new ones in and save again
+    store = stopword_store
+    if store is None:
+        store = StopwordStore(save_path, load_all_in_dir=load_all_in_dir)
+    store.update(stop_words)
+
+    with stage("yake") as timed:
+        custom_kw_extractor = make_key_word_extractor(store.all_stopwords(), no_key_words)
+        keyword_importance = custom_kw_extractor.extract_keywords(text)
+        keywords = [word for word, _ in keyword_importance]
+        timed.add(items=1)
 
     # add new key words to set of book stopwords so later pages don't show words that have already been shown
-    book_stopwords.update(set(keywords))
-    write_stopwords(file_name=save_path, stop_words=book_stopwords)
+    store.update(keywords)
+    if stopword_store is None:
+        store.flush()
+    else:
+        store.checkpoint()
 
     return keywords
 
 
+class _RecordingSet(set):
+    # set that remembers every value it was asked if it contains
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.queries = set()
+
+    def __contains__(self, item):
+        self.queries.add(item)
+        return super().__contains__(item)
+
+
+def _extract_key_words_recording(text: str, stop_words: frozenset, no_key_words: int):
+    # runs in a worker process, returns the key words and every word yake checked against the stop words
+    # only recorded when run in the instrumented process, a parallel run is timed by extract_key_words_parallel
+    with stage("yake") as timed:
+        custom_kw_extractor = make_key_word_extractor(stop_words, no_key_words)
+        recording_set = _RecordingSet(custom_kw_extractor.stopword_set)
+        custom_kw_extractor.stopword_set = recording_set
+        keyword_importance = custom_kw_extractor.extract_keywords(text)
+        timed.add(items=1)
+    return [word for word, _ in keyword_importance], frozenset(recording_set.queries)
+
+
+def extract_key_words_parallel(
+    texts: list[str],
+    page_stop_words: list[set],
+    stopword_store: StopwordStore,
+    no_key_words=20,
+    executor: Executor = None,
+    max_workers: int = None,
+    max_rounds: int = 8,
+) -> list[list[str]]:
+    """
+    Extracts key words for many pages in parallel, giving the same key words as calling extract_key_words page by page.
+
+    Args:
+        texts (list[str]): The lemma text of each page in book order.
+        page_stop_words (list[set]): The stop words (named entities) of each page.
+        stopword_store (StopwordStore): Book stopwords, updated with the stop words and key words of every page.
+        no_key_words (int, optional): Number of key words to extract per page. Defaults to 20.
+        executor (Executor, optional): Process pool to run YAKE in. Defaults to a new ProcessPoolExecutor.
+        max_workers (int, optional): Number of processes when creating the pool. Defaults to the number of cpus.
+        max_rounds (int, optional): Number of parallel rounds before finishing any pages left sequentially. Defaults to 8.
+
+    Returns:
+        list[list[str]]: The key words of each page.
+
+    Note:
+        Each page's stop words include the key words of every page before it, so pages can't simply be run
+        independently. YAKE only depends on the stop words through the words it looks up, so every page is
+        first extracted in parallel without the earlier key words and the looked up words are recorded.
+        A cheap sequential pass then finds the pages whose looked up words meet the key words of earlier pages
+        differently, only those are extracted again. Once no page changes the key words match the serial ones.
+        Pages often look up the key words of earlier pages, so most pages are extracted again over several
+        rounds: on the synthetic benchmark books this does about 5 times the YAKE calls of the serial path and
+        is slower than it on few cores. The rounds and the pages extracted again are counted in the
+        yake_parallel_rounds and yake_pages_extracted_again counters.
+
+    Example:
+        ```python
+        stopword_store = StopwordStore()
+        key_words = extract_key_words_parallel(
+            [page.lemma_text for page in pages], [page.stop_words for page in pages], stopword_store
+        )
+        ```
+    """
+    with stage("yake") as timed:
+        key_words = _extract_key_words_parallel(
+            texts, page_stop_words, stopword_store, no_key_words, executor, max_workers, max_rounds
+        )
+        timed.add(items=len(texts))
+    return key_words
+
+
+def _extract_key_words_parallel(
+    texts, page_stop_words, stopword_store, no_key_words, executor, max_workers, max_rounds
+):
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    page_count = len(texts)
+    base_stopwords = stopword_store.all_stopwords()
+
+    try:
+        # first round, pages only know the named entities of the pages before them
+        first_stopwords = []
+        stopwords = set(base_stopwords)
+        for stop_words in page_stop_words:
+            stopwords |= stop_words
+            first_stopwords.append(frozenset(stopwords))
+
+        key_words = [None] * page_count
+        queries = [None] * page_count
+        used = [None] * page_count
+        results = executor.map(
+            _extract_key_words_recording, texts, first_stopwords, repeat(no_key_words)
+        )
+        for i, (page_key_words, page_queries) in enumerate(results):
+            key_words[i] = page_key_words
+            queries[i] = page_queries
+            used[i] = page_queries & first_stopwords[i]
+        del first_stopwords
+
+        for round_number in range(max_rounds + 1):
+            last_round = round_number == max_rounds
+            stale = []
+
+            stopwords = set(base_stopwords)
+            for i in range(page_count):
+                stopwords |= page_stop_words[i]
+                needed = frozenset(q for q in queries[i] if q in stopwords)
+
+                if needed != used[i]:
+                    if last_round:
+                        # out of parallel rounds, finish the rest the same way as the serial path
+                        custom_kw_extractor = make_key_word_extractor(
+                            stopwords, no_key_words
+                        )
+                        keyword_importance = custom_kw_extractor.extract_keywords(texts[i])
+                        key_words[i] = [word for word, _ in keyword_importance]
+                        used[i] = needed
+                    else:
+                        stale.append((i, needed))
+
+                stopwords.update(key_words[i])
+
+            logger.debug(
+                f"key word round {round_number + 1}: {len(stale)} of {page_count} pages extracted again"
+            )
+            count("yake_parallel_rounds")
+            count("yake_pages_extracted_again", len(stale))
+            if not stale:
+                break
+
+            stale_indices = [i for i, _ in stale]
+            results = executor.map(
+                _extract_key_words_recording,
+                [texts[i] for i in stale_indices],
+                [needed for _, needed in stale],
+                repeat(no_key_words),
+            )
+            for (i, needed), (page_key_words, page_queries) in zip(stale, results):
+                key_words[i] = page_key_words
+                queries[i] = page_queries
+                used[i] = page_queries & needed
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    # same updates to the book stop words as the serial path
+    for stop_words, page_key_words in zip(page_stop_words, key_words):
+        stopword_store.update(stop_words)
+        stopword_store.update(page_key_words)
+        stopword_store.checkpoint()
+
+    return key_words
+
+
+def extract_key_words_tfidf(
+    pages_sentences: list[list], stopword_store: StopwordStore, no_key_words=20
+) -> list[list[str]]:
+    """
+    Extracts key words for every page at once with TF-IDF instead of YAKE.
+
+    Args:
+        pages_sentences (list[list[Sentence]]): The sentences of each page in book order, all in the same TokenStore.
+        stopword_store (StopwordStore): Book stopwords, updated with the stop words and key words of every page.
+        no_key_words (int, optional): Number of key words to extract per page. Defaults to 20.
+
+    Returns:
+        list[list[str]]: The key words of each page.
+
+    Note:
+        Scores the lemmas by how distinctive they are for the page within the book, see tfidf_key_words.
+        The key words differ from YAKE's, YAKE only looks at the text of the page.
+    """
+    from ComprehensibleLatvian.tfidf import tfidf_key_words
+
+    key_words = tfidf_key_words(
+        pages_sentences, stopword_store.all_stopwords(), no_key_words
+    )
+    # same updates to the book stop words as the serial path
+    for sentences, page_key_words in zip(pages_sentences, key_words):
+        stopword_store.update(join_stop_words(sentences))
+        stopword_store.update(page_key_words)
+        stopword_store.checkpoint()
+    return key_words
+
+
+# key word engines of sentences_to_pages
+KEY_WORD_ENGINES = ("yake", "tfidf")
+
+
+# tokens that are written straight after the previous token without a space
+PUNCTUATION = frozenset([".", ";", ":", ",", "!", "?"])
+
+
 class Sentence:
-    def __init__(self, sentence: dict):
+    __slots__ = ("store", "index")
+
+    def __init__(self, sentence: dict, store: TokenStore = None, text_id: int = None):
         """
         Initializes a Sentence object.
 
         Args:
             sentence (dict): Dictionary representing the sentence as returned from nlp.ailab.lv/api/nlp.
+            store (TokenStore, optional): Book level store the tokens are added to. Defaults to a new TokenStore for this sentence only.
+            text_id (int, optional): Id in the store of the text the sentence's "text_span" is in. Defaults to None.
 
         Attributes:
-            sentence (dict): The original sentence dictionary.
-            ner (list): List of named entities in the sentence.
-            tokens (list): List of tokens in the sentence.
+            store (TokenStore): The store holding the sentence's tokens.
+            index (int): Index of the sentence in the store.
+            tokens (list): List of tokens in the sentence, dicts of form and lemma.
             lemma_form (list): List of tuples containing token lemma and lowercase form.
             text (str): The text of the sentence.
             lemma_text (str): The text of the sentence with lemmatized tokens.
             stop_words (set): Set of stop words in the sentence.
 
+        Note:
+            The sentence dict is not kept, the tokens are stored as ids in the store and the attributes are
+            built from it when used. Share one store between every sentence of a book, see sentences_from_results.
+            The text is sliced from the text the sentence was found in when it has a span there, and otherwise
+            made from the tokens.
+        """
+        if store is None:
+            store = TokenStore()
+        self.store = store
+        self.index = store.add_sentence(sentence, text_id)
+
+    @classmethod
+    def from_store(cls, store: TokenStore, index: int) -> "Sentence":
+        """
+        Creates a Sentence for a sentence already in a store.
+
+        Args:
+            store (TokenStore): The store holding the sentence's tokens.
+            index (int): Index of the sentence in the store.
+
+        Returns:
+            Sentence: View of the sentence.
         """
-        # self.word_forms = []
-        self.sentence = sentence
-        self.ner = sentence["ner"]
-        self.tokens = sentence["tokens"]
+        sentence = cls.__new__(cls)
+        sentence.store = store
+        sentence.index = index
+        return sentence
+
+    @property
+    def forms(self) -> list[str]:
+        return self.store.forms(self.index)
+
+    @property
+    def lemmas(self) -> list[str]:
+        return self.store.lemmas(self.index)
+
+    @property
+    def tokens(self) -> list[dict]:
+        return [
+            {"form": form, "lemma": lemma}
+            for form, lemma in zip(self.forms, self.lemmas)
+        ]
 
-        self.lemma_form = [
-            (token["lemma"], token["form"].lower()) for token in self.tokens
+    @property
+    def lemma_form(self) -> list[tuple[str, str]]:
+        return [
+            (lemma, form.lower()) for lemma, form in zip(self.lemmas, self.forms)
         ]
 
-        self.text: str = self.make_text(sentence["tokens"])
-        self.lemma_text: str = self.make_lemma_text(sentence["tokens"])
-        self.stop_words: set = self.make_stop_words(sentence["ner"])
+    @property
+    def text(self) -> str:
+        text = self.store.text(self.index)
+        if text is None:
+            text = self.make_text(self.forms)
+        return text
 
-    # def add_word_form(self, form):
-    #     self.word_forms.append(form)
+    @property
+    def lemma_text(self) -> str:
+        return self.make_lemma_text(self.lemmas)
 
-    def make_text(self, tokens):
+    @property
+    def stop_words(self) -> set:
+        return self.store.stop_words(self.index)
+
+    def make_text(self, forms: list[str]):
         """
         Creates the text of the sentence from its tokens.
 
         Args:
-            tokens (list): List of tokens in the sentence.
+            forms (list[str]): The form of each token in the sentence.
 
         Returns:
             str: The text of the sentence.
         """
-        text = ""
-        for i, token in enumerate(tokens):
-            form = token["form"]
-            if form.startswith(PAGE_DELIMITER):
-                continue
+        parts = []
+        for i, form in enumerate(forms):
             # Look forward, if next is a punctuation dont add a trailing space
-            if i + 1 < len(tokens) and tokens[i + 1]["form"] in [
-                ".",
-                ";",
-                ":",
-                ",",
-                "!",
-                "?",
-            ]:
-                text = text + form
+            if i + 1 < len(forms) and forms[i + 1] in PUNCTUATION:
+                parts.append(form)
             else:
-                text = text + f"{form} "
-        return text
+                parts.append(f"{form} ")
+        return "".join(parts)
 
-    # def make_text(self, tokens):
-    #     return " ".join(
-    #         [
-    #             token["form"]
-    #             for token in tokens
-    #             if not token["form"].startswith(PAGE_DELIMITER)
-    #         ]
-    #     )
-
-    def make_lemma_text(self, tokens):
+    def make_lemma_text(self, lemmas: list[str]):
         """
         Creates the lemmatized text of the sentence from its tokens.
 
         Args:
-            tokens (list): List of tokens in the sentence.
+            lemmas (list[str]): The lemma of each token in the sentence.
 
         Returns:
             str: The lemmatized text of the sentence.
         """
-        return " ".join(
-            [
-                token["lemma"].lower()
-                for token in tokens
-                if not token["lemma"].startswith(PAGE_DELIMITER)
-            ]
-        )
+        return " ".join([lemma.lower() for lemma in lemmas])
 
-    def make_stop_words(self, ner):
-        """
-        Creates a set of stop words from the named entities in the sentence.
+    def __len__(self):
+        # len will be the number of words in the sentence
+        return self.store.token_count(self.index)
 
-        Args:
-            ner (list): List of named entities in the sentence.
 
-        Returns:
-            set: Set of stop words.
-        """
-        # split named entities into single words then flatten into list
-        stop_word_list = itertools.chain.from_iterable(
-            [ne["text"].lower().split(" ") for ne in ner]
+def sentences_from_results(results: list[dict], store: TokenStore = None) -> list[Sentence]:
+    """
+    Creates Sentence objects for every sentence in NLP API results, sharing one TokenStore.
+
+    Args:
+        results (list[dict]): Results of request_nlp_api.
+        store (TokenStore, optional): Store to add the sentences to. Defaults to a new TokenStore.
+
+    Returns:
+        list[Sentence]: List of Sentence objects.
+    """
+    if store is None:
+        store = TokenStore()
+    with stage("sentence_construction") as timed:
+        sentences = [
+            Sentence(sentence, store)
+            for result in results
+            for sentence in result["sentences"]
+        ]
+        timed.add(items=len(sentences))
+    return sentences
+
+
+# how far ahead of the last aligned token a token is looked for in the chunk text
+_ALIGN_WINDOW = 1000
+
+
+def _split_ner(ner: list[dict], parts: list[list[dict]]) -> list[list[dict]]:
+    # each named entity goes with the part its first word is in
+    part_ner = [[] for _ in parts]
+    for entity in ner:
+        first_word = entity["text"].split(" ")[0]
+        index = next(
+            (
+                i
+                for i, tokens in enumerate(parts)
+                if any(token["form"] == first_word for token in tokens)
+            ),
+            0,
         )
-        return set(stop_word_list)
+        part_ner[index].append(entity)
+    return part_ner
 
-    def __len__(self):
-        # len will be the number of words in the sentence
-        return len(self.tokens)
 
+def align_chunk_sentences(chunk, result: dict) -> list[tuple[str, list[dict], bool]]:
+    """
+    Maps the sentences the NLP API returned for a chunk onto the chunk's pages.
+
+    Args:
+        chunk (PageChunk): The text sent to the NLP API, with the offsets of its pages.
+        result (dict): The NLP API result for chunk.
+
+    Returns:
+        list[tuple[str, list[dict], bool]]: Page id, sentence dicts and whether the page ends in this chunk,
+            for every page of the chunk in order. Each sentence dict is a copy with a "text_span", the start
+            and end offset of the sentence in the chunk.
+
+    Note:
+        Each token is found in the chunk text after the previous one, its character offset gives its page.
+        A sentence the tokenizer ran over the end of a page is split where the page ends, so a sentence
+        never belongs to two pages. A token that can't be found, e.g. normalised by the tokenizer, stays
+        on the page of the token before it.
+    """
+    spans = chunk.pages
+    if not spans:
+        return []
+    starts = [start for _, start, _, _ in spans]
+    page_sentences = [[] for _ in spans]
+
+    cursor = 0
+    page = 0
+    # the start of the page after the current one, tokens are in order so pages are only looked up past it
+    next_start = starts[1] if len(starts) > 1 else len(chunk) + 1
+    for sentence in result["sentences"]:
+        tokens = sentence["tokens"]
+        if not tokens:
+            continue
+        # the token index each page of the sentence starts at, and the text span of each part
+        breaks = [(0, page)]
+        part_spans = []
+        for i, token in enumerate(tokens):
+            form = token["form"]
+            end = cursor
+            # only whitespace is between tokens, so the first match after the cursor is the token
+            position = chunk.find(form, cursor, cursor + _ALIGN_WINDOW)
+            if position >= 0:
+                cursor = position + len(form)
+            else:
+                position = cursor
+            if i == 0:
+                start = position
+            if position >= next_start:
+                page = bisect_right(starts, position) - 1
+                next_start = starts[page + 1] if page + 1 < len(starts) else len(chunk) + 1
+                if i == 0:
+                    breaks[0] = (0, page)
+                else:
+                    breaks.append((i, page))
+                    part_spans.append((start, end))
+                    start = position
+        part_spans.append((start, cursor))
+
+        if len(breaks) == 1:
+            page_sentences[page].append({**sentence, "text_span": part_spans[0]})
+            continue
+        ends = [i for i, _ in breaks[1:]] + [len(tokens)]
+        parts = [tokens[i:end] for (i, _), end in zip(breaks, ends)]
+        for (_, part_page), part, ner, span in zip(
+            breaks, parts, _split_ner(sentence["ner"], parts), part_spans
+        ):
+            page_sentences[part_page].append(
+                {**sentence, "tokens": part, "ner": ner, "text_span": span}
+            )
+
+    return [
+        (page_id, sentences, ends_page)
+        for (page_id, _, _, ends_page), sentences in zip(spans, page_sentences)
+    ]
+
+
+def page_sentences_from_results(
+    chunks: list, results: list[dict], store: TokenStore = None
+) -> list[tuple[str, list[Sentence], bool]]:
+    """
+    Creates Sentence objects for NLP API results, grouped by the page they are in.
+
+    Args:
+        chunks (list[PageChunk]): The chunks sent to the NLP API.
+        results (list[dict]): The result of each chunk.
+        store (TokenStore, optional): Store to add the sentences to. Defaults to a new TokenStore.
+
+    Returns:
+        list[tuple[str, list[Sentence], bool]]: Page id, sentences and whether the page ends there, for every
+            page of every chunk in order. Pass them to PageAssembler.add_pages or sentences_to_pages.
+
+    Note:
+        Each chunk is added to the store as a text, the sentences' texts are slices of it.
+    """
+    if store is None:
+        store = TokenStore()
+    page_sentences = []
+    with stage("sentence_construction") as timed:
+        for chunk, result in zip(chunks, results):
+            text_id = store.add_text(chunk)
+            for page_id, sentences, ends_page in align_chunk_sentences(chunk, result):
+                page_sentences.append(
+                    (page_id, [Sentence(s, store, text_id) for s in sentences], ends_page)
+                )
+                timed.add(items=len(sentences))
+    return page_sentences
+
+
+def flatten_page_sentences(page_sentences: list[tuple]) -> list[Sentence]:
+    """
+    Args:
+        page_sentences (list[tuple[str, list[Sentence], bool]]): Sentences grouped by page, see page_sentences_from_results.
 
-# google translate isn't very good
-translator = Translator()
-translator_fn = partial(translator.translate, src="lv")
+    Returns:
+        list[Sentence]: Every sentence in order, e.g. for LemmaContainer.sentences_to_lemmas.
+    """
+    return [sentence for _, sentences, _ in page_sentences for sentence in sentences]
 
-# deepl also is not very good :(
-# translator = deepl.Translator(os.environ.get("deepl_auth_key"))
-# translator_fn = partial(
-#     translator.translate_text, source_lang="LV", target_lang="EN-GB", preserve_formatting=True
-# )
+
+def join_text(sentences: list[Sentence]) -> str:
+    """
+    Returns:
+        str: The text of the sentences joined into one string.
+
+    Note:
+        Sentences that follow each other in the same text are one slice of it, keeping the text's spacing and
+        line breaks, only separate slices and sentences without a text are joined with spaces.
+    """
+    parts = []
+    # the store, text id, start and end of the slice being extended
+    run = None
+    for sentence in sentences:
+        span = sentence.store.span(sentence.index)
+        if (
+            run is not None
+            and span is not None
+            and sentence.store is run[0]
+            and span[0] == run[1]
+            and span[1] >= run[3]
+        ):
+            run[3] = span[2]
+            continue
+        if run is not None:
+            parts.append(run[0].texts[run[1]][run[2] : run[3]])
+            run = None
+        if span is None:
+            parts.append(sentence.text)
+        else:
+            run = [sentence.store, *span]
+    if run is not None:
+        parts.append(run[0].texts[run[1]][run[2] : run[3]])
+    return " ".join(parts)
+
+
+def join_lemma_text(sentences: list[Sentence]) -> str:
+    """
+    Returns:
+        str: The lemmatized text of the sentences joined into one string.
+    """
+    return " ".join([sentence.lemma_text for sentence in sentences])
+
+
+def join_stop_words(sentences: list[Sentence]) -> set:
+    """
+    Returns:
+        set: The union of the stop words of the sentences.
+    """
+    return set().union(*[sentence.stop_words for sentence in sentences])
 
 
 class Page:
@@ -335,6 +835,9 @@ class Page:
         start_end_slice: slice,
         sentences: list[Sentence],
         translator=translator_fn,
+        stopword_store: StopwordStore = None,
+        extracted_key_words: list[str] = None,
+        translate: bool = True,
     ):
         """
         Initializes a Page object.
@@ -343,73 +846,247 @@ class Page:
             page_number (int): The page number.
             start_end_slice (slice): Slice indicating the start and end indices of the page in the document.
             sentences (list[Sentence]): List of Sentence objects representing the sentences on the page.
-            translator (callable, optional): Translator function to translate key words. Defaults to translator_fn.
+            translator (TranslationBackend | callable, optional): Backend or translator function to translate key words. Defaults to translator_fn.
+            stopword_store (StopwordStore, optional): Book stopwords shared between pages. Defaults to None (read and written to disk per page).
+            extracted_key_words (list[str], optional): Key words already extracted for the page, e.g by extract_key_words_parallel. Defaults to None (extracted when first used).
+            translate (bool, optional): Whether to translate the key words when they are first used, if False use set_translations or translate_pages. Defaults to True.
 
         Attributes:
             page_number (int): The page number.
             start_end_slice (slice): Slice indicating the start and end indices of the page in the document.
             sentences (list[Sentence]): List of Sentence objects representing the sentences on the page.
-            translator (callable): Translator function to translate key words.
+            translator (TranslationBackend | callable): Backend or translator function to translate key words.
+            stopword_store (StopwordStore): Book stopwords the key words are extracted with.
+            translate (bool): Whether the key words are translated when first used.
             text (str): The text of the page.
             lemma_text (str): The lemmatized text of the page.
             stop_words (set): Set of stop words on the page.
             _key_words (list[str]): List of extracted key words.
-            translated_kws (list[str]): List of translated key words.
-            key_words (list[tuple[str, str]]): List of tuples containing original and translated key words.
+            translated_kws (list[str]): List of translated key words, empty until translated.
+            key_words (list[tuple[str, str]]): List of tuples containing original and translated key words, empty until translated.
 
+        Note:
+            Making a Page does no work, the text is joined, the key words extracted and translated the first time
+            each is used and then kept. Key words extracted on first use depend on the book stop words at that time,
+            so use materialize_pages to extract the key words of many pages in book order and translate them in one batch.
         """
         self.page_number = page_number
         self.start_end_slice = start_end_slice
         self.sentences = sentences
         self.translator = translator
+        self.stopword_store = stopword_store
+        self.translate = translate
+
+        self._extracted_key_words: list[str] = extracted_key_words
+        self._translated_kws: list[str] = None
+        self._key_word_pairs: list[tuple[str, str]] = None
+
+    @cached_property
+    def text(self) -> str:
+        return join_text(self.sentences)
+
+    @cached_property
+    def lemma_text(self) -> str:
+        return join_lemma_text(self.sentences)
+
+    @cached_property
+    def stop_words(self) -> set:
+        return join_stop_words(self.sentences)
+
+    @property
+    def key_words_extracted(self) -> bool:
+        return self._extracted_key_words is not None
+
+    @property
+    def translated(self) -> bool:
+        return self._translated_kws is not None
+
+    @property
+    def _key_words(self) -> list[str]:
+        if self._extracted_key_words is None:
+            self._extracted_key_words = extract_key_words(
+                text=self.lemma_text,
+                stop_words=self.stop_words,
+                save_path=default_stopword_save_path(),
+                stopword_store=self.stopword_store,
+            )
+        return self._extracted_key_words
+
+    @property
+    def translated_kws(self) -> list[str]:
+        if self._translated_kws is None and self.translate:
+            key_words = self._key_words
+            self.set_translations(
+                dict(zip(key_words, translate_words(key_words, self.translator)))
+            )
+        return self._translated_kws if self._translated_kws is not None else []
 
-        self.text: str = " ".join([sentence.text for sentence in sentences])
-        self.lemma_text: str = " ".join([sentence.lemma_text for sentence in sentences])
-        self.stop_words: set = set().union(
-            *[sentence.stop_words for sentence in sentences]
-        )
+    @property
+    def key_words(self) -> list[tuple[str, str]]:
+        if self._key_word_pairs is None:
+            # translates the key words first if the page translates them
+            self.translated_kws
+        return self._key_word_pairs if self._key_word_pairs is not None else []
 
-        self._key_words: list[str] = extract_key_words(
-            text=self.lemma_text,
-            stop_words=self.stop_words,
-            save_path=STOPWORD_SAVE_PATH,
-        )
+    def set_translations(self, translations: dict[str, str]) -> None:
+        """
+        Sets the translations of the page's key words.
 
-        self.translated_kws: list[str] = [
-            translation.text for translation in self.translator(self._key_words)
-        ]
-        self.key_words: list[tuple[str, str]] = list(
-            zip(self._key_words, self.translated_kws)
-        )
+        Args:
+            translations (dict[str, str]): Translation of each key word, may contain other words as well.
+        """
+        key_words = self._key_words
+        self._translated_kws = [translations[key_word] for key_word in key_words]
+        self._key_word_pairs = list(zip(key_words, self._translated_kws))
+
+
+def materialize_pages(
+    pages: list[Page],
+    translate: bool = True,
+    cache=None,
+    executor: Executor = None,
+) -> list[Page]:
+    """
+    Extracts and translates the key words of many pages at once.
+
+    Args:
+        pages (list[Page]): Pages in book order.
+        translate (bool, optional): Whether to translate the key words of every page not yet translated, including pages made with translate=False. Defaults to True.
+        cache (TranslationCache, optional): Cache of previous translations. Defaults to None.
+        executor (Executor, optional): Process pool to extract key words in parallel, used when the pages share a stopword_store. Defaults to None (one page at a time).
+
+    Returns:
+        list[Page]: pages, every key word extracted and, if translate, translated.
+
+    Note:
+        Key words are extracted in the order of pages, so they are the same as extracting them page by page in
+        book order. Each unique key word is translated once, by each page's translator.
+
+    Example:
+        ```python
+        pages = [Page(page_number, sentence_slice, sentences) for page_number, sentence_slice, sentences in page_spans]
+        with TranslationCache() as cache:
+            materialize_pages(pages, cache=cache)
+        ```
+    """
+    pending = [page for page in pages if not page.key_words_extracted]
+    stopword_stores = {id(page.stopword_store): page.stopword_store for page in pending}
+    if executor is not None and len(pending) > 1 and len(stopword_stores) == 1:
+        (stopword_store,) = stopword_stores.values()
+        if stopword_store is not None:
+            page_key_words = extract_key_words_parallel(
+                texts=[page.lemma_text for page in pending],
+                page_stop_words=[page.stop_words for page in pending],
+                stopword_store=stopword_store,
+                executor=executor,
+            )
+            for page, key_words in zip(pending, page_key_words):
+                page._extracted_key_words = key_words
+    for page in pending:
+        page._key_words
+
+    if translate:
+        # one batch per translator, pages usually share one
+        by_translator = {}
+        for page in pages:
+            if not page.translated:
+                by_translator.setdefault(id(page.translator), []).append(page)
+        for translator_pages in by_translator.values():
+            translate_pages(
+                translator_pages, translator=translator_pages[0].translator, cache=cache
+            )
+    return pages
+
+
+class WordForm:
+    __slots__ = ("form", "rank", "sentence_ids", "shortest_sentence_id", "_shortest_len")
+
+    def __init__(self, form: str, rank: int):
+        """
+        Initializes a WordForm object.
+
+        Args:
+            form (str): The word form.
+            rank (int): Order the form was first seen in for its lemma, breaks ties between equally frequent forms.
+
+        Attributes:
+            form (str): The word form.
+            rank (int): Order the form was first seen in for its lemma.
+            sentence_ids (list[int]): Id in the LemmaContainer of the sentence of every occurrence of the form.
+            shortest_sentence_id (int): Id of the first of the shortest sentences the form occurs in.
+        """
+        self.form = form
+        self.rank = rank
+        self.sentence_ids: list[int] = []
+        self.shortest_sentence_id: int = None
+        self._shortest_len: int = None
+
+    def __len__(self):
+        # len is the number of occurrences
+        return len(self.sentence_ids)
 
 
 class Lemma:
-    def __init__(self, lemma):
+    def __init__(self, lemma, sentences: list = None):
         """
         Initializes a Lemma object.
 
         Args:
             lemma (str): The lemma.
+            sentences (list[Sentence], optional): Sentences the sentence ids refer to, shared with the LemmaContainer. Defaults to a new list.
 
         Attributes:
             lemma (str): The lemma.
-            forms (dict): Dictionary where key is each form of the lemma and the value is a list of scentences where that form occurs.
+            word_forms (dict): Dictionary mapping each form of the lemma to its WordForm, in the order first seen.
+            best_form (WordForm): The form with the most occurrences, the first seen on a tie.
+            forms (dict): Dictionary where key is each form of the lemma and the value is a list of sentences where that form occurs.
+
+        Note:
+            best_form and the shortest sentence of each form are kept up to date as forms are added
+            so the form and example sentence of a card are looked up without scanning the sentences.
         """
         self.lemma: str = lemma
-        self.forms: dict[str, list[str]] = defaultdict(list)
+        self.sentences = sentences if sentences is not None else []
+        self.word_forms: dict[str, WordForm] = {}
+        self.best_form: WordForm = None
 
     # add methods to show all forms for a lemma (self.forms.keys())
     # add methods to show all sentences for all wordforms of lemma
 
-    def add_word_form(self, form: str, sentence: str):
+    def add_word_form(self, form: str, sentence_id: int, sentence_len: int):
         """
-        Adds a word form to the lemma's forms dictionary.
+        Adds an occurrence of a word form to the lemma's index.
 
         Args:
             form (str): The word form.
-            sentence (str): The sentence containing the word form.
+            sentence_id (int): Id of the sentence containing the word form.
+            sentence_len (int): Number of tokens in the sentence.
         """
-        self.forms[form].append(sentence)
+        word_form = self.word_forms.get(form)
+        if word_form is None:
+            word_form = WordForm(form, len(self.word_forms))
+            self.word_forms[form] = word_form
+
+        word_form.sentence_ids.append(sentence_id)
+        # strict < keeps the first of equally short sentences
+        if word_form._shortest_len is None or sentence_len < word_form._shortest_len:
+            word_form.shortest_sentence_id = sentence_id
+            word_form._shortest_len = sentence_len
+
+        best = self.best_form
+        if (
+            best is None
+            or len(word_form) > len(best)
+            or (len(word_form) == len(best) and word_form.rank < best.rank)
+        ):
+            self.best_form = word_form
+
+    @property
+    def forms(self) -> dict:
+        return {
+            form: [self.sentences[i] for i in word_form.sentence_ids]
+            for form, word_form in self.word_forms.items()
+        }
 
     def get_wordform(self, form: str):
         """
@@ -419,14 +1096,29 @@ class Lemma:
             form (str): The word form.
 
         Returns:
-            list[str]: List of sentences containing the specified word form.
+            list[Sentence]: List of sentences containing the specified word form.
 
         """
-        if form in self.forms:
-            return self.forms[form]
+        if form in self.word_forms:
+            return [self.sentences[i] for i in self.word_forms[form].sentence_ids]
 
         return []
 
+    def example_sentence(self, form: str = None):
+        """
+        Retrieves the shortest sentence containing a word form.
+
+        Args:
+            form (str, optional): The word form. Defaults to the best form of the lemma.
+
+        Returns:
+            Sentence: The first of the shortest sentences containing the form, None if the form does not occur.
+        """
+        word_form = self.best_form if form is None else self.word_forms.get(form)
+        if word_form is None:
+            return None
+        return self.sentences[word_form.shortest_sentence_id]
+
     def __hash__(self):
         return hash((self.lemma))
 
@@ -441,9 +1133,11 @@ class LemmaContainer:
 
         Attributes:
             lemmas (dict): Dictionary mapping lemmas to corresponding Lemma objects.
+            sentences (list[Sentence]): Every sentence added, the index into it is the sentence id used by the lemmas.
 
         Note:
-            This class is designed to store and manage Lemma objects.
+            This class is an inverted index of lemma -> form -> sentence ids. It is built in one pass over the
+            sentences and can hold the sentences of several books.
 
         Example:
             ```python
@@ -451,25 +1145,33 @@ class LemmaContainer:
             ```
         """
         self.lemmas: dict[str, Lemma] = {}
+        self.sentences: list[Sentence] = []
 
-    def add_lemma(self, lemma: str, form: str, sentence: str) -> None:
+    def add_lemma(self, lemma: str, form: str, sentence: Sentence) -> None:
         """
         Adds a word form to the lemma's forms dictionary in the LemmaContainer.
 
         Args:
             lemma (str): The lemma.
             form (str): The word form.
-            sentence (str): The sentence containing the word form.
+            sentence (Sentence): The sentence containing the word form.
 
         Example:
             ```python
-            lemma_container.add_lemma(lemma="example", form="example_form", sentence="This is an example sentence.")
+            lemma_container.add_lemma(lemma="example", form="example_form", sentence=sentence)
             ```
+
+        Note:
+            Adds the sentence as a new sentence id, use sentences_to_lemmas to add every token of a sentence.
         """
-        updated_lemma = self.get_lemma(lemma)
-        updated_lemma.add_word_form(form, sentence)
+        self.sentences.append(sentence)
+        self._add(lemma, form, len(self.sentences) - 1, len(sentence))
 
-        self.lemmas[lemma] = updated_lemma
+    def _add(self, lemma: str, form: str, sentence_id: int, sentence_len: int):
+        lemma_obj = self.lemmas.get(lemma)
+        if lemma_obj is None:
+            lemma_obj = self.lemmas[lemma] = Lemma(lemma, self.sentences)
+        lemma_obj.add_word_form(form, sentence_id, sentence_len)
 
     def get_lemma(self, lemma: str) -> Lemma:
         """
@@ -492,11 +1194,27 @@ class LemmaContainer:
         if lemma in self.lemmas:
             return self.lemmas[lemma]
 
-        return Lemma(lemma)
+        return Lemma(lemma, self.sentences)
 
     def get_all_lemmas(self):
         return list(self.lemmas.values())
 
+    def card_example(self, key_word: str):
+        """
+        Retrieves the form and example sentence for the card of a key word.
+
+        Args:
+            key_word (str): The key word, a lemma.
+
+        Returns:
+            tuple[str, Sentence]: The most frequent form of the lemma and the shortest sentence it occurs in,
+                None if the key word itself never occurs as a form of the lemma.
+        """
+        lemma = self.lemmas.get(key_word)
+        if lemma is None or key_word not in lemma.word_forms:
+            return None
+        return lemma.best_form.form, lemma.example_sentence()
+
     def sentences_to_lemmas(self, sentences: list[Sentence]):
         """
         Processes Sentences into lemma objects stored in self.lemmas
@@ -507,39 +1225,194 @@ class LemmaContainer:
         Returns:
             None. Adds lemmas from sentences to self.lemmas
         """
-        for sentence in sentences:
-            for lemma, form in sentence.lemma_form:
-                self.add_lemma(lemma, form, sentence)
+        add = self._add
+        with stage("sentences_to_lemmas") as timed:
+            for sentence in sentences:
+                sentence_id = len(self.sentences)
+                self.sentences.append(sentence)
+                sentence_len = len(sentence)
+                for lemma, form in sentence.lemma_form:
+                    add(lemma, form, sentence_id, sentence_len)
+            timed.add(items=len(sentences))
+
+
+class PageAssembler:
+    def __init__(
+        self,
+        stopword_store: StopwordStore = None,
+        executor: Executor = None,
+        translate: bool = True,
+        translator=translator_fn,
+        parallel_key_words: bool = False,
+    ):
+        """
+        Initializes a PageAssembler object.
 
+        Args:
+            stopword_store (StopwordStore, optional): Book stopwords shared by the pages. Defaults to a new StopwordStore.
+            executor (Executor, optional): Process pool to extract key words of pages in parallel, only used with parallel_key_words. Defaults to None.
+            translate (bool, optional): Whether pages translate their key words when made. Defaults to True.
+            translator (TranslationBackend | callable, optional): Backend or translator function given to the pages. Defaults to translator_fn.
+            parallel_key_words (bool, optional): Whether to extract the key words of each batch of pages in executor,
+                see extract_key_words_parallel, it is usually slower than one page at a time. Defaults to False.
+
+        Attributes:
+            sentence_count (int): Number of sentences added so far, used for the page slices.
+            stopword_store (StopwordStore): Book stopwords shared by the pages, flush it once all sentences are added.
+            executor (Executor): Process pool to extract key words of pages in parallel.
+            translate (bool): Whether pages translate their key words when made.
+            translator (TranslationBackend | callable): Backend or translator function given to the pages.
+            parallel_key_words (bool): Whether key words are extracted in executor.
 
-def sentences_to_pages(sentences: list[Sentence]):
+        Note:
+            Builds Page objects from sentences that arrive in several batches, a page can start in one batch
+            and end in a later one.
+
+        Example:
+            ```python
+            assembler = PageAssembler()
+            for chunk, result in zip(chunks, results):
+                pages = assembler.add_pages(page_sentences_from_results([chunk], [result]))
+            ```
+        """
+        self.sentence_count = 0
+        self.stopword_store = (
+            stopword_store if stopword_store is not None else StopwordStore()
+        )
+        self.executor = executor
+        self.translate = translate
+        self.translator = translator
+        self.parallel_key_words = parallel_key_words
+        self._page_number = None
+        self._start_idx = None
+        self._page_sentences: list[Sentence] = None
+
+    def collect_page_spans(self, page_sentences: list[tuple]) -> list[tuple]:
+        """
+        Adds sentences and returns the spans of the pages they complete, without making the pages.
+
+        Args:
+            page_sentences (list[tuple[str, list[Sentence], bool]]): Page id, sentences and whether the page ends,
+                following on from previously added sentences, see page_sentences_from_results.
+
+        Returns:
+            list[tuple[str, slice, list[Sentence]]]: Page number, sentence slice and sentences of each completed page.
+        """
+        page_spans = []
+        for page_number, sentences, ends_page in page_sentences:
+            if self._page_sentences is None or page_number != self._page_number:
+                # a page left unfinished by the previous chunk is dropped
+                self._page_number = page_number
+                self._start_idx = self.sentence_count
+                self._page_sentences = []
+            self._page_sentences.extend(sentences)
+            self.sentence_count += len(sentences)
+
+            if ends_page:
+                sentence_slice = slice(self._start_idx, self.sentence_count)
+                page_spans.append(
+                    (self._page_number, sentence_slice, self._page_sentences)
+                )
+                self._page_sentences = None
+        return page_spans
+
+    def add_pages(self, page_sentences: list[tuple]) -> list:
+        """
+        Adds sentences and returns the pages they complete.
+
+        Args:
+            page_sentences (list[tuple[str, list[Sentence], bool]]): Page id, sentences and whether the page ends,
+                following on from previously added sentences, see page_sentences_from_results.
+
+        Returns:
+            list[Page]: List of Page objects that ended in page_sentences.
+        """
+        page_spans = self.collect_page_spans(page_sentences)
+        pages = [
+            Page(
+                page_number=page_number,
+                start_end_slice=sentence_slice,
+                sentences=sentences,
+                stopword_store=self.stopword_store,
+                translate=self.translate,
+                translator=self.translator,
+            )
+            for page_number, sentence_slice, sentences in page_spans
+        ]
+        # each page's key words depend on the pages before it, so extract them now in book order
+        executor = self.executor if self.parallel_key_words else None
+        return materialize_pages(pages, translate=self.translate, executor=executor)
+
+
+def sentences_to_pages(
+    page_sentences: list[tuple],
+    stopword_store: StopwordStore = None,
+    parallel: bool = False,
+    max_workers: int = None,
+    translate: bool = True,
+    translator=translator_fn,
+    key_word_engine: str = "yake",
+):
     """
-    Converts a list of Sentence objects into a list of Page objects.
+    Converts Sentence objects grouped by page into a list of Page objects.
 
     Args:
-        sentences (list[Sentence]): List of Sentence objects.
+        page_sentences (list[tuple[str, list[Sentence], bool]]): Page id, sentences and whether the page ends, see page_sentences_from_results.
+        stopword_store (StopwordStore, optional): Book stopwords shared by the pages. Defaults to a new StopwordStore.
+        parallel (bool, optional): Whether to extract the key words of the pages in a process pool, see extract_key_words_parallel. Defaults to False.
+        max_workers (int, optional): Number of processes when parallel. Defaults to the number of cpus.
+        translate (bool, optional): Whether each page translates its key words, if False use translate_pages to translate every page at once. Defaults to True.
+        translator (TranslationBackend | callable, optional): Backend or translator function to translate key words. Defaults to translator_fn.
+        key_word_engine (str, optional): "yake" to extract each page's key words from its own text, or "tfidf" to
+            score every page at once against the whole book, see tfidf_key_words. Defaults to "yake".
 
     Returns:
         list[Page]: List of Page objects.
 
+    Note:
+        The book stop words are written to disk once all pages are made.
+        The key words are the same whether or not parallel is used, parallel is not used by "tfidf".
     """
-    page_list = []
-    for index, sentence_dict in enumerate(sentences):
-        delimiter = sentence_dict.tokens[0]["form"]
-        if delimiter.startswith(PAGE_START_DELIMITER):
-            page_number = delimiter.split("_")[-1]
-            start_idx = index
-        if delimiter.startswith(PAGE_END_DELIMITER):
-            end_idx = index
-            sentence_slice = slice(start_idx, end_idx)
-            page_sentences = sentences[sentence_slice]
-
-            page_list.append(
-                Page(
-                    page_number=page_number,
-                    start_end_slice=sentence_slice,
-                    sentences=page_sentences,
-                )
+    if key_word_engine not in KEY_WORD_ENGINES:
+        raise ValueError(
+            f"key_word_engine must be one of {', '.join(KEY_WORD_ENGINES)}, not {key_word_engine!r}"
+        )
+
+    if key_word_engine == "tfidf":
+        assembler = PageAssembler(stopword_store=stopword_store)
+        page_spans = assembler.collect_page_spans(page_sentences)
+        page_key_words = extract_key_words_tfidf(
+            [span[2] for span in page_spans], assembler.stopword_store
+        )
+        pages = [
+            Page(
+                page_number=page_number,
+                start_end_slice=sentence_slice,
+                sentences=sentences,
+                extracted_key_words=key_words,
+                translate=translate,
+                translator=translator,
+            )
+            for (page_number, sentence_slice, sentences), key_words in zip(
+                page_spans, page_key_words
             )
+        ]
+        assembler.stopword_store.flush()
+        return materialize_pages(pages, translate=translate)
+
+    executor = ProcessPoolExecutor(max_workers=max_workers) if parallel else None
+    try:
+        assembler = PageAssembler(
+            stopword_store=stopword_store,
+            executor=executor,
+            translate=translate,
+            translator=translator,
+            parallel_key_words=parallel,
+        )
+        pages = assembler.add_pages(page_sentences)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-    return page_list
+    assembler.stopword_store.flush()
+    return pages
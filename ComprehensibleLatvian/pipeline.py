@@ -0,0 +1,167 @@
+import asyncio
+from concurrent.futures import Executor
+
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.epub import iter_text_from_epub
+from ComprehensibleLatvian.nlp_client import NLPBackend, NLPClient
+from ComprehensibleLatvian.page_objects import (
+    LemmaContainer,
+    PageAssembler,
+    StopwordStore,
+    flatten_page_sentences,
+    page_sentences_from_results,
+)
+from ComprehensibleLatvian.token_store import TokenStore
+from ComprehensibleLatvian.translation import translator_fn
+
+# marks the end of the items put on a stage's queue
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def _extract_stage(chunks, chunk_queue: asyncio.Queue):
+    try:
+        while True:
+            # extraction is blocking html parsing so keep it off the event loop
+            chunk = await asyncio.to_thread(next, chunks, _DONE)
+            await chunk_queue.put(chunk)
+            if chunk is _DONE:
+                return
+    except Exception as e:
+        await chunk_queue.put(_StageError(e))
+
+
+async def _request_stage(
+    client: NLPBackend, chunk_queue: asyncio.Queue, result_queue: asyncio.Queue
+):
+    while True:
+        chunk = await chunk_queue.get()
+        if chunk is _DONE or isinstance(chunk, _StageError):
+            await result_queue.put(chunk)
+            return
+        # the queue holds the request tasks in chunk order, its size caps how many run ahead
+        task = asyncio.ensure_future(client.analyse(chunk))
+        # the chunk's page offsets are needed to place the result's sentences on pages
+        await result_queue.put((chunk, task))
+
+
+async def stream_pages(
+    epub_file_path: str,
+    page_chunk_size: int = 10,
+    max_chunk_size: int = None,
+    size_unit: str = "chars",
+    engine: str = "bs4",
+    client: NLPBackend = None,
+    cache: ResponseCache = None,
+    lemma_container: LemmaContainer = None,
+    token_store: TokenStore = None,
+    stopword_store: StopwordStore = None,
+    executor: Executor = None,
+    translate: bool = True,
+    translator=translator_fn,
+    max_queued_chunks: int = 2,
+    parallel_key_words: bool = False,
+):
+    """
+    Asynchronously streams Page objects out of an EPUB as its chunks are extracted and processed.
+
+    Args:
+        epub_file_path (str): Path to the EPUB file.
+        page_chunk_size (int, optional): Number of pages in each chunk. Defaults to 10.
+        max_chunk_size (int, optional): If set chapters are packed into chunks of up to this size instead of by page_chunk_size. Defaults to None.
+        size_unit (str, optional): Whether max_chunk_size counts "chars" or UTF-8 "bytes". Defaults to "chars".
+        engine (str, optional): Html to text engine, see html_to_text. Defaults to "bs4".
+        client (NLPBackend, optional): Backend to analyse the chunks with. Defaults to a new NLPClient using cache.
+        cache (ResponseCache, optional): Cache of previous NLP responses. Defaults to None.
+        lemma_container (LemmaContainer, optional): Container the sentences are added to as they arrive. Defaults to None.
+        token_store (TokenStore, optional): Store the tokens of the book's sentences are kept in. Defaults to a new TokenStore.
+        stopword_store (StopwordStore, optional): Book stopwords shared by the pages. Defaults to a new StopwordStore.
+        executor (Executor, optional): Process pool to extract the chapters' text in parallel, and with parallel_key_words the key words of a chunk's pages. Defaults to None.
+        translate (bool, optional): Whether each page translates its key words, if False use translate_pages once the stream is done. Defaults to True.
+        translator (TranslationBackend | callable, optional): Backend or translator function to translate key words. Defaults to translator_fn.
+        max_queued_chunks (int, optional): Size of the queues between the extract, request and page stages. Defaults to 2.
+        parallel_key_words (bool, optional): Whether to extract the key words of a chunk's pages in executor, see
+            extract_key_words_parallel. Defaults to False.
+
+    Yields:
+        Page: Pages in book order, each one as soon as all of its sentences have been returned by the NLP API.
+
+    Note:
+        Extraction, NLP requests and page building run concurrently. The bounded queues stop extraction
+        running ahead of the NLP API so only a few chunks are held in memory at once.
+        The lemma_container is only complete, and the book stop words only written, once the stream is exhausted.
+
+    Example:
+        ```python
+        lemma_container = LemmaContainer()
+        async for page in stream_pages("sample.epub", lemma_container=lemma_container):
+            print(page.page_number, page.key_words)
+        ```
+    """
+    own_client = client is None
+    if own_client:
+        client = NLPClient(cache=cache)
+
+    chunk_queue = asyncio.Queue(maxsize=max_queued_chunks)
+    result_queue = asyncio.Queue(maxsize=max_queued_chunks)
+
+    chunks = iter_text_from_epub(
+        epub_file_path,
+        page_chunk_size=page_chunk_size,
+        max_chunk_size=max_chunk_size,
+        size_unit=size_unit,
+        engine=engine,
+        executor=executor,
+    )
+    stages = [
+        asyncio.create_task(_extract_stage(chunks, chunk_queue)),
+        asyncio.create_task(_request_stage(client, chunk_queue, result_queue)),
+    ]
+
+    if token_store is None:
+        token_store = TokenStore()
+
+    assembler = PageAssembler(
+        stopword_store=stopword_store,
+        executor=executor,
+        translate=translate,
+        translator=translator,
+        parallel_key_words=parallel_key_words,
+    )
+    try:
+        while True:
+            item = await result_queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+
+            chunk, task = item
+            result = await task
+            page_sentences = page_sentences_from_results(
+                [chunk], [result], store=token_store
+            )
+            if lemma_container is not None:
+                lemma_container.sentences_to_lemmas(
+                    flatten_page_sentences(page_sentences)
+                )
+
+            # keyword extraction and translation block, run them in a thread so requests keep flowing
+            pages = await asyncio.to_thread(assembler.add_pages, page_sentences)
+            for page in pages:
+                yield page
+
+        assembler.stopword_store.flush()
+    finally:
+        for stage in stages:
+            stage.cancel()
+        while not result_queue.empty():
+            item = result_queue.get_nowait()
+            if isinstance(item, tuple):
+                item[1].cancel()
+        if own_client:
+            await client.close()
@@ -0,0 +1,209 @@
+import numpy as np
+
+from ComprehensibleLatvian.instrumentation import stage
+
+
+class PageLemmaMatrix:
+    def __init__(self, rows, cols, counts, vocabulary, first_stop_page, page_count):
+        """
+        Initializes a sparse page × lemma count matrix in coordinate format.
+
+        Args:
+            rows (np.ndarray): Page index of each non zero entry, sorted.
+            cols (np.ndarray): Term index of each entry.
+            counts (np.ndarray): Number of times the term occurs on the page.
+            vocabulary (list[str]): The lowercase lemma of each term index.
+            first_stop_page (np.ndarray): Index of the first page each term is a stop word (named entity) on, page_count if never.
+            page_count (int): Number of pages, including pages without any terms.
+
+        Attributes:
+            rows, cols, counts, vocabulary, first_stop_page, page_count: As above.
+            term_ids (dict[str, int]): The term index of each lemma in vocabulary.
+
+        Note:
+            Built with page_lemma_matrix, numpy has no sparse matrices so the entries are kept as three arrays.
+        """
+        self.rows = rows
+        self.cols = cols
+        self.counts = counts
+        self.vocabulary = vocabulary
+        self.first_stop_page = first_stop_page
+        self.page_count = page_count
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+
+    def document_frequency(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Number of pages each term occurs on.
+        """
+        return np.bincount(self.cols, minlength=len(self.vocabulary))
+
+    def term_mask(self, words) -> np.ndarray:
+        """
+        Args:
+            words (Iterable[str]): Words, e.g. stop words, words not in the vocabulary are ignored.
+
+        Returns:
+            np.ndarray: Boolean mask over the vocabulary, True for the terms in words.
+        """
+        mask = np.zeros(len(self.vocabulary), dtype=bool)
+        ids = [self.term_ids[word] for word in words if word in self.term_ids]
+        mask[ids] = True
+        return mask
+
+
+def _column(values) -> np.ndarray:
+    # a TokenStore column, an array or a memoryview of a saved book, without copying it
+    return np.asarray(values, dtype=np.uint32)
+
+
+def _select_rows(starts: np.ndarray, indices: np.ndarray):
+    # the positions in a column of every row in indices, rows are delimited by starts
+    first = starts[indices].astype(np.int64)
+    lengths = starts[indices + 1].astype(np.int64) - first
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(first - offsets, lengths)
+    return positions, lengths
+
+
+def page_lemma_matrix(pages_sentences: list[list]) -> PageLemmaMatrix:
+    """
+    Counts the lemmas of every page in one pass over the book's TokenStore.
+
+    Args:
+        pages_sentences (list[list[Sentence]]): The sentences of each page in book order, all in the same TokenStore.
+
+    Returns:
+        PageLemmaMatrix: The lemma counts of every page and the first page each named entity word is on.
+
+    Note:
+        Terms are lowercase lemmas made only of letters, like the words YAKE gives as key words. Punctuation and
+        numbers are left out.
+    """
+    stores = {
+        id(sentence.store): sentence.store
+        for sentences in pages_sentences
+        for sentence in sentences
+    }
+    if len(stores) > 1:
+        raise ValueError("the sentences of every page must be in one TokenStore")
+    page_count = len(pages_sentences)
+    if not stores:
+        empty = np.zeros(0, dtype=np.int64)
+        return PageLemmaMatrix(empty, empty, empty, [], empty, page_count)
+    (store,) = stores.values()
+
+    # term of every string in the store, -1 for strings that can't be key words
+    term_ids = {}
+    string_terms = np.full(len(store.strings), -1, dtype=np.int64)
+    for string_id, string in enumerate(store.strings):
+        term = string.lower()
+        if term.isalpha():
+            string_terms[string_id] = term_ids.setdefault(term, len(term_ids))
+    vocabulary = list(term_ids)
+    term_count = len(vocabulary)
+
+    sentence_ids = np.fromiter(
+        (sentence.index for sentences in pages_sentences for sentence in sentences),
+        dtype=np.int64,
+    )
+    sentence_pages = np.repeat(
+        np.arange(page_count, dtype=np.int64),
+        [len(sentences) for sentences in pages_sentences],
+    )
+
+    positions, lengths = _select_rows(_column(store.token_starts), sentence_ids)
+    token_terms = string_terms[_column(store.lemma_ids)[positions]]
+    token_pages = np.repeat(sentence_pages, lengths)
+    keep = token_terms >= 0
+    # one key per page and term, np.unique sorts them by page then term and counts them
+    keys, counts = np.unique(
+        token_pages[keep] * term_count + token_terms[keep], return_counts=True
+    )
+
+    positions, lengths = _select_rows(_column(store.stop_word_starts), sentence_ids)
+    stop_terms = string_terms[_column(store.stop_word_ids)[positions]]
+    stop_pages = np.repeat(sentence_pages, lengths)
+    keep = stop_terms >= 0
+    first_stop_page = np.full(term_count, page_count, dtype=np.int64)
+    np.minimum.at(first_stop_page, stop_terms[keep], stop_pages[keep])
+
+    return PageLemmaMatrix(
+        rows=keys // term_count,
+        cols=keys % term_count,
+        counts=counts,
+        vocabulary=vocabulary,
+        first_stop_page=first_stop_page,
+        page_count=page_count,
+    )
+
+
+def tfidf_scores(matrix: PageLemmaMatrix) -> np.ndarray:
+    """
+    Scores how distinctive each term is for each page it is on.
+
+    Args:
+        matrix (PageLemmaMatrix): The lemma counts of the pages.
+
+    Returns:
+        np.ndarray: Score of each entry of the matrix, (1 + log count) * log(pages / pages with the term).
+            A term on every page scores 0.
+    """
+    idf = np.log(matrix.page_count / np.maximum(matrix.document_frequency(), 1))
+    return (1.0 + np.log(matrix.counts)) * idf[matrix.cols]
+
+
+def tfidf_key_words(
+    pages_sentences: list[list], stopwords=frozenset(), no_key_words=20
+) -> list[list[str]]:
+    """
+    Finds the key words of every page at once from the statistics of the whole book.
+
+    Args:
+        pages_sentences (list[list[Sentence]]): The sentences of each page in book order, all in the same TokenStore.
+        stopwords (Iterable[str], optional): Words never returned as key words, e.g. StopwordStore.all_stopwords(). Defaults to none.
+        no_key_words (int, optional): Number of key words per page. Defaults to 20.
+
+    Returns:
+        list[list[str]]: The key words of each page, most distinctive first.
+
+    Note:
+        Follows the same rules as YAKE page by page: a named entity is a stop word from the first page it is on,
+        and a word is only a key word of the first page it is picked for. Scoring and the stop word and named
+        entity filters are done on the whole matrix, only picking the top words of each page goes page by page.
+
+    Example:
+        ```python
+        page_spans = PageAssembler().collect_page_spans(page_sentences)
+        key_words = tfidf_key_words([span[2] for span in page_spans], stopword_store.all_stopwords())
+        ```
+    """
+    with stage("tfidf") as timed:
+        matrix = page_lemma_matrix(pages_sentences)
+        scores = tfidf_scores(matrix)
+
+        keep = (
+            (scores > 0)
+            & ~matrix.term_mask(stopwords)[matrix.cols]
+            & (matrix.rows < matrix.first_stop_page[matrix.cols])
+        )
+        rows, cols, scores = matrix.rows[keep], matrix.cols[keep], scores[keep]
+        # by page, then highest score, then the term seen first in the book
+        order = np.lexsort((cols, -scores, rows))
+        rows, cols = rows[order], cols[order]
+        page_starts = np.searchsorted(rows, np.arange(matrix.page_count + 1))
+
+        vocabulary = matrix.vocabulary
+        picked = set()
+        key_words = []
+        for page in range(matrix.page_count):
+            page_key_words = []
+            for term in cols[page_starts[page] : page_starts[page + 1]].tolist():
+                if len(page_key_words) == no_key_words:
+                    break
+                if term not in picked:
+                    picked.add(term)
+                    page_key_words.append(vocabulary[term])
+            key_words.append(page_key_words)
+        timed.add(items=matrix.page_count)
+    return key_words
@@ -0,0 +1,268 @@
+import itertools
+from array import array
+
+# text id of a sentence that has no span in a text buffer
+NO_TEXT = 0xFFFFFFFF
+
+
+class TokenStore:
+    def __init__(self):
+        """
+        Initializes a TokenStore object.
+
+        Attributes:
+            strings (list[str]): String table, every form, lemma and stop word is stored once.
+            form_ids (array): String id of the form of every token in the book.
+            lemma_ids (array): String id of the lemma of every token in the book.
+            token_starts (array): Index of the first token of each sentence, with a final entry for the end of the last sentence.
+            stop_word_ids (array): String ids of the stop words (named entities) of every sentence.
+            stop_word_starts (array): Index of the first stop word of each sentence, with a final entry.
+            texts (list[str]): Text buffers the sentences were found in, e.g. the text of each NLP request or chapter.
+            text_ids (array): Index in texts of every sentence's text, NO_TEXT if the sentence has none.
+            text_spans (array): Start and end character offset of every sentence in its text, two entries per sentence.
+
+        Note:
+            Stores the tokens of every sentence of a book in columns of ids into one string table instead of a dict per token.
+            Sentence objects are views onto a row of the store. The text of a sentence is a slice of its text buffer,
+            so it keeps the spacing of the book and no sentence text is stored twice.
+
+        Example:
+            ```python
+            token_store = TokenStore()
+            sentence_list = [Sentence(sentence, token_store) for sentence in result["sentences"]]
+            ```
+        """
+        self.strings: list[str] = []
+        self._string_ids: dict[str, int] = {}
+
+        self.form_ids = array("I")
+        self.lemma_ids = array("I")
+        self.token_starts = array("I", [0])
+        self.stop_word_ids = array("I")
+        self.stop_word_starts = array("I", [0])
+
+        self.texts: list[str] = []
+        self.text_ids = array("I")
+        self.text_spans = array("I")
+
+    @classmethod
+    def from_columns(
+        cls,
+        strings,
+        form_ids,
+        lemma_ids,
+        token_starts,
+        stop_word_ids,
+        stop_word_starts,
+        texts=(),
+        text_ids=None,
+        text_spans=None,
+    ) -> "TokenStore":
+        """
+        Creates a TokenStore from existing columns, e.g memoryviews of a saved book.
+
+        Args:
+            strings (Sequence[str]): String table.
+            form_ids (Sequence[int]): String id of the form of every token.
+            lemma_ids (Sequence[int]): String id of the lemma of every token.
+            token_starts (Sequence[int]): Index of the first token of each sentence, with a final entry.
+            stop_word_ids (Sequence[int]): String ids of the stop words of every sentence.
+            stop_word_starts (Sequence[int]): Index of the first stop word of each sentence, with a final entry.
+            texts (Sequence[str], optional): Text buffers of the sentences. Defaults to none.
+            text_ids (Sequence[int], optional): Index in texts of every sentence's text. Defaults to no sentence having a text.
+            text_spans (Sequence[int], optional): Start and end offset of every sentence in its text. Defaults to None.
+
+        Returns:
+            TokenStore: Store reading from the columns, they are only copied if sentences are added to it.
+        """
+        store = cls.__new__(cls)
+        store.strings = strings
+        store._string_ids = None
+        store.form_ids = form_ids
+        store.lemma_ids = lemma_ids
+        store.token_starts = token_starts
+        store.stop_word_ids = stop_word_ids
+        store.stop_word_starts = stop_word_starts
+        store.texts = texts
+        if text_ids is None:
+            text_ids = array("I", [NO_TEXT]) * (len(token_starts) - 1)
+            text_spans = array("I", [0, 0]) * (len(token_starts) - 1)
+        store.text_ids = text_ids
+        store.text_spans = text_spans
+        return store
+
+    def _make_writable(self):
+        # copy columns made by from_columns so the store can grow
+        self.strings = list(self.strings)
+        self._string_ids = {string: i for i, string in enumerate(self.strings)}
+        self.texts = list(self.texts)
+        for name in (
+            "form_ids",
+            "lemma_ids",
+            "token_starts",
+            "stop_word_ids",
+            "stop_word_starts",
+            "text_ids",
+            "text_spans",
+        ):
+            setattr(self, name, array("I", getattr(self, name)))
+
+    def intern(self, string: str) -> int:
+        """
+        Returns the id of a string, adding it to the string table if it is new.
+
+        Args:
+            string (str): The string.
+
+        Returns:
+            int: The string id.
+        """
+        if self._string_ids is None:
+            self._make_writable()
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self._string_ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    def add_text(self, text: str) -> int:
+        """
+        Adds a text buffer the spans of sentences point into.
+
+        Args:
+            text (str): The text, e.g. an NLP request's chunk or a chapter, it is kept as is, not copied.
+
+        Returns:
+            int: The text id.
+        """
+        if self._string_ids is None:
+            self._make_writable()
+        self.texts.append(text)
+        return len(self.texts) - 1
+
+    def add_sentence(self, sentence: dict, text_id: int = None) -> int:
+        """
+        Adds a sentence as returned from nlp.ailab.lv/api/nlp.
+
+        Args:
+            sentence (dict): Dictionary with the "tokens" and "ner" of the sentence, and the "text_span" (start, end)
+                in the text text_id that align_chunk_sentences adds.
+            text_id (int, optional): Id of the text buffer the sentence is in, see add_text. Defaults to None.
+
+        Returns:
+            int: Index of the sentence in the store.
+        """
+        # split named entities into single words
+        stop_words = set(
+            itertools.chain.from_iterable(
+                [ne["text"].lower().split(" ") for ne in sentence["ner"]]
+            )
+        )
+        tokens = sentence["tokens"]
+        span = sentence.get("text_span")
+        return self.add_tokens(
+            [token["form"] for token in tokens],
+            [token["lemma"] for token in tokens],
+            stop_words,
+            None if text_id is None or span is None else (text_id, *span),
+        )
+
+    def add_tokens(
+        self, forms: list[str], lemmas: list[str], stop_words, span: tuple = None
+    ) -> int:
+        """
+        Adds a sentence from its forms, lemmas and stop words.
+
+        Args:
+            forms (list[str]): The form of every token in the sentence.
+            lemmas (list[str]): The lemma of every token in the sentence.
+            stop_words (Iterable[str]): The stop words of the sentence.
+            span (tuple[int, int, int], optional): Text id, start and end offset of the sentence's text. Defaults to
+                None, the text is then made from the forms.
+
+        Returns:
+            int: Index of the sentence in the store.
+        """
+        if self._string_ids is None:
+            self._make_writable()
+        intern = self.intern
+        # most strings are already interned, look them up without a call
+        get_id = self._string_ids.get
+        form_ids, lemma_ids = self.form_ids, self.lemma_ids
+        for form, lemma in zip(forms, lemmas):
+            form_id = get_id(form)
+            form_ids.append(intern(form) if form_id is None else form_id)
+            lemma_id = get_id(lemma)
+            lemma_ids.append(intern(lemma) if lemma_id is None else lemma_id)
+        self.token_starts.append(len(form_ids))
+
+        self.stop_word_ids.extend(intern(word) for word in stop_words)
+        self.stop_word_starts.append(len(self.stop_word_ids))
+
+        if span is None:
+            self.text_ids.append(NO_TEXT)
+            self.text_spans.extend((0, 0))
+        else:
+            self.text_ids.append(span[0])
+            self.text_spans.extend(span[1:])
+
+        return len(self.token_starts) - 2
+
+    def __len__(self):
+        # len is the number of sentences
+        return len(self.token_starts) - 1
+
+    def token_count(self, index: int) -> int:
+        """
+        Returns:
+            int: Number of tokens in the sentence at index.
+        """
+        return self.token_starts[index + 1] - self.token_starts[index]
+
+    def forms(self, index: int) -> list[str]:
+        """
+        Returns:
+            list[str]: The form of every token in the sentence at index.
+        """
+        strings = self.strings
+        start, end = self.token_starts[index], self.token_starts[index + 1]
+        return [strings[i] for i in self.form_ids[start:end]]
+
+    def lemmas(self, index: int) -> list[str]:
+        """
+        Returns:
+            list[str]: The lemma of every token in the sentence at index.
+        """
+        strings = self.strings
+        start, end = self.token_starts[index], self.token_starts[index + 1]
+        return [strings[i] for i in self.lemma_ids[start:end]]
+
+    def stop_words(self, index: int) -> set:
+        """
+        Returns:
+            set: The stop words of the sentence at index.
+        """
+        strings = self.strings
+        start, end = self.stop_word_starts[index], self.stop_word_starts[index + 1]
+        return {strings[i] for i in self.stop_word_ids[start:end]}
+
+    def span(self, index: int):
+        """
+        Returns:
+            tuple[int, int, int]: Text id, start and end offset of the sentence at index, None if it has no text.
+        """
+        text_id = self.text_ids[index]
+        if text_id == NO_TEXT:
+            return None
+        return text_id, self.text_spans[2 * index], self.text_spans[2 * index + 1]
+
+    def text(self, index: int):
+        """
+        Returns:
+            str: The text of the sentence at index, a slice of its text buffer, None if it has no text.
+        """
+        text_id = self.text_ids[index]
+        if text_id == NO_TEXT:
+            return None
+        return self.texts[text_id][self.text_spans[2 * index] : self.text_spans[2 * index + 1]]
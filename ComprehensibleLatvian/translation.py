@@ -0,0 +1,486 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import statistics
+import time
+from abc import ABC, abstractmethod
+
+from ComprehensibleLatvian.instrumentation import stage
+
+# google translate isn't very good, the translator is made on first use, see get_translator
+_translator = None
+
+
+def get_translator():
+    """
+    Returns:
+        googletrans.Translator: The translator used by translator_fn, created and googletrans imported on first use.
+    """
+    global _translator
+    if _translator is None:
+        from googletrans import Translator
+
+        _translator = Translator()
+    return _translator
+
+
+def translator_fn(words, **kwargs):
+    """
+    Translates words from Latvian with googletrans.
+
+    Args:
+        words (list[str]): Words to translate.
+        **kwargs: Passed on to googletrans' Translator.translate, e.g. dest.
+
+    Returns:
+        list: googletrans translations, each has the translated word as text.
+    """
+    return get_translator().translate(words, src="lv", **kwargs)
+
+
+def __getattr__(name):
+    # translator used to be made when the module was imported
+    if name == "translator":
+        return get_translator()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# deepl also is not very good :(
+# import deepl
+# translator = deepl.Translator(os.environ.get("deepl_auth_key"))
+# translator_fn = partial(
+#     translator.translate_text, source_lang="LV", target_lang="EN-GB", preserve_formatting=True
+# )
+
+
+class TranslationBackend(ABC):
+    # name used in the translation cache key, override in subclasses
+    name = "base"
+
+    def __init__(
+        self, src="lv", dest="en", max_concurrency=4, timeout=30.0, batch_size=100
+    ):
+        """
+        Initializes a translation backend.
+
+        Args:
+            src (str, optional): Source language. Defaults to "lv".
+            dest (str, optional): Destination language. Defaults to "en".
+            max_concurrency (int, optional): Maximum number of batches being translated at once. Defaults to 4.
+            timeout (float, optional): Timeout in seconds of translating one batch. Defaults to 30.
+            batch_size (int, optional): Number of words translated in one call. Defaults to 100.
+
+        Attributes:
+            latencies (list[float]): Time in seconds of every call to the translator.
+
+        Note:
+            Subclasses implement _translate_batch, an async function translating at most batch_size words.
+
+        Example:
+            ```python
+            backend = DictionaryBackend("lv_en.tsv")
+            pages = sentences_to_pages(page_sentences, translator=backend)
+            print(backend.latency_stats())
+            ```
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least one")
+
+        self.src = src
+        self.dest = dest
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.latencies: list[float] = []
+
+    @abstractmethod
+    async def _translate_batch(self, words: list[str]) -> list[str]:
+        """
+        Translates at most batch_size words.
+
+        Args:
+            words (list[str]): Words to translate.
+
+        Returns:
+            list[str]: Translation of each word in the same order as words.
+        """
+
+    async def _timed_batch(self, words: list[str], semaphore: asyncio.Semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                return await asyncio.wait_for(
+                    self._translate_batch(words), timeout=self.timeout
+                )
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+
+    async def translate_batch(self, words: list[str]) -> list[str]:
+        """
+        Asynchronously translates words, split into batches translated concurrently.
+
+        Args:
+            words (list[str]): Words to translate.
+
+        Returns:
+            list[str]: Translation of each word in the same order as words.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = [
+            words[start : start + self.batch_size]
+            for start in range(0, len(words), self.batch_size)
+        ]
+        results = await asyncio.gather(
+            *[self._timed_batch(batch, semaphore) for batch in batches]
+        )
+        return [translation for batch in results for translation in batch]
+
+    def translate(self, words: list[str]) -> list[str]:
+        """
+        Translates words, blocking until they are all translated.
+
+        Args:
+            words (list[str]): Words to translate.
+
+        Returns:
+            list[str]: Translation of each word in the same order as words.
+
+        Note:
+            Can't be called from a running event loop, await translate_batch there instead.
+        """
+        if not words:
+            return []
+        return asyncio.run(self.translate_batch(list(words)))
+
+    def latency_stats(self) -> dict:
+        """
+        Summarises the time of the calls made to the translator.
+
+        Returns:
+            dict: Dictionary of calls, total, mean, median and max latency in seconds.
+        """
+        if not self.latencies:
+            return {"calls": 0, "total": 0.0}
+
+        return {
+            "calls": len(self.latencies),
+            "total": sum(self.latencies),
+            "mean": statistics.fmean(self.latencies),
+            "median": statistics.median(self.latencies),
+            "max": max(self.latencies),
+        }
+
+
+class GoogleTranslateBackend(TranslationBackend):
+    # googletrans blocks so batches are run in threads, needs network access
+    name = "googletrans"
+
+    async def _translate_batch(self, words: list[str]) -> list[str]:
+        from googletrans import Translator
+
+        # googletrans' client isn't thread safe so each batch gets its own
+        translations = await asyncio.to_thread(
+            Translator().translate, words, src=self.src, dest=self.dest
+        )
+        return [translation.text for translation in translations]
+
+
+class DictionaryBackend(TranslationBackend):
+    def __init__(
+        self,
+        path=None,
+        entries: dict[str, str] = None,
+        missing="",
+        src="lv",
+        dest="en",
+        batch_size=1000,
+    ):
+        """
+        Initializes an offline backend translating from a local dictionary file.
+
+        Args:
+            path (str, optional): Path to a UTF-8 file with one "word<TAB>translation" per line, lines starting with # are skipped. Defaults to None.
+            entries (dict[str, str], optional): Extra dictionary entries, these take priority over the file. Defaults to None.
+            missing (str, optional): Translation given to words not in the dictionary. Defaults to "".
+            src (str, optional): Source language. Defaults to "lv".
+            dest (str, optional): Destination language. Defaults to "en".
+            batch_size (int, optional): Number of words translated in one call. Defaults to 1000.
+
+        Attributes:
+            dictionary (dict[str, str]): Translation of each word, words are lower case.
+            name (str): "dictionary:" and a digest of the dictionary and missing, so translations cached from
+                different dictionaries are kept apart.
+
+        Note:
+            When a word is in the file more than once the first translation is used.
+
+        Example:
+            ```python
+            backend = DictionaryBackend("lv_en.tsv")
+            backend.translate(["māja", "koks"])
+            ```
+        """
+        super().__init__(src=src, dest=dest, max_concurrency=1, batch_size=batch_size)
+        self.missing = missing
+        self.dictionary: dict[str, str] = {}
+
+        if path is not None:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip() or line.startswith("#"):
+                        continue
+                    word, _, translation = line.rstrip("\n").partition("\t")
+                    self.dictionary.setdefault(word.strip().lower(), translation.strip())
+
+        if entries is not None:
+            self.dictionary.update(
+                {word.lower(): translation for word, translation in entries.items()}
+            )
+
+        digest = hashlib.sha256(missing.encode("utf-8"))
+        for word, translation in sorted(self.dictionary.items()):
+            digest.update(f"\n{word}\t{translation}".encode("utf-8"))
+        self.name = f"dictionary:{digest.hexdigest()[:16]}"
+
+    async def _translate_batch(self, words: list[str]) -> list[str]:
+        return [self.dictionary.get(word.lower(), self.missing) for word in words]
+
+
+def translate_words(words: list[str], translator=translator_fn) -> list[str]:
+    """
+    Translates words with either a TranslationBackend or a googletrans style translator function.
+
+    Args:
+        words (list[str]): Words to translate.
+        translator (TranslationBackend | callable, optional): The translator. Defaults to translator_fn.
+
+    Returns:
+        list[str]: Translation of each word in the same order as words.
+    """
+    with stage("translation") as timed:
+        timed.add(items=len(words))
+        if isinstance(translator, TranslationBackend):
+            return translator.translate(words)
+        return [translation.text for translation in translator(words)]
+
+
+class TranslationCache:
+    def __init__(self, path=None, timeout=5.0):
+        """
+        Initializes a persistent SQLite cache of key word translations.
+
+        Args:
+            path (str, optional): Path to the SQLite database. Defaults to ./translations.sqlite3 in the working directory.
+            timeout (float, optional): Seconds to wait for another process's write to finish before raising. Defaults to 5.
+
+        Attributes:
+            path (str): Path to the SQLite database.
+            hits (int): Number of key words found in the cache.
+            misses (int): Number of key words not found in the cache.
+
+        Note:
+            Translations are keyed by lemma, language pair and backend, so switching translator never returns
+            another translator's translation.
+
+        Example:
+            ```python
+            with TranslationCache() as cache:
+                translate_pages(pages, cache=cache)
+            ```
+        """
+        if path is None:
+            path = os.path.join(os.getcwd(), "translations.sqlite3")
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._connection = sqlite3.connect(path, timeout=timeout)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS translations (
+                lemma TEXT NOT NULL,
+                src TEXT NOT NULL,
+                dest TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                PRIMARY KEY (lemma, src, dest, backend)
+            ) WITHOUT ROWID
+            """
+        )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        self._connection.close()
+
+    def get_many(
+        self, lemmas: list[str], src: str, dest: str, backend: str
+    ) -> dict[str, str]:
+        """
+        Looks up the cached translations of many lemmas.
+
+        Args:
+            lemmas (list[str]): Lemmas to look up, without duplicates.
+            src (str): Source language.
+            dest (str): Destination language.
+            backend (str): Name of the translator.
+
+        Returns:
+            dict[str, str]: Translation of every lemma found in the cache.
+        """
+        found = {}
+        # stay under sqlite's limit on the number of query parameters
+        for start in range(0, len(lemmas), 500):
+            batch = lemmas[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT lemma, translation FROM translations "
+                f"WHERE src = ? AND dest = ? AND backend = ? AND lemma IN ({placeholders})",
+                (src, dest, backend, *batch),
+            )
+            found.update(rows)
+
+        self.hits += len(found)
+        self.misses += len(lemmas) - len(found)
+        return found
+
+    def set_many(
+        self, translations: dict[str, str], src: str, dest: str, backend: str
+    ) -> None:
+        """
+        Saves many translations in one transaction.
+
+        Args:
+            translations (dict[str, str]): Translation of each lemma.
+            src (str): Source language.
+            dest (str): Destination language.
+            backend (str): Name of the translator.
+        """
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                [
+                    (lemma, src, dest, backend, translation)
+                    for lemma, translation in translations.items()
+                ],
+            )
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Dictionary of hits and misses.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def translate_key_words(
+    key_words: list[str],
+    translator=translator_fn,
+    cache: TranslationCache = None,
+    src="lv",
+    dest="en",
+    backend="googletrans",
+    batch_size=100,
+) -> dict[str, str]:
+    """
+    Translates key words, only sending the ones missing from the cache to the translator.
+
+    Args:
+        key_words (list[str]): Key words to translate, duplicates are only translated once.
+        translator (TranslationBackend | callable, optional): Backend or translator function taking a list of words. Defaults to translator_fn.
+        cache (TranslationCache, optional): Cache of previous translations. Defaults to None.
+        src (str, optional): Source language, used for the cache key. Defaults to "lv".
+        dest (str, optional): Destination language, used for the cache key. Defaults to "en".
+        backend (str, optional): Name of the translator, used for the cache key. Defaults to "googletrans".
+        batch_size (int, optional): Number of key words sent to the translator at once. Defaults to 100.
+
+    Returns:
+        dict[str, str]: Translation of each key word.
+
+    Note:
+        When translator is a TranslationBackend its name, languages and batching are used instead of src, dest, backend and batch_size.
+        Empty translations (words a backend doesn't know) are not cached.
+    """
+    if isinstance(translator, TranslationBackend):
+        src, dest, backend = translator.src, translator.dest, translator.name
+        # the backend splits into batches and translates them concurrently itself
+        batch_size = max(1, translator.batch_size * translator.max_concurrency)
+
+    unique_key_words = list(dict.fromkeys(key_words))
+
+    translations = {}
+    if cache is not None:
+        translations = cache.get_many(unique_key_words, src, dest, backend)
+
+    misses = [word for word in unique_key_words if word not in translations]
+    for start in range(0, len(misses), batch_size):
+        batch = misses[start : start + batch_size]
+        batch_translations = dict(zip(batch, translate_words(batch, translator)))
+        translations.update(batch_translations)
+        if cache is not None:
+            # save each batch as it comes so an error later on doesn't lose it
+            cache.set_many(
+                {
+                    word: translation
+                    for word, translation in batch_translations.items()
+                    if translation
+                },
+                src,
+                dest,
+                backend,
+            )
+
+    return translations
+
+
+def translate_pages(
+    pages: list,
+    translator=translator_fn,
+    cache: TranslationCache = None,
+    src="lv",
+    dest="en",
+    backend="googletrans",
+    batch_size=100,
+) -> None:
+    """
+    Translates the key words of every page at once, each unique key word is translated only once.
+
+    Args:
+        pages (list[Page]): Pages, usually made with translate=False.
+        translator (TranslationBackend | callable, optional): Backend or translator function taking a list of words. Defaults to translator_fn.
+        cache (TranslationCache, optional): Cache of previous translations. Defaults to None.
+        src (str, optional): Source language, used for the cache key. Defaults to "lv".
+        dest (str, optional): Destination language, used for the cache key. Defaults to "en".
+        backend (str, optional): Name of the translator, used for the cache key. Defaults to "googletrans".
+        batch_size (int, optional): Number of key words sent to the translator at once. Defaults to 100.
+
+    Returns:
+        None. Sets translated_kws and key_words of every page.
+
+    Example:
+        ```python
+        pages = sentences_to_pages(page_sentences, translate=False)
+        with TranslationCache() as cache:
+            translate_pages(pages, cache=cache)
+        ```
+    """
+    translations = translate_key_words(
+        [word for page in pages for word in page._key_words],
+        translator=translator,
+        cache=cache,
+        src=src,
+        dest=dest,
+        backend=backend,
+        batch_size=batch_size,
+    )
+    for page in pages:
+        page.set_translations(translations)
@@ -0,0 +1,208 @@
+"""
+Compares making Anki clozes with str.replace, one scan per key word, and with a ClozeMatcher, one pass per sentence.
+
+Usage:
+    python benchmarks/cloze_engines.py [--scale 10] [--repeat 5] [--alternatives 10]
+
+Uses the same books and NLP fixtures as pipeline_stages.py, with TF-IDF key words. Times
+- making the cards of every page, with a matcher per page or one for the book, with one cloze per card and up to 3,
+- clozing up to --alternatives example sentences of each key word, as when looking for a better example,
+- clozing every key word of a page in every sentence of the page, and every key word of the book in every sentence.
+Prints the best wall time of each over the repeats and how many of the clozed texts have a cloze inside a
+longer word.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, ".")
+
+from pipeline_stages import book_path, nlp_results  # noqa: E402
+
+from ComprehensibleLatvian.anki import card_matcher, to_anki_cards  # noqa: E402
+from ComprehensibleLatvian.cloze import ClozeMatcher  # noqa: E402
+from ComprehensibleLatvian.epub import extract_text_from_epub  # noqa: E402
+from ComprehensibleLatvian.page_objects import (  # noqa: E402
+    LemmaContainer,
+    StopwordStore,
+    flatten_page_sentences,
+    page_sentences_from_results,
+    sentences_to_pages,
+)
+
+# a cloze with a letter right before or after it, the form was part of a longer word
+_INSIDE_WORD = re.compile(r"\w\{\{c\d+::[^}]*\}\}|\{\{c\d+::[^}]*\}\}\w")
+
+
+def replace_cards(key_words: list[tuple], lemma_container) -> list[dict]:
+    # to_anki_cards as it was, one str.replace of the form per card
+    anki_cards = []
+    for kw, trans in key_words:
+        example = lemma_container.card_example(kw)
+        if example is None:
+            continue
+        form, sentence = example
+        anki_cards.append(
+            {
+                "header": f"{'_' if kw == form else kw } ({trans})",
+                "cloze_string": sentence.text.replace(form, f"{{{{c1::{form}}}}}"),
+                "backside": "",
+            }
+        )
+    return anki_cards
+
+
+def example_sentences(key_words: list[tuple], lemma_container, alternatives: int) -> list[tuple]:
+    # the card form of each key word and up to alternatives sentences it is in
+    examples = []
+    for kw, _ in key_words:
+        example = lemma_container.card_example(kw)
+        if example is None:
+            continue
+        form = example[0]
+        sentence_ids = lemma_container.lemmas[kw].word_forms[form].sentence_ids[:alternatives]
+        examples.append((form, [lemma_container.sentences[i].text for i in sentence_ids]))
+    return examples
+
+
+def replace_alternatives(examples: list[tuple]) -> list[str]:
+    return [
+        text.replace(form, f"{{{{c1::{form}}}}}")
+        for form, texts in examples
+        for text in texts
+    ]
+
+
+def matcher_alternatives(examples: list[tuple]) -> list[str]:
+    # one matcher for the page, each distinct sentence is scanned once for every key word
+    matcher = ClozeMatcher(form for form, _ in examples)
+    found = {}
+    clozes = []
+    for form, texts in examples:
+        for text in texts:
+            matches = found.get(text)
+            if matches is None:
+                matches = found[text] = matcher.find(text)
+            clozes.append(matcher.cloze(text, {form: 1}, matches))
+    return clozes
+
+
+def card_forms(key_words: list[tuple], lemma_container) -> list[str]:
+    forms = []
+    for kw, _ in key_words:
+        example = lemma_container.card_example(kw)
+        if example is not None:
+            forms.append(example[0])
+    return forms
+
+
+def replace_page(forms: list[str], texts: list[str]) -> list[str]:
+    clozed = []
+    for text in texts:
+        for number, form in enumerate(forms, 1):
+            text = text.replace(form, f"{{{{c{number}::{form}}}}}")
+        clozed.append(text)
+    return clozed
+
+
+def matcher_page(forms: list[str], texts: list[str]) -> list[str]:
+    matcher = ClozeMatcher(forms)
+    numbers = {form: number for number, form in enumerate(forms, 1)}
+    return [matcher.cloze(text, numbers) for text in texts]
+
+
+def book_cards(pages_key_words: list[list], lemma_container, max_clozes=1) -> list[dict]:
+    matcher = card_matcher((kw for key_words in pages_key_words for kw in key_words), lemma_container)
+    return [
+        card
+        for key_words in pages_key_words
+        for card in to_anki_cards(key_words, lemma_container, max_clozes=max_clozes, matcher=matcher)
+    ]
+
+
+def best_time(function, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--alternatives", type=int, default=10)
+    parser.add_argument("--record", action="store_true", help="fetch missing responses from the live NLP API")
+    args = parser.parse_args()
+
+    chunks = extract_text_from_epub(
+        book_path(args.scale), page_chunk_size=8, engine="stream"
+    )
+    page_sentences = page_sentences_from_results(chunks, nlp_results(chunks, args.record))
+    lemma_container = LemmaContainer()
+    lemma_container.sentences_to_lemmas(flatten_page_sentences(page_sentences))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        # the book stop words are written to ./stopwords
+        os.chdir(work_dir)
+        try:
+            pages = sentences_to_pages(
+                page_sentences,
+                stopword_store=StopwordStore(save_path="bench.txt", load_all_in_dir=False),
+                translate=False,
+                key_word_engine="tfidf",
+            )
+        finally:
+            os.chdir(cwd)
+    pages_key_words = [[(kw, kw) for kw in page._key_words] for page in pages]
+    pages_examples = [
+        example_sentences(key_words, lemma_container, args.alternatives)
+        for key_words in pages_key_words
+    ]
+    pages_texts = [
+        (card_forms(key_words, lemma_container), [sentence.text for sentence in page.sentences])
+        for key_words, page in zip(pages_key_words, pages)
+    ]
+    book_forms = list(dict.fromkeys(form for forms, _ in pages_texts for form in forms))
+    book_texts = [text for _, texts in pages_texts for text in texts]
+
+    runs = {
+        "cards, replace": lambda: [
+            card for key_words in pages_key_words for card in replace_cards(key_words, lemma_container)
+        ],
+        "cards, page matcher": lambda: [
+            card for key_words in pages_key_words for card in to_anki_cards(key_words, lemma_container)
+        ],
+        "cards, book matcher": lambda: book_cards(pages_key_words, lemma_container),
+        "cards, book matcher, 3": lambda: book_cards(pages_key_words, lemma_container, max_clozes=3),
+        "alternatives, replace": lambda: [
+            cloze for examples in pages_examples for cloze in replace_alternatives(examples)
+        ],
+        "alternatives, matcher": lambda: [
+            cloze for examples in pages_examples for cloze in matcher_alternatives(examples)
+        ],
+        "page sentences, replace": lambda: [
+            text for forms, texts in pages_texts for text in replace_page(forms, texts)
+        ],
+        "page sentences, matcher": lambda: [
+            text for forms, texts in pages_texts for text in matcher_page(forms, texts)
+        ],
+        "book sentences, replace": lambda: replace_page(book_forms, book_texts),
+        "book sentences, matcher": lambda: matcher_page(book_forms, book_texts),
+    }
+
+    clozes = sum(len(texts) for examples in pages_examples for _, texts in examples)
+    print(f"{args.scale}x book, {len(pages)} pages, {clozes} alternative example sentences")
+    print(f"{'':>26}{'seconds':>10}{'items':>8}{'inside a word':>15}")
+    for name, function in runs.items():
+        seconds, result = best_time(function, args.repeat)
+        texts = [item["cloze_string"] if isinstance(item, dict) else item for item in result]
+        inside = sum(1 for text in texts if _INSIDE_WORD.search(text))
+        print(f"{name:>26}{seconds:10.4f}{len(texts):8}{inside:15}")
@@ -0,0 +1,114 @@
+"""
+Checks the "stream" html to text engine gives the same text as "bs4" and times both.
+
+Usage:
+    python benchmarks/html_extraction.py [book.epub ...]
+
+Without EPUBs a synthetic book of Calibre style chapters is used. EDGE_CHAPTERS, markup whose strings get_text
+leaves out or keeps as they are, are always checked too. Raises AssertionError if any chapter's text differs.
+"""
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from ebooklib import epub
+
+sys.path.insert(0, ".")
+
+from ComprehensibleLatvian.epub import _is_chapter, html_to_text  # noqa: E402
+
+WORDS = (
+    "māja koks suns kaķis upe kalns mežs pilsēta skola grāmata galds logs durvis ceļš zeme "
+    "debess saule mēness zvaigzne jūra ezers lauks dārzs puķe ābols maize piens ūdens vējš"
+).split()
+
+# strings in script, style, template, rt and rp are left out by get_text since beautifulsoup4 4.10
+EDGE_CHAPTERS = (
+    "<html><head><style>p { margin: 0 }</style><script>var a = '<p>x</p>';</script></head>"
+    "<body><p>Suns</p><script type='text/javascript'>alert(1)</script></body></html>",
+    "<html><body><template><p>veidne</p></template><p>teksts</p></body></html>",
+    "<html><body><p><ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby> vārds</p></body></html>",
+    "<html><body><svg><style>.a{}</style><text>svg</text></svg><p>x<script>y</script>z</p></body></html>",
+    "<html><body><pre>  a\n   b  </pre><p>  </p><textarea>  </textarea>"
+    "<p>x&nbsp;y &amp; &#8222;z&#8220; &#x41; &notanentity;</p></body></html>",
+    "<?xml version='1.0' encoding='utf-8'?>\n<html><body><!-- c --><![CDATA[cdata]]>"
+    "<p>māja<br/>koks</p><style/><p>pēc</p></body></html>",
+)
+
+
+def make_chapter(rnd: random.Random, paragraphs: int) -> bytes:
+    # xhtml like Calibre writes it, with the markup the engines have to agree on
+    parts = [
+        "<?xml version='1.0' encoding='utf-8'?>\n",
+        "<html xmlns=\"http://www.w3.org/1999/xhtml\">\n  <head>\n",
+        "    <title>Nodaļa</title>\n",
+        '    <link href="stylesheet.css" rel="stylesheet" type="text/css"/>\n',
+        "    <style>p { margin: 0 }</style>\n  </head>\n  <body class=\"calibre\">\n",
+        "<!-- chapter -->\n<h1 class=\"calibre1\">Nodaļa&nbsp;1</h1>\n",
+    ]
+    for _ in range(paragraphs):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(20, 80))]
+        for i in range(0, len(words), 9):
+            words[i] = rnd.choice(
+                [
+                    f"<em>{words[i]}</em>",
+                    f'<span class="calibre2">{words[i]}</span>',
+                    f"{words[i]} &mdash;",
+                    f"&#8222;{words[i]}&#8220;",
+                    f"{words[i]}<br/>",
+                ]
+            )
+        parts.append(f'<p class="calibre3">{" ".join(words).capitalize()}.</p>\n')
+    parts.append('<div class="image"><img src="image.jpg" alt=""/></div>\n  </body>\n</html>\n')
+    return "".join(parts).encode("utf-8")
+
+
+def book_chapters(paths: list[str]) -> list[bytes]:
+    if not paths:
+        rnd = random.Random(0)
+        return [make_chapter(rnd, 150) for _ in range(60)]
+    return [
+        item.get_content()
+        for path in paths
+        for item in epub.read_epub(path).items
+        if _is_chapter(item)
+    ]
+
+
+def check_same_text(texts: list[str], *other_texts: list[str]) -> None:
+    different = [i for i, text in enumerate(texts) if any(other[i] != text for other in other_texts)]
+    assert not different, f"text differs for chapters {different}"
+
+
+def timed(label: str, extract) -> list[str]:
+    start = time.perf_counter()
+    texts = extract()
+    print(f"{label:<24}{time.perf_counter() - start:8.3f} s")
+    return texts
+
+
+if __name__ == "__main__":
+    edge_chapters = [chapter.encode("utf-8") for chapter in EDGE_CHAPTERS]
+    check_same_text(
+        [html_to_text(c, "bs4") for c in edge_chapters],
+        [html_to_text(c, "stream") for c in edge_chapters],
+    )
+
+    chapters = book_chapters(sys.argv[1:])
+    size = sum(len(chapter) for chapter in chapters) / 1024 / 1024
+    print(f"{len(chapters)} chapters, {size:.1f} MB of html")
+
+    bs4_texts = timed("bs4", lambda: [html_to_text(c, "bs4") for c in chapters])
+    stream_texts = timed("stream", lambda: [html_to_text(c, "stream") for c in chapters])
+    with ProcessPoolExecutor() as executor:
+        pool_texts = timed(
+            "stream, process pool",
+            lambda: list(
+                executor.map(html_to_text, chapters, repeat("stream"), chunksize=4)
+            ),
+        )
+
+    check_same_text(bs4_texts, stream_texts, pool_texts)
+    print(f"same text for every chapter and the {len(edge_chapters)} edge chapters")
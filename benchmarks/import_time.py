@@ -0,0 +1,77 @@
+"""
+Checks that importing the package stays fast and loads no heavy dependency until it is used.
+
+Usage:
+    python benchmarks/import_time.py [--budget 250] [--repeat 5]
+
+Each module is imported in a fresh interpreter with -X importtime. Exits with 1 if a module imports one of
+HEAVY_DEPENDENCIES or its best import time over the repeats is over --budget milliseconds.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = (
+    "ComprehensibleLatvian.anki",
+    "ComprehensibleLatvian.book_file",
+    "ComprehensibleLatvian.cache",
+    "ComprehensibleLatvian.cloze",
+    "ComprehensibleLatvian.epub",
+    "ComprehensibleLatvian.incremental",
+    "ComprehensibleLatvian.instrumentation",
+    "ComprehensibleLatvian.library",
+    "ComprehensibleLatvian.local_nlp",
+    "ComprehensibleLatvian.nlp_client",
+    "ComprehensibleLatvian.page_objects",
+    "ComprehensibleLatvian.pipeline",
+    "ComprehensibleLatvian.token_store",
+    "ComprehensibleLatvian.translation",
+)
+# only imported once the feature that needs them is used
+HEAVY_DEPENDENCIES = ("aiohttp", "bs4", "ebooklib", "googletrans", "lxml", "numpy", "yake")
+
+_PROBE = """
+import json, sys
+import {module}
+print(json.dumps(sorted(name for name in {heavy!r} if name in sys.modules)))
+"""
+
+
+def import_module(module: str) -> tuple[float, list[str]]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY_DEPENDENCIES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    microseconds = None
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            microseconds = int(parts[1])
+    return microseconds / 1000, json.loads(process.stdout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--budget", type=float, default=250.0, help="milliseconds per module")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':>40}{'ms':>10}  heavy dependencies")
+    for module in MODULES:
+        runs = [import_module(module) for _ in range(args.repeat)]
+        milliseconds = min(ms for ms, _ in runs)
+        heavy = runs[0][1]
+        flag = ""
+        if heavy or milliseconds > args.budget:
+            flag = "  over budget"
+            failures.append(module)
+        print(f"{module:>40}{milliseconds:10.1f}  {', '.join(heavy) or '-'}{flag}")
+
+    if failures:
+        print(f"\nover the import budget: {', '.join(failures)}")
+        sys.exit(1)
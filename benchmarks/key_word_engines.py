@@ -0,0 +1,79 @@
+"""
+Compares the YAKE and TF-IDF key word engines on a synthetic book.
+
+Usage:
+    python benchmarks/key_word_engines.py [--scale 10] [--repeat 3]
+
+Uses the same books and NLP fixtures as pipeline_stages.py. Prints the best wall time of each engine over the
+repeats, the time per page and how many of the TF-IDF key words YAKE also picks for the page.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, ".")
+
+from pipeline_stages import book_path, nlp_results  # noqa: E402
+
+from ComprehensibleLatvian.epub import extract_text_from_epub  # noqa: E402
+from ComprehensibleLatvian.page_objects import (  # noqa: E402
+    StopwordStore,
+    page_sentences_from_results,
+    sentences_to_pages,
+)
+
+
+def time_engine(page_sentences: list[tuple], engine: str, repeat: int):
+    best = None
+    for i in range(repeat):
+        # a new file each run, the stop words written by an earlier run would hide its key words
+        stopword_store = StopwordStore(
+            save_path=f"bench_{engine}_{i}.txt", load_all_in_dir=False
+        )
+        start = time.perf_counter()
+        pages = sentences_to_pages(
+            page_sentences,
+            stopword_store=stopword_store,
+            translate=False,
+            key_word_engine=engine,
+        )
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, pages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--record", action="store_true", help="fetch missing responses from the live NLP API")
+    args = parser.parse_args()
+
+    chunks = extract_text_from_epub(
+        book_path(args.scale), page_chunk_size=8, engine="stream"
+    )
+    page_sentences = page_sentences_from_results(chunks, nlp_results(chunks, args.record))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        # the book stop words are written to ./stopwords
+        os.chdir(work_dir)
+        try:
+            times = {}
+            key_words = {}
+            for engine in ("yake", "tfidf"):
+                times[engine], pages = time_engine(page_sentences, engine, args.repeat)
+                key_words[engine] = [set(page._key_words) for page in pages]
+        finally:
+            os.chdir(cwd)
+
+    page_count = len(key_words["yake"])
+    print(f"{args.scale}x book, {page_count} pages")
+    for engine, seconds in times.items():
+        print(f"{engine:>8}{seconds:10.3f}s{seconds / page_count * 1000:10.2f}ms/page")
+    print(f"tfidf is {times['yake'] / times['tfidf']:.0f}x faster")
+    shared = sum(len(y & t) for y, t in zip(key_words["yake"], key_words["tfidf"]))
+    total = sum(len(t) for t in key_words["tfidf"])
+    print(f"{shared} of {total} tfidf key words are also yake key words of the page")
@@ -0,0 +1,196 @@
+"""
+Times each stage of the pipeline on synthetic books with recorded NLP responses, and compares with a baseline.
+
+Usage:
+    python benchmarks/pipeline_stages.py [--scales 1,10,100] [--repeat 3] [--save-baseline] [--record]
+
+Books are generated into benchmarks/data and the NLP responses are replayed from benchmarks/fixtures, a
+ResponseCache directory. Responses missing from the fixtures are made by synthetic.analyse and saved, with
+--record they are fetched from the live NLP API instead. Nothing else uses the network, key words are
+"translated" to themselves.
+
+Each stage's best wall time of the repeats is compared with benchmarks/baseline.json, exits with 1 if a stage
+is more than --threshold times slower, stages under 50ms are too noisy to count.
+--save-baseline writes the times as the new baseline instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+
+sys.path.insert(0, ".")
+
+from synthetic import analyse, make_book  # noqa: E402
+
+from ComprehensibleLatvian.anki import to_anki_cards  # noqa: E402
+from ComprehensibleLatvian.cache import ResponseCache, make_cache_key  # noqa: E402
+from ComprehensibleLatvian.epub import (  # noqa: E402
+    construct_epub,
+    extract_text_from_epub,
+    open_epub,
+    request_nlp_api,
+)
+from ComprehensibleLatvian.instrumentation import Instrumentation, stage  # noqa: E402
+from ComprehensibleLatvian.page_objects import (  # noqa: E402
+    LemmaContainer,
+    StopwordStore,
+    flatten_page_sentences,
+    page_sentences_from_results,
+    sentences_to_pages,
+)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCHMARK_DIR, "data")
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+NLP_STEPS = ["tokenizer", "morpho", "ner"]
+# the stages reported, Instrumentation stage names
+STAGES = (
+    "epub_extraction",
+    "sentence_construction",
+    "sentences_to_lemmas",
+    "sentences_to_pages",
+    "yake",
+    "anki_cards",
+    "construct_epub",
+)
+
+
+def book_path(scale: int) -> str:
+    path = os.path.join(DATA_DIR, f"synthetic_{scale}x.epub")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        make_book(path, scale=scale)
+    return path
+
+
+def nlp_results(chunks: list[str], record: bool) -> list[dict]:
+    fixtures = ResponseCache(FIXTURE_DIR, max_bytes=1 << 40)
+    if record:
+        return asyncio.run(request_nlp_api(chunks, cache=fixtures))
+
+    results = []
+    for chunk in chunks:
+        key = make_cache_key(chunk, NLP_STEPS)
+        result = fixtures.get(key)
+        if result is None:
+            result = analyse(chunk)
+            fixtures.set(key, result)
+        results.append(result)
+    return results
+
+
+def run_stages(
+    epub_path: str, chunks: list, results: list[dict], work_dir: str, run_number: int
+) -> dict:
+    with Instrumentation() as run:
+        book = open_epub(epub_path)
+        extract_text_from_epub(book, page_chunk_size=8, engine="stream")
+
+        page_sentences = page_sentences_from_results(chunks, results)
+        lemma_container = LemmaContainer()
+        lemma_container.sentences_to_lemmas(flatten_page_sentences(page_sentences))
+
+        with stage("sentences_to_pages") as timed:
+            pages = sentences_to_pages(
+                page_sentences,
+                # a new file each run, the stop words written by an earlier run would hide its key words
+                stopword_store=StopwordStore(
+                    save_path=f"bench_{run_number}.txt", load_all_in_dir=False
+                ),
+                translate=False,
+            )
+            timed.add(items=len(pages))
+
+        for page in pages:
+            page.set_translations({word: word for word in page._key_words})
+        for page in pages:
+            to_anki_cards(page.key_words, lemma_container)
+
+        construct_epub(book, pages, os.path.join(work_dir, "keywords.epub"))
+
+    stages = run.report()["stages"]
+    return {name: stages[name]["wall_seconds"] for name in STAGES if name in stages}
+
+
+def benchmark(scale: int, repeat: int, record: bool) -> dict:
+    epub_path = book_path(scale)
+    chunks = extract_text_from_epub(epub_path, page_chunk_size=8, engine="stream")
+    results = nlp_results(chunks, record)
+
+    best = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        # the book stop words are written to ./stopwords
+        os.chdir(work_dir)
+        try:
+            for run_number in range(repeat):
+                times = run_stages(epub_path, chunks, results, work_dir, run_number)
+                for name, seconds in times.items():
+                    best[name] = min(seconds, best.get(name, seconds))
+        finally:
+            os.chdir(cwd)
+    return best
+
+
+def compare(
+    scale: int, times: dict, baseline: dict, threshold: float, min_seconds=0.05
+) -> list[str]:
+    regressions = []
+    print(f"\n{scale}x{'stage':>22}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for name, seconds in times.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:>24}{'-':>12}{seconds:12.3f}")
+            continue
+        ratio = seconds / before if before else float("inf")
+        flag = ""
+        # stages of a few milliseconds are mostly noise
+        if ratio > threshold and seconds >= min_seconds:
+            flag = "  slower"
+            regressions.append(f"{scale}x {name}")
+        print(f"{name:>24}{before:12.3f}{seconds:12.3f}{ratio:8.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scales", default="1,10", help="book sizes, e.g. 1,10,100")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--record", action="store_true", help="fetch missing responses from the live NLP API")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    times = {str(scale): benchmark(scale, args.repeat, args.record) for scale in scales}
+
+    if args.save_baseline:
+        baseline = {"machine": platform.platform(), "python": platform.python_version()}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding="utf8") as f:
+                baseline = json.load(f) | baseline
+        baseline.setdefault("scales", {}).update(times)
+        with open(BASELINE_PATH, "w", encoding="utf8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline of {', '.join(f'{s}x' for s in times)} saved to {BASELINE_PATH}")
+        for scale, scale_times in times.items():
+            compare(scale, scale_times, scale_times, args.threshold)
+        sys.exit(0)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf8") as f:
+            baseline = json.load(f)
+    regressions = []
+    for scale, scale_times in times.items():
+        regressions += compare(
+            scale, scale_times, baseline.get("scales", {}).get(scale, {}), args.threshold
+        )
+    if regressions:
+        print(f"\nslower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,109 @@
+"""
+Memory used by the Sentence objects of a synthetic book, before and after the TokenStore.
+
+Usage:
+    python benchmarks/sentence_memory.py [number of sentences]
+"""
+import gc
+import itertools
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, ".")
+
+from ComprehensibleLatvian.page_objects import LemmaContainer, Sentence  # noqa: E402
+from ComprehensibleLatvian.token_store import TokenStore  # noqa: E402
+
+
+class LegacySentence:
+    # the Sentence from before the TokenStore, keeps the api dict and copies of the text
+    def __init__(self, sentence: dict):
+        self.sentence = sentence
+        self.ner = sentence["ner"]
+        self.tokens = sentence["tokens"]
+        self.lemma_form = [
+            (token["lemma"], token["form"].lower()) for token in self.tokens
+        ]
+        self.text = " ".join(token["form"] for token in self.tokens)
+        self.lemma_text = " ".join(token["lemma"].lower() for token in self.tokens)
+        self.stop_words = set(
+            itertools.chain.from_iterable(
+                [ne["text"].lower().split(" ") for ne in sentence["ner"]]
+            )
+        )
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+def make_results(sentence_count: int, seed=0) -> list[dict]:
+    # api shaped sentences, the token dicts have the same keys the api returns
+    rnd = random.Random(seed)
+    syllables = "ka ma ra ta la na sa pa va da ga ze ri lo mu ne si tu ā ē ī ū".split()
+    vocab = [
+        "".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4)))
+        for _ in range(20000)
+    ]
+
+    sentences = []
+    for _ in range(sentence_count):
+        tokens = []
+        for i in range(rnd.randint(5, 25)):
+            lemma = vocab[min(len(vocab) - 1, int(rnd.paretovariate(1.1)) - 1)]
+            form = lemma + rnd.choice(["", "s", "a", "u", "ai", "iem"])
+            tokens.append(
+                {
+                    "index": i + 1,
+                    "form": form,
+                    "lemma": lemma,
+                    "pos": "n",
+                    "tag": "ncmsn1",
+                    "ufeats": "Case=Nom|Gender=Masc|Number=Sing",
+                }
+            )
+        tokens.append({"index": len(tokens) + 1, "form": ".", "lemma": ".", "pos": "z", "tag": "zs", "ufeats": ""})
+        ner = [{"text": tokens[0]["form"], "label": "person", "start": 0, "end": 1}] if rnd.random() < 0.1 else []
+        sentences.append({"tokens": tokens, "ner": ner})
+    return [{"sentences": sentences}]
+
+
+def measure(build) -> float:
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current / 1024 / 1024
+
+
+def build_legacy(sentence_count):
+    results = make_results(sentence_count)
+    sentences = [LegacySentence(s) for result in results for s in result["sentences"]]
+    lemma_container = LemmaContainer()
+    lemma_container.sentences_to_lemmas(sentences)
+    return sentences, lemma_container
+
+
+def build_token_store(sentence_count):
+    results = make_results(sentence_count)
+    store = TokenStore()
+    sentences = [Sentence(s, store) for result in results for s in result["sentences"]]
+    del results
+    lemma_container = LemmaContainer()
+    lemma_container.sentences_to_lemmas(sentences)
+    return sentences, lemma_container
+
+
+if __name__ == "__main__":
+    sentence_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    before = measure(lambda: build_legacy(sentence_count))
+    after = measure(lambda: build_token_store(sentence_count))
+
+    print(f"{sentence_count} sentences with their LemmaContainer")
+    print(f"before (api dicts kept): {before:8.1f} MB")
+    print(f"after (TokenStore):      {after:8.1f} MB")
+    print(f"reduction:               {before / after:8.1f}x")
@@ -0,0 +1,143 @@
+"""
+Synthetic Latvian-like EPUBs and an offline stand-in for the NLP API, for the benchmarks.
+
+The books are made from a Zipf distributed vocabulary of stems with Latvian endings and a few recurring names,
+so pages have repeated lemmas, several forms of each and named entities, like a novel does.
+analyse returns the same shape of result as request_nlp_api.
+"""
+import random
+import re
+
+from ebooklib import epub
+
+SYLLABLES = "ka ma ra ta la na sa pa va da ga ba ze ri lo mu ne si tu je ķe ļa ņu šo ža kā mē rī tū".split()
+# noun and verb endings, the analyser strips them to find the lemma
+ENDINGS = ("s", "a", "u", "am", "ai", "as", "iem", "ām", "us", "ei", "ot", "ēja", "ēt")
+NAMES = "Harijs Rons Hermione Dumbldors Hagrids Snegs Dadlijs Petūnija Vernons Malfojs".split()
+PUNCTUATION = (".", ".", ".", "!", "?")
+
+# chapters of the 1x book, the scale multiplies the number of chapters
+CHAPTERS_PER_SCALE = 12
+PARAGRAPHS_PER_CHAPTER = 30
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def make_vocabulary(rnd: random.Random, size=6000) -> list[str]:
+    stems = {
+        "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3)))
+        for _ in range(size)
+    }
+    return sorted(stems)
+
+
+def _word(rnd: random.Random, vocabulary: list[str]) -> str:
+    stem = vocabulary[min(len(vocabulary) - 1, int(rnd.paretovariate(1.0)) - 1)]
+    if rnd.random() < 0.3:
+        stem = rnd.choice(vocabulary)
+    return stem + rnd.choice(ENDINGS)
+
+
+def make_sentence(rnd: random.Random, vocabulary: list[str]) -> str:
+    words = [_word(rnd, vocabulary) for _ in range(rnd.randint(5, 18))]
+    if rnd.random() < 0.3:
+        words.insert(rnd.randrange(len(words)), rnd.choice(NAMES))
+    if len(words) > 8 and rnd.random() < 0.4:
+        words[rnd.randrange(2, len(words) - 1)] += ","
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rnd.choice(PUNCTUATION)
+
+
+def make_chapter(rnd: random.Random, vocabulary: list[str], number: int) -> str:
+    # xhtml like Calibre writes it
+    paragraphs = []
+    for _ in range(PARAGRAPHS_PER_CHAPTER):
+        sentences = [make_sentence(rnd, vocabulary) for _ in range(rnd.randint(2, 6))]
+        paragraphs.append(f'<p class="calibre3">{" ".join(sentences)}</p>')
+    return (
+        f'<h1 class="calibre1">{number}. nodaļa</h1>\n' + "\n".join(paragraphs) + "\n"
+    )
+
+
+def make_book(path: str, scale=1, seed=0) -> str:
+    """
+    Writes a synthetic book.
+
+    Args:
+        path (str): Path of the EPUB.
+        scale (int, optional): Size of the book, a 1x book has CHAPTERS_PER_SCALE chapters. Defaults to 1.
+        seed (int, optional): Seed of the text, the same seed and scale always give the same book. Defaults to 0.
+
+    Returns:
+        str: path
+    """
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(rnd)
+
+    book = epub.EpubBook()
+    book.set_identifier(f"synthetic-{scale}-{seed}")
+    book.set_title(f"Sintētiska grāmata {scale}x")
+    book.set_language("lv")
+    book.set_cover("cover.jpg", b"\xff\xd8\xff\xe0")
+
+    chapters = []
+    for number in range(1, scale * CHAPTERS_PER_SCALE + 1):
+        chapter = epub.EpubHtml(
+            title=f"{number}. nodaļa", file_name=f"chapter_{number}.xhtml", lang="lv"
+        )
+        chapter.content = make_chapter(rnd, vocabulary, number)
+        book.add_item(chapter)
+        chapters.append(chapter)
+
+    book.toc = chapters
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav"] + chapters
+    epub.write_epub(path, book)
+    return path
+
+
+def _lemma(form: str) -> str:
+    if form in NAMES or not form[0].isalnum():
+        return form
+    word = form.lower()
+    for ending in sorted(ENDINGS, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)] + "s"
+    return word
+
+
+def analyse(text: str) -> dict:
+    """
+    Tokenizes, lemmatizes and tags named entities the way the NLP API would, without the API.
+
+    Args:
+        text (str): The text of a request.
+
+    Returns:
+        dict: Result with the same keys as the NLP API's, a list of sentences of tokens and ner.
+    """
+    sentences = []
+    for sentence_text in _SENTENCE_END.split(text):
+        forms = _TOKEN.findall(sentence_text)
+        if not forms:
+            continue
+        tokens = [
+            {
+                "index": i + 1,
+                "form": form,
+                "lemma": _lemma(form),
+                "pos": "n" if form[0].isalnum() else "z",
+                "tag": "ncmsn1" if form[0].isalnum() else "zs",
+                "ufeats": "Case=Nom|Gender=Masc|Number=Sing" if form[0].isalnum() else "",
+            }
+            for i, form in enumerate(forms)
+        ]
+        ner = [
+            {"text": form, "label": "person", "start": i, "end": i + 1}
+            for i, form in enumerate(forms)
+            if form in NAMES
+        ]
+        sentences.append({"tokens": tokens, "ner": ner})
+    return {"sentences": sentences}
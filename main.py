@@ -1,44 +1,79 @@
-from ComprehensibleLatvian.anki import *
-from ComprehensibleLatvian.epub import *
-from ComprehensibleLatvian.page_objects import *
+import asyncio
+import logging
+import os
+
+from ComprehensibleLatvian.anki import make_deck_id, to_anki_cards, write_apkg
+from ComprehensibleLatvian.book_file import save_book
+from ComprehensibleLatvian.cache import ResponseCache
+from ComprehensibleLatvian.epub import open_epub
+from ComprehensibleLatvian.incremental import ChapterStore, process_epub_incrementally
+from ComprehensibleLatvian.instrumentation import Instrumentation
+from ComprehensibleLatvian.page_objects import LemmaContainer
+from ComprehensibleLatvian.translation import TranslationCache, translate_pages
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+
     # epub_file_path = r"C:\Users\small\Calibre Library\Duglass Adamss\Galaktikas celvedis stopetajiem-1 (65)\Galaktikas celvedis stopetajiem - Duglass Adamss.epub"
     epub_file_path = r"c:\Users\small\Calibre Library\Dzoanna Ketlina Roulinga\Harijs Poters un filozofu akmens (38)\Harijs Poters un filozofu akmen - Dzoanna Ketlina Roulinga.epub"
 
-    extracted_text = extract_text_from_epub(epub_file_path, page_chunk_size=8)
+    # time every stage of the run, the report shows where the time goes
+    with Instrumentation() as run:
+        lemma_container = LemmaContainer()
+        # responses are cached on disk so reruns with the same text don't hit the api again
+        nlp_cache = ResponseCache()
 
-    results = asyncio.run(request_nlp_api(extracted_text))
+        # the epub is parsed once and reused for the text and for writing the epub with keyword pages
+        book = open_epub(epub_file_path)
 
-    sentence_list = [
-        Sentence(sentence) for result in results for sentence in result["sentences"]
-    ]
+        # chapters are stored with a hash of their text so reruns only process the chapters that changed
+        with ChapterStore() as chapter_store:
+            pages = asyncio.run(
+                process_epub_incrementally(
+                    book,
+                    chapter_store,
+                    book_id=os.path.basename(epub_file_path),
+                    page_chunk_size=8,
+                    engine="stream",
+                    cache=nlp_cache,
+                    lemma_container=lemma_container,
+                )
+            )
 
-    lemma_container = LemmaContainer()
-    lemma_container.sentences_to_lemmas(sentence_list)
+        # translate every unique key word of the book at once, reruns reuse the cached translations
+        with TranslationCache() as translation_cache:
+            translate_pages(pages, cache=translation_cache)
 
-    pages = sentences_to_pages(sentence_list)
+        deck_id = make_deck_id(os.path.basename(epub_file_path))
 
-    anki_cards = [
-        card
-        for page in pages
-        for card in to_anki_cards(
-            key_words=page.key_words, lemma_container=lemma_container
+        # save the processed book so decks and epubs can be made again without redoing the nlp,
+        # python -m ComprehensibleLatvian.anki deck.apkg hp_book.clvb makes the deck again
+        save_book(
+            "hp_book.clvb",
+            pages,
+            lemma_container,
+            meta={"epub_file_path": epub_file_path, "deck_id": deck_id},
         )
-    ]
-
-    with open("hp_anki_cards2.json", "w", encoding="utf8") as f:
-        json.dump(
-            {
-                "deck_id": int(datetime.now().strftime("%Y%m%d%H%M%S")),
-                "anki_cards": anki_cards,
-            },
-            f,
-            indent=2,
+
+        # the cards are streamed into the deck page by page
+        write_apkg(
+            "hp_anki_cards.apkg",
+            [
+                {
+                    "deck_id": deck_id,
+                    "name": "Harijs Poters un filozofu akmens",
+                    "anki_cards": (
+                        card
+                        for page in pages
+                        for card in to_anki_cards(
+                            key_words=page.key_words, lemma_container=lemma_container
+                        )
+                    ),
+                }
+            ],
         )
 
-    # # reconstruct output
-    # construct_epub(epub_file_path, pages, "test2.epub")
+        # # reconstruct output
+        # construct_epub(book, pages, "test2.epub")
 
-# todo  add create_anki_pkg function
-# todo make objects serializable and save lemma container as output
+    run.write_report("hp_run_report.json")